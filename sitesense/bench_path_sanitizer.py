@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del middleware di sanificazione dei percorsi.
+
+Confronta, per richiesta, il vecchio middleware ``@app.middleware("http")``
+(BaseHTTPMiddleware + str.replace/re.sub a ogni chiamata) con
+``SanitizePathMiddleware`` (ASGI puro), chiamando direttamente l'app ASGI
+senza server né rete. Ogni misura è il tempo medio per richiesta, al netto
+dell'app senza middleware.
+
+Uso (dalla cartella che contiene ``sitesense``):
+    python -m sitesense.bench_path_sanitizer [numero_richieste]
+"""
+
+import asyncio
+import re
+import sys
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, RedirectResponse
+
+from sitesense.services.path_sanitizer import SanitizePathMiddleware, sanitize_path
+
+BYPASS = ("/static/", "/assets/", "/chi_siamo_design/")
+PATHS = {
+    "pagina pulita": "/area_riservata",
+    "asset statico": "/static/script.js",
+    "percorso sporco": '/dashboard/%22profile.html%22/',
+}
+
+
+def _old_sanitize(path: str) -> str:
+    sanitized = path.replace('%22', '').replace('"', '').replace("'", '')
+    sanitized = re.sub(r"/+", "/", sanitized)
+    return re.sub(r"(\.html)/+$", r"\1", sanitized)
+
+
+def _build_app(mode: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/{rest:path}")
+    async def _endpoint(rest: str):
+        return PlainTextResponse("ok")
+
+    if mode == "vecchio":
+        @app.middleware("http")
+        async def _sanitize_path_middleware(request, call_next):
+            path = request.url.path
+            if path.startswith("/dashboard/api_current_user") or path.startswith("/api/area_riservata/api_current_user"):
+                q = request.url.query
+                url = "/api_current_user" if not q else f"/api_current_user?{q}"
+                return RedirectResponse(url=url, status_code=307)
+            sanitized = _old_sanitize(path)
+            if sanitized != path:
+                q = request.url.query
+                url = sanitized if not q else f"{sanitized}?{q}"
+                return RedirectResponse(url=url, status_code=307)
+            return await call_next(request)
+    elif mode == "asgi":
+        app.add_middleware(SanitizePathMiddleware, bypass_prefixes=BYPASS)
+    return app
+
+
+async def _run(app, path: str, n: int) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1234), "server": ("localhost", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(min(n, 200)):
+        await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+async def main(n: int):
+    apps = {mode: _build_app(mode) for mode in ("nessuno", "vecchio", "asgi")}
+    print(f"{n} richieste per misura, microsecondi per richiesta (overhead = differenza con 'nessuno')")
+    for label, path in PATHS.items():
+        base = await _run(apps["nessuno"], path, n)
+        old = await _run(apps["vecchio"], path, n)
+        new = await _run(apps["asgi"], path, n)
+        print(f"- {label:16} {path!r}")
+        print(f"    nessuno {base:8.1f}   vecchio {old:8.1f} (+{old - base:.1f})   asgi {new:8.1f} (+{new - base:.1f})")
+
+    # Solo il controllo sul percorso, senza richiesta
+    for label, path in PATHS.items():
+        loops = n * 20
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            _old_sanitize(path)
+        t1 = time.perf_counter()
+        for _ in range(loops):
+            sanitize_path(path)
+        t2 = time.perf_counter()
+        print(f"- controllo {label:16} vecchio {(t1 - t0) / loops * 1e9:7.0f} ns   nuovo {(t2 - t1) / loops * 1e9:7.0f} ns")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
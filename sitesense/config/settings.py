@@ -4,6 +4,15 @@ from dotenv import load_dotenv
 from typing import Optional
 from pathlib import Path
 
+def _env_int(name: str, default: int) -> int:
+    """Legge un intero positivo dall'ambiente, con fallback al default."""
+    try:
+        value = int(os.getenv(name, default))
+        return value if value > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
 class Settings:
     """Classe per gestire le configurazioni dell'applicazione"""
     
@@ -37,6 +46,45 @@ class Settings:
         self._unsplash_access_key: Optional[str] = os.getenv("UNSPLASH_ACCESS_KEY")
         self._pexels_api_key: Optional[str] = os.getenv("PEXELS_API_KEY")
         self._pixabay_api_key: Optional[str] = os.getenv("PIXABAY_API_KEY")
+        # Limite di chiamate concorrenti ai modelli Gemini per worker
+        self._gemini_max_concurrency: int = _env_int("GEMINI_MAX_CONCURRENCY", 16)
+        # Store delle sessioni di conversazione (per worker)
+        self._session_max_entries: int = _env_int("SESSION_MAX_ENTRIES", 1000)
+        self._session_ttl_seconds: int = _env_int("SESSION_TTL_SECONDS", 3600)
+        self._session_max_bytes: int = _env_int("SESSION_MAX_BYTES", 64 * 1024 * 1024)
+        # Client HTTP condiviso verso le API Google
+        self._http_max_connections: int = _env_int("HTTP_MAX_CONNECTIONS", 100)
+        self._http_max_keepalive: int = _env_int("HTTP_MAX_KEEPALIVE", 20)
+        self._http_max_per_host: int = _env_int("HTTP_MAX_PER_HOST", 20)
+        self._http_timeout_seconds: int = _env_int("HTTP_TIMEOUT_SECONDS", 15)
+        self._http_max_retries: int = _env_int("HTTP_MAX_RETRIES", 2)
+        # Chiamate Places contemporanee per singola ricerca
+        self._maps_max_concurrency: int = _env_int("MAPS_MAX_CONCURRENCY", 8)
+        # Cache dei risultati Places (LRU in memoria + SQLite opzionale)
+        self._places_cache_max_entries: int = _env_int("PLACES_CACHE_MAX_ENTRIES", 5000)
+        self._places_cache_db: Optional[str] = os.getenv("PLACES_CACHE_DB") or None
+        # Connessioni MySQL nel pool di ciascun worker (massimo 32)
+        self._db_pool_size: int = _env_int("DB_POOL_SIZE", 10)
+        # Attesa massima su un lock InnoDB e soglia oltre cui una transazione viene segnalata nei log
+        self._db_lock_wait_seconds: int = _env_int("DB_LOCK_WAIT_SECONDS", 5)
+        self._db_slow_transaction_ms: int = _env_int("DB_SLOW_TRANSACTION_MS", 500)
+        # Cache in memoria degli URL immagine salvati in Initalya.photo
+        self._photo_cache_max_entries: int = _env_int("PHOTO_CACHE_MAX_ENTRIES", 5000)
+        self._photo_cache_ttl_seconds: int = _env_int("PHOTO_CACHE_TTL_SECONDS", 24 * 3600)
+        # Proxy immagini: cache su disco delle immagini servite (con varianti ridimensionate)
+        self._image_proxy_enabled: bool = os.getenv("IMAGE_PROXY_ENABLED", "true").lower() == "true"
+        self._image_cache_dir: str = os.getenv("IMAGE_CACHE_DIR") or str(Path(__file__).resolve().parents[1] / "assets" / "images_cache")
+        self._image_cache_max_mb: int = _env_int("IMAGE_CACHE_MAX_MB", 512)
+        # Preriscaldamento immagini dopo una ricerca: worker in background e lunghezza della coda
+        self._image_prefetch_workers: int = _env_int("IMAGE_PREFETCH_WORKERS", 4)
+        self._image_prefetch_queue_size: int = _env_int("IMAGE_PREFETCH_QUEUE_SIZE", 200)
+        # Ricaricamento dell'indice in memoria di Initalya.cities (città aggiunte da altri worker)
+        self._city_index_refresh_seconds: int = _env_int("CITY_INDEX_REFRESH_SECONDS", 300)
+        # Cache dei risultati completi della prima ricerca (0 voci = disattiva)
+        self._result_cache_max_entries: int = _env_int("RESULT_CACHE_MAX_ENTRIES", 200)
+        self._result_cache_ttl_seconds: int = _env_int("RESULT_CACHE_TTL_SECONDS", 6 * 3600)
+        # Contesto del chatbot: riassunto strutturato della pagina invece dell'HTML completo
+        self._chat_context_compact: bool = os.getenv("CHAT_CONTEXT_COMPACT", "true").lower() == "true"
         # Log non sensibili per diagnosi
         try:
             logger.info(f"Settings: GOOGLE_CLIENT_ID presente={bool(self._google_oauth_client_id)}; GOOGLE_CLIENT_SECRET presente={bool(self._google_oauth_client_secret)}")
@@ -109,6 +157,110 @@ class Settings:
     def gemini_model(self) -> Optional[str]:
         return self._gemini_model
 
+    @property
+    def gemini_max_concurrency(self) -> int:
+        return self._gemini_max_concurrency
+
+    @property
+    def session_max_entries(self) -> int:
+        return self._session_max_entries
+
+    @property
+    def session_ttl_seconds(self) -> int:
+        return self._session_ttl_seconds
+
+    @property
+    def session_max_bytes(self) -> int:
+        return self._session_max_bytes
+
+    @property
+    def http_max_connections(self) -> int:
+        return self._http_max_connections
+
+    @property
+    def http_max_keepalive(self) -> int:
+        return self._http_max_keepalive
+
+    @property
+    def http_max_per_host(self) -> int:
+        return self._http_max_per_host
+
+    @property
+    def http_timeout_seconds(self) -> int:
+        return self._http_timeout_seconds
+
+    @property
+    def http_max_retries(self) -> int:
+        return self._http_max_retries
+
+    @property
+    def maps_max_concurrency(self) -> int:
+        return self._maps_max_concurrency
+
+    @property
+    def places_cache_max_entries(self) -> int:
+        return self._places_cache_max_entries
+
+    @property
+    def places_cache_db(self) -> Optional[str]:
+        return self._places_cache_db
+
+    @property
+    def db_pool_size(self) -> int:
+        return self._db_pool_size
+
+    @property
+    def db_lock_wait_seconds(self) -> int:
+        return self._db_lock_wait_seconds
+
+    @property
+    def db_slow_transaction_ms(self) -> int:
+        return self._db_slow_transaction_ms
+
+    @property
+    def photo_cache_max_entries(self) -> int:
+        return self._photo_cache_max_entries
+
+    @property
+    def photo_cache_ttl_seconds(self) -> int:
+        return self._photo_cache_ttl_seconds
+
+    @property
+    def image_proxy_enabled(self) -> bool:
+        return self._image_proxy_enabled
+
+    @property
+    def image_cache_dir(self) -> str:
+        return self._image_cache_dir
+
+    @property
+    def image_cache_max_mb(self) -> int:
+        return self._image_cache_max_mb
+
+    @property
+    def image_prefetch_workers(self) -> int:
+        return self._image_prefetch_workers
+
+    @property
+    def image_prefetch_queue_size(self) -> int:
+        return self._image_prefetch_queue_size
+
+    @property
+    def city_index_refresh_seconds(self) -> int:
+        return self._city_index_refresh_seconds
+
+    @property
+    def result_cache_max_entries(self) -> int:
+        return self._result_cache_max_entries
+
+    @property
+    def result_cache_ttl_seconds(self) -> int:
+        return self._result_cache_ttl_seconds
+
+    @property
+    def chat_context_compact(self) -> bool:
+        return self._chat_context_compact
+
     @property
     def google_cse_api_key(self) -> str:
         if not self._google_cse_api_key:
@@ -4,6 +4,7 @@ from typing import Dict, List, Any, Optional
 from pydantic import BaseModel, Field
 from ..services import GeminiMapsService, GeminiService, AnalyzerService
 from ..services.filtering_ranking_service import FilteringRankingService
+from ..services.session_store import ConversationState
 
 logger = logging.getLogger(__name__)
 
@@ -28,8 +29,15 @@ class SearchController:
         self.gemini_service = GeminiService(self.maps_service, self.analyzer_service)
         logger.info("SearchController inizializzato con successo")
     
-    async def handle_chat_request_stream(self, chat_request: ChatRequest):
-        """Gestisce una richiesta di chat in modalità streaming."""
+    async def handle_chat_request_stream(self, chat_request: ChatRequest, session: Optional[ConversationState] = None, results_format: str = "html"):
+        """Gestisce una richiesta di chat in modalità streaming.
+
+        `session` contiene lo stato della conversazione del singolo utente; se
+        assente viene usato uno stato temporaneo per la sola richiesta.
+        `results_format` ("html" o "json") è il formato dei risultati classificati.
+        """
+        if session is None:
+            session = ConversationState("ephemeral")
         try:
             logger.info(f"Elaborazione richiesta chat (streaming): {chat_request.query}")
             
@@ -38,25 +46,27 @@ class SearchController:
            
 
             # In Programma di viaggio, chatMode deve essere sempre True
-            if getattr(self.gemini_service, "programMode", True):
-                self.gemini_service.chatMode = True
+            if session.programMode:
+                session.chatMode = True
                 logger.info("ProgramMode attivo: chatMode forzato a True")
             else:
                 # Reset della modalità chatbot per ogni nuova sessione
                 # Questo assicura che ogni prima richiesta esegua sempre la ricerca completa
                 if not chat_request.history or len(chat_request.history) == 0:
-                    self.gemini_service.chatMode = False
+                    session.chatMode = False
                     logger.info("Reset chatMode a False per nuova sessione")
                 # Reset aggiuntivo: se la history contiene solo un messaggio utente, è una nuova sessione
                 elif len(chat_request.history) == 1 and chat_request.history[0].get('role') == 'user':
-                    self.gemini_service.chatMode = False
+                    session.chatMode = False
                     logger.info("Reset chatMode a False - rilevata nuova sessione con un solo messaggio utente")
             
             # Usa il metodo di streaming del servizio Gemini
             async for chunk in self.gemini_service.chat_stream(
                 chat_request.query, 
                 chat_request.history,
-                skip_echo=chat_request.skip_echo
+                skip_echo=chat_request.skip_echo,
+                session=session,
+                results_format=results_format
             ):
                 yield chunk
             
@@ -72,9 +82,9 @@ class SearchController:
                     "vini": "enoteca vini",
                     "cucina tipica": "cucina tipica"
                 }
-                ranked_results = await frs.filter_rank_and_present(default_queries, {}, chat_request.query)
+                ranked_results = await frs.filter_rank_and_present(default_queries, {}, chat_request.query, results_format=results_format)
                 # Stream dei suggerimenti per compatibilità frontend
-                yield {"map_payload": {"tool_name": "search_google_maps", "tool_data": ranked_results}}
+                yield {"map_payload": {"tool_name": "search_google_maps", "tool_data": ranked_results, "format": results_format}}
                 # Messaggio informativo minimale per la parte contenuti
                 info_html = (
                     "<div class='travel-guide'><div class='intro'>"
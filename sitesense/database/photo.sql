@@ -3,7 +3,9 @@ CREATE TABLE photo(
     city_id INT NOT NULL,
     url VARCHAR(255) NOT NULL,
     titolo VARCHAR(255) NOT NULL,
+    dish_slug VARCHAR(191) NULL,
 
+    UNIQUE KEY uq_photo_dish_city (dish_slug, city_id),
     FOREIGN KEY (city_id) REFERENCES cities(id) ON DELETE CASCADE
 );
 
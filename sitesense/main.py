@@ -6,9 +6,12 @@ from fastapi.staticfiles import StaticFiles
 from .search_routes_oop import router as search_router
 from fastapi import Form
 from pathlib import Path
+from types import SimpleNamespace
 import re
 import importlib
-from .services.database import get_connection
+from .services import repository
+from .services.prepared_pages import page_response, prepared_pages
+from .services.path_sanitizer import SanitizePathMiddleware
 
 # Importa l'app OOP per poter delegare alcune route quando il server viene avviato con main.py
 try:
@@ -41,30 +44,15 @@ templates = Jinja2Templates(directory="templates")
 app.include_router(search_router)
 
 # Middleware globale per sanificare percorsi con virgolette (codificate o grezze)
-@app.middleware("http")
-async def _sanitize_path_middleware(request, call_next):
-    path = request.url.path
-    if path.startswith("/dashboard/api_current_user") or path.startswith("/api/area_riservata/api_current_user"):
-        q = request.url.query
-        url = "/api_current_user" if not q else f"/api_current_user?{q}"
-        return RedirectResponse(url=url, status_code=307)
-    sanitized = path.replace('%22', '').replace('"', '').replace("'", '')
-    sanitized = re.sub(r"/+", "/", sanitized)
-    sanitized = re.sub(r"(\.html)/+$", r"\1", sanitized)
-    if sanitized != path:
-        q = request.url.query
-        url = sanitized if not q else f"{sanitized}?{q}"
-        return RedirectResponse(url=url, status_code=307)
-    return await call_next(request)
+app.add_middleware(SanitizePathMiddleware, bypass_prefixes=("/static/", "/assets/", "/chi_siamo_design/"))
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.get("/chi_siamo", response_class=HTMLResponse)
-async def chi_siamo_page(request: Request):
-    base_dir = Path(__file__).resolve().parent
-    build_index = base_dir / "Chi Siamo Page Design 1" / "build" / "index.html"
+def _build_chi_siamo_page(build_index: Path, authenticated: bool) -> str:
+    # Il template legge dalla richiesta solo il cookie auth: una variante per stato di login
+    context = {"request": SimpleNamespace(cookies={"auth": "1"} if authenticated else {}), "design_head": "", "design_html": ""}
     if build_index.exists():
         html = build_index.read_text(encoding="utf-8")
         html = re.sub(r'(href|src)="/?assets/', r'\1="/chi_siamo_design/assets/', html)
@@ -75,10 +63,22 @@ async def chi_siamo_page(request: Request):
         html = re.sub(r"<section[^>]*>[\s\S]*?Scegli initalya[\s\S]*?</section>", "", html, flags=re.IGNORECASE)
         m_head = re.search(r"<head[^>]*>([\\s\\S]*?)</head>", html, flags=re.IGNORECASE)
         m_body = re.search(r"<body[^>]*>([\\s\\S]*?)</body>", html, flags=re.IGNORECASE)
-        head_inner = (m_head.group(1) if m_head else "")
-        body_inner = (m_body.group(1) if m_body else html)
-        return templates.TemplateResponse("chi_siamo.html", {"request": request, "design_head": head_inner, "design_html": body_inner})
-    return templates.TemplateResponse("chi_siamo.html", {"request": request, "design_head": "", "design_html": ""})
+        context["design_head"] = (m_head.group(1) if m_head else "")
+        context["design_html"] = (m_body.group(1) if m_body else html)
+    return templates.get_template("chi_siamo.html").render(context)
+
+@app.get("/chi_siamo", response_class=HTMLResponse)
+async def chi_siamo_page(request: Request):
+    # Riscritture e rimozione delle sezioni fatte una volta, ripetute solo se cambia il build o il template
+    base_dir = Path(__file__).resolve().parent
+    build_index = base_dir / "Chi Siamo Page Design 1" / "build" / "index.html"
+    authenticated = request.cookies.get("auth") == "1"
+    page = prepared_pages.get(
+        ("main.chi_siamo", authenticated),
+        [build_index, base_dir / "templates" / "chi_siamo.html"],
+        lambda: _build_chi_siamo_page(build_index, authenticated),
+    )
+    return page_response(page, request, vary=("Cookie",))
 
 @app.get("/place_details", response_class=HTMLResponse)
 async def place_details(request: Request, place_id: str):
@@ -118,6 +118,14 @@ async def city_image_cse_alias(city: str):
         return await sitesense_app.city_image(city=city)
     return RedirectResponse(url="/", status_code=307)
 
+# Alias per compatibilità: /place_photo (foto Google Places nei risultati di ricerca)
+# Delega all'handler OOP se disponibile, evitando 404 quando si avvia con main.py
+@app.get("/place_photo")
+async def place_photo_alias(request: Request, ref: str, v: str | None = None):
+    if sitesense_app and hasattr(sitesense_app, "place_photo"):
+        return await sitesense_app.place_photo(ref=ref, v=v, request=request)
+    return RedirectResponse(url="/", status_code=307)
+
 # Pagina di login Super Admin
 @app.get("/login_super_admin", response_class=HTMLResponse)
 async def login_super_admin_get(request: Request):
@@ -216,24 +224,20 @@ async def api_current_user(request: Request):
     user_email = request.cookies.get("user_email")
     if auth != "1" or not user_email:
         return JSONResponse({"ok": False, "error": "Non autenticato"}, status_code=401)
-    conn = get_connection()
-    if not conn:
-        return JSONResponse({"ok": False, "error": "DB non disponibile"}, status_code=503)
+    def _fetch_user(repo):
+        if repo is None:
+            return None
+        return repo.get_user_by_email(user_email) or {}
     try:
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT name, surname, email, profile_image FROM Initalya.users WHERE email = %s", (user_email,))
-        u = cur.fetchone() or {}
-        return JSONResponse({
-            "ok": True,
-            "name": u.get("name"),
-            "surname": u.get("surname"),
-            "email": u.get("email") or user_email,
-            "profile_image": u.get("profile_image") or "/assets/user-variant1.png",
-        })
-    except Exception as e:
+        u = await repository.run(_fetch_user)
+    except Exception:
         return JSONResponse({"ok": False, "error": "Errore server"}, status_code=500)
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    if u is None:
+        return JSONResponse({"ok": False, "error": "DB non disponibile"}, status_code=503)
+    return JSONResponse({
+        "ok": True,
+        "name": u.get("name"),
+        "surname": u.get("surname"),
+        "email": u.get("email") or user_email,
+        "profile_image": u.get("profile_image") or "/assets/user-variant1.png",
+    })
@@ -1,6 +1,9 @@
+import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Optional
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import HTMLResponse, PlainTextResponse, Response
@@ -8,13 +11,22 @@ from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from .search_routes_oop import search_routes_instance
-import httpx
 import json
 import urllib.parse
 from .config.settings import settings
 import re
-from .services.database import get_connection
-import hashlib
+from .services import database, http_client, repository
+from .services.schema_registry import schema_registry
+from .services.photo_cache import photo_cache
+from .services.city_index import city_index
+from .services.single_flight import image_flights, image_key
+from .services.image_prefetch import image_prefetcher
+from .services.image_proxy import VARIANTS, image_proxy, image_response, variant_name
+from .services.json_storage import json_storage
+from .services.context_compactor import context_compactor
+from .services.dashboard_pages import AREA_RISERVATA, AREA_SUPER_ADMIN, DashboardUser, dashboard_pages
+from .services.prepared_pages import PreparedPage, page_response, prepared_pages
+from .services.path_sanitizer import SanitizePathMiddleware
 from .services.city_cache_service import save_city_cache, load_city_cache
 
 # Configurazione logging
@@ -30,18 +42,55 @@ logging.getLogger("google_genai.models").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 # Base directory of the sitesense package (for absolute paths)
 BASE_DIR = Path(__file__).resolve().parent
+# Elementi massimi per singola richiesta a /api/images/batch
+IMAGE_BATCH_MAX_ITEMS = 50
+# Cache del browser per le immagini servite dal proxy (il contenuto di una chiave può cambiare)
+IMAGE_MAX_AGE_SECONDS = 7 * 24 * 3600
+# Mount statici esclusi dalla sanificazione dei percorsi (/dashboard resta incluso: i suoi link generati
+# sono quelli che possono contenere virgolette)
+SANITIZE_BYPASS_PREFIXES = ("/static/", "/assets/", "/chi_siamo_design/")
 
 class SiteSenseApp:
     """Classe principale per l'applicazione SiteSense"""
     
     def __init__(self):
-        self.app = FastAPI(title="SiteSense", description="AI Travel & Food Concierge")
+        self.app = FastAPI(title="SiteSense", description="AI Travel & Food Concierge", lifespan=self._lifespan)
         self.templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
         self._setup_middleware()
         self._setup_static_files()
         self._setup_routes()
         logger.info("SiteSenseApp inizializzata con successo")
     
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        """Risorse condivise per la durata dell'applicazione (pool HTTP e MySQL)."""
+        await http_client.startup()
+        await database.startup()
+        await schema_registry.startup()
+        await photo_cache.startup()
+        await city_index.startup()
+        await image_proxy.startup()
+        # Template delle pagine del dashboard preparati una volta (riscritture statiche)
+        await asyncio.to_thread(dashboard_pages.warm)
+        # Pagina Chi Siamo renderizzata una volta (riscritture, template, varianti compresse)
+        await asyncio.to_thread(self._warm_chi_siamo)
+        # Preriscaldamento immagini dopo le ricerche: stessi resolver degli endpoint
+        image_prefetcher.configure({
+            "dish": self.dish_image_url,
+            "city": lambda _dish, city: self.city_image_url(city),
+            "city_dish": lambda dish, city: self.get_city_dish_image(city, dish),
+        })
+        await image_prefetcher.start()
+        try:
+            yield
+        finally:
+            logger.info(f"Pool MySQL: {database.stats()}")
+            logger.info(f"Cache immagini: {photo_cache.stats()} {image_flights.stats()} prefetch={image_prefetcher.stats()} proxy={image_proxy.stats()}")
+            logger.info(f"Contesto chatbot: {context_compactor.stats()} file JSON: {json_storage.stats()} dashboard: {dashboard_pages.stats()} pagine: {prepared_pages.stats()}")
+            await image_prefetcher.stop()
+            await database.shutdown()
+            await http_client.shutdown()
+
     def _setup_static_files(self):
         """Configura i file statici"""
         self.app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
@@ -84,6 +133,10 @@ class SiteSenseApp:
         self.app.get("/city_image_cse")(self.city_image)
         # Nuova endpoint per immagini piatti per citt�
         self.app.get("/city_dish_image")(self.city_dish_image)
+        # Risoluzione in blocco degli URL immagine (piatti e città) per le pagine con molte card
+        self.app.post("/api/images/batch")(self.image_batch)
+        # Foto Google Places servite dal proxy immagini (la chiave API resta lato server)
+        self.app.get("/place_photo")(self.place_photo)
         # Nuove endpoint per immagini della pagina intro (associate a città specifica)
         self.app.get("/intro_image/{city}/{item}")(self.intro_page_image)
         self.app.get("/login", response_class=HTMLResponse)(self.login_page)
@@ -99,24 +152,7 @@ class SiteSenseApp:
 
     def _setup_middleware(self):
         """Middleware globale per sanificare percorsi contenenti virgolette codificate/non codificate."""
-        @self.app.middleware("http")
-        async def _sanitize_path_middleware(request, call_next):
-            path = request.url.path
-            if path.startswith("/dashboard/api_current_user") or path.startswith("/api/area_riservata/api_current_user"):
-                q = request.url.query
-                url = "/api_current_user" if not q else f"/api_current_user?{q}"
-                return RedirectResponse(url=url, status_code=307)
-            # Rimuove qualsiasi occorrenza di %22 o virgolette grezze dal path
-            sanitized = path.replace('%22', '').replace('"', '').replace("'", '')
-            # Normalizza doppi slash
-            sanitized = re.sub(r"/+", "/", sanitized)
-            # Rimuove slash finale superfluo dopo .html
-            sanitized = re.sub(r"(\.html)/+$", r"\1", sanitized)
-            if sanitized != path:
-                q = request.url.query
-                url = sanitized if not q else f"{sanitized}?{q}"
-                return RedirectResponse(url=url, status_code=307)
-            return await call_next(request)
+        self.app.add_middleware(SanitizePathMiddleware, bypass_prefixes=SANITIZE_BYPASS_PREFIXES)
         self.app.get("/google_login", name="google_login")(self.google_login)
         self.app.get("/auth/google/callback", name="google_callback")(self.google_callback)
         self.app.get("/area_riservata", response_class=HTMLResponse)(self.area_riservata)
@@ -169,7 +205,7 @@ class SiteSenseApp:
         if not city:
             raise HTTPException(status_code=400, detail="Parametro 'city' mancante")
         try:
-            res = save_city_cache(city, data)
+            res = await asyncio.to_thread(save_city_cache, city, data)
             return res
         except Exception as e:
             logger.warning(f"Errore salvataggio cache città: {e}")
@@ -189,7 +225,7 @@ class SiteSenseApp:
         if not city:
             raise HTTPException(status_code=400, detail="Parametro 'city' mancante")
         try:
-            data = load_city_cache(city)
+            data = await asyncio.to_thread(load_city_cache, city)
             return data
         except Exception as e:
             logger.warning(f"Errore caricamento cache città: {e}")
@@ -204,49 +240,62 @@ class SiteSenseApp:
             auth = request.cookies.get("auth")
             user_email = request.cookies.get("user_email")
             if auth == "1" and user_email:
-                conn = get_connection()
-                if conn:
+                def _fetch_user(conn):
+                    if not conn:
+                        return None
                     cur = conn.cursor(dictionary=True)
                     try:
                         cur.execute("SELECT * FROM Initalya.users WHERE email = %s", (user_email,))
-                        user_data = cur.fetchone()
+                        return cur.fetchone()
                     finally:
-                        try:
-                            conn.close()
-                        except Exception:
-                            pass
+                        cur.close()
+                user_data = await database.run(_fetch_user)
         except Exception as e:
             logger.warning(f"Impossibile recuperare i dati utente per la home: {e}")
         return self.templates.TemplateResponse("index.html", {"request": request, "user": user_data})
 
-    async def chi_siamo_page(self, request: Request):
-        dist_index = BASE_DIR / "Chi Siamo Page Design 1" / "dist" / "index.html"
-        if dist_index.exists():
-            html = dist_index.read_text(encoding="utf-8")
-            if "<base" not in html:
-                html = re.sub(r"(<head[^>]*>)", r"\1\n    <base href=\"/chi_siamo_design/\">", html, count=1)
-            html = re.sub(r"(src|href)=\"src/", r"\1=\"/chi_siamo_design/src/", html)
-            html = re.sub(r"(href|src)=\"/assets/", r"\1=\"/chi_siamo_design/assets/", html)
-            html = re.sub(r"(href|src)=\"/vite\.svg", r"\1=\"/chi_siamo_design/vite.svg", html)
-            m_head = re.search(r"<head[^>]*>([\s\S]*?)</head>", html, flags=re.IGNORECASE)
-            m_body = re.search(r"<body[^>]*>([\s\S]*?)</body>", html, flags=re.IGNORECASE)
-            head_inner = (m_head.group(1) if m_head else "")
-            body_inner = (m_body.group(1) if m_body else html)
-            return self.templates.TemplateResponse("chi_siamo.html", {"request": request, "design_head": head_inner, "design_html": body_inner})
-        build_index = BASE_DIR / "Chi Siamo Page Design 1" / "build" / "index.html"
-        if build_index.exists():
-            html = build_index.read_text(encoding="utf-8")
-            if "<base" not in html:
-                html = re.sub(r"(<head[^>]*>)", r"\1\n    <base href=\"/chi_siamo_design/\">", html, count=1)
-            html = re.sub(r"(src|href)=\"src/", r"\1=\"/chi_siamo_design/src/", html)
-            html = re.sub(r"(href|src)=\"/assets/", r"\1=\"/chi_siamo_design/assets/", html)
-            html = re.sub(r"(href|src)=\"/vite\.svg", r"\1=\"/chi_siamo_design/vite.svg", html)
+    @staticmethod
+    def _rewrite_chi_siamo_design(html: str) -> str:
+        """Base href e percorsi degli asset del design Chi Siamo sotto /chi_siamo_design/."""
+        if "<base" not in html:
+            html = re.sub(r"(<head[^>]*>)", r"\1\n    <base href=\"/chi_siamo_design/\">", html, count=1)
+        html = re.sub(r"(src|href)=\"src/", r"\1=\"/chi_siamo_design/src/", html)
+        html = re.sub(r"(href|src)=\"/assets/", r"\1=\"/chi_siamo_design/assets/", html)
+        html = re.sub(r"(href|src)=\"/vite\.svg", r"\1=\"/chi_siamo_design/vite.svg", html)
+        return html
+
+    def _build_chi_siamo_page(self, design_index: Optional[Path], authenticated: bool) -> str:
+        # Il template legge dalla richiesta solo il cookie auth: una variante per stato di login
+        context = {"request": SimpleNamespace(cookies={"auth": "1"} if authenticated else {})}
+        if design_index is not None:
+            html = self._rewrite_chi_siamo_design(design_index.read_text(encoding="utf-8"))
             m_head = re.search(r"<head[^>]*>([\s\S]*?)</head>", html, flags=re.IGNORECASE)
             m_body = re.search(r"<body[^>]*>([\s\S]*?)</body>", html, flags=re.IGNORECASE)
-            head_inner = (m_head.group(1) if m_head else "")
-            body_inner = (m_body.group(1) if m_body else html)
-            return self.templates.TemplateResponse("chi_siamo.html", {"request": request, "design_head": head_inner, "design_html": body_inner})
-        return self.templates.TemplateResponse("chi_siamo.html", {"request": request})
+            context["design_head"] = (m_head.group(1) if m_head else "")
+            context["design_html"] = (m_body.group(1) if m_body else html)
+        return self.templates.get_template("chi_siamo.html").render(context)
+
+    def _chi_siamo_prepared(self, authenticated: bool) -> PreparedPage:
+        """Pagina Chi Siamo (design da dist/ o, in mancanza, da build/) preparata una volta per deploy."""
+        design_root = BASE_DIR / "Chi Siamo Page Design 1"
+        design_index = next((p for p in (design_root / "dist" / "index.html", design_root / "build" / "index.html") if p.exists()), None)
+        sources = [BASE_DIR / "templates" / "chi_siamo.html"] + ([design_index] if design_index else [])
+        return prepared_pages.get(
+            ("chi_siamo", str(design_index), authenticated),
+            sources,
+            lambda: self._build_chi_siamo_page(design_index, authenticated),
+        )
+
+    def _warm_chi_siamo(self) -> None:
+        for authenticated in (False, True):
+            try:
+                self._chi_siamo_prepared(authenticated)
+            except Exception as e:
+                logger.warning(f"Pagina Chi Siamo non preparata: {e}")
+
+    async def chi_siamo_page(self, request: Request):
+        page = self._chi_siamo_prepared(request.cookies.get("auth") == "1")
+        return page_response(page, request, vary=("Cookie",))
     
     async def contatti_page(self, request: Request):
         return self.templates.TemplateResponse("contatti.html", {"request": request})
@@ -281,136 +330,36 @@ class SiteSenseApp:
         return await self._render_dashboard_page(page_name, request)
 
     async def _render_dashboard_page(self, page_name: str, request: Request) -> HTMLResponse:
-        """Legge un file HTML dal build del dashboard e inietta <base href="/dashboard/">."""
-        build_dir = BASE_DIR / "dashboard" / "build"
-        html_path = build_dir / page_name
-
-        if not html_path.exists():
+        """Pagina del build del dashboard: template già riscritto (base href, link, asset) più l'header utente."""
+        path = request.url.path or ""
+        area = AREA_RISERVATA if path.startswith("/area_riservata") else AREA_SUPER_ADMIN
+        template = dashboard_pages.get(page_name, area)
+        if template is None:
             raise HTTPException(status_code=404, detail=f"Pagina dashboard non trovata: {page_name}")
 
-        html = html_path.read_text(encoding="utf-8")
-
-        # Inietta il base href se non presente per risolvere asset relativi
-        if "<base" not in html:
-            html = re.sub(r"(<head[^>]*>)", r"\1\n    <base href=\"/dashboard/\">", html, count=1)
-
-        # Riscrivi percorsi critici (CSS/JS/favicon/src assets) e link HTML
-        html = re.sub(r"href=\"style\.css\"", "href=\"/dashboard/style.css\"", html)
-        html = re.sub(r"src=\"bundle\.js\"", "src=\"/dashboard/bundle.js\"", html)
-        html = re.sub(r"href=\"favicon\.ico\"", "href=\"/dashboard/favicon.ico\"", html)
-        # Riscrivi riferimenti a src/ per immagini e altri asset
-        html = re.sub(r"(src|href)=\"src/", r"\1=\"/dashboard/src/", html)
-        path = request.url.path or ""
-        if path.startswith("/area_riservata"):
-            html = re.sub(r"href=\"(?!http)(?!/)([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
-            html = re.sub(r"href='(?!http)(?!/)([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
-            html = re.sub(r"href=\"/dashboard/([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
-            html = re.sub(r"href='/dashboard/([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
-            html = re.sub(r"href=\"\./([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
-            html = re.sub(r"href='\./([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
-            html = re.sub(r"href=\"/([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
-            html = re.sub(r"href='/([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
-        else:
-            html = re.sub(r"href=\"(?!http)(?!/)([A-Za-z0-9_-]+\.html)\"", r"href=\"/area_super_admin/\1\"", html)
-            html = re.sub(r"href='(?!http)(?!/)([A-Za-z0-9_-]+\.html)'", r"href='/area_super_admin/\1'", html)
-        # Pulisci virgolette codificate %22 eventualmente presenti nei valori href/src
-        # Inizio valore attributo
-        html = re.sub(r"(href|src)=(\"|')%22/", r"\1=\2/", html)
-        # Fine valore attributo
-        html = re.sub(r"%22(\"|')", r"\1", html)
-        # Gestisci anche il caso con slash finale prima della chiusura
-        html = re.sub(r"/%22(\"|')", r"\1", html)
-        # Rimuovi qualsiasi occorrenza di %22 all'interno dei valori href/src
-        html = re.sub(r"(href|src)=(\"|')([^\"']*?)%22([^\"']*?)(\"|')", r"\1=\2\3\4\5", html)
-        if path.startswith("/area_riservata"):
+        user = None
+        if area == AREA_RISERVATA:
             try:
                 auth = request.cookies.get("auth")
                 user_email = request.cookies.get("user_email")
                 if auth == "1" and user_email:
-                    conn = get_connection()
-                    u = {}
-                    if conn:
-                        cur = conn.cursor(dictionary=True)
-                        cur.execute("SELECT name, surname, email, profile_image FROM Initalya.users WHERE email = %s", (user_email,))
-                        u = cur.fetchone() or {}
-                        try:
-                            conn.close()
-                        except Exception:
-                            pass
-                    def _esc(v):
-                        s = "" if v is None else str(v)
-                        s = s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
-                        return s
-                    name = (u.get("name") or "").strip()
-                    surname = (u.get("surname") or "").strip()
-                    email_val = (u.get("email") or user_email or "").strip()
-                    full_name = (f"{name} {surname}".strip() or email_val)
-                    img_src = ((u.get("profile_image") or "").strip() or "/assets/user-variant1.png")
-                    img_src = _esc(img_src)
-                    # Aggiorna avatar nell'header
-                    html = re.sub(r'src="/dashboard/src/images/user/owner\.jpg"', f'src="{img_src}"', html)
-                    html = re.sub(r'src="src/images/user/owner\.jpg"', f'src="{img_src}"', html)
-                    # Aggiorna nome breve vicino all'avatar
-                    if name:
-                        html = re.sub(r">\s*Musharof\s*<", f">{_esc(name)}<", html)
-                    # Aggiorna nome completo nel dropdown utente
-                    html = re.sub(r">\s*Musharof Chowdhury\s*<", f">{_esc(full_name)}<", html)
-                    # Aggiorna email nel dropdown utente
-                    html = re.sub(r">\s*randomuser@pimjo\.com\s*<", f">{_esc(email_val)}<", html)
-                    # Collega il pulsante Sign out al logout sostituendolo con un link
-                    # Usa un regex che non attraversi i tag di chiusura button per evitare di catturare bottoni precedenti (es. hamburger)
-                 
-                    
-                    # Aggiorna il bottone hamburger per usare prevent.stop come richiesto
-                    html = re.sub(r"@click\.stop=\"sidebarToggle\s*=\s*!sidebarToggle\"", r'@click.prevent.stop="sidebarToggle = !sidebarToggle"', html)
-
-                    # Forza avatar lato client se presenti residui non catturati, inserendo script inline
-                    avatar_script = f"<script>try{{var img='{img_src}';var el=document.getElementById('user-avatar-img');if(el){{el.src=img;}}var q=document.querySelector('img[src*=\"owner.jpg\"]');if(q){{q.src=img;}}}}catch(e){{}}</script>"
-                    m_body_end = re.search(r"</body>", html, flags=re.IGNORECASE)
-                    if m_body_end:
-                        pos = m_body_end.start()
-                        html = html[:pos] + avatar_script + html[pos:]
+                    u = await repository.run(lambda repo: (repo.get_user_by_email(user_email) if repo else None) or {})
+                    user = DashboardUser.from_row(u, user_email)
             except Exception as _e:
                 logger.warning(f"Iniezione header utente fallita: {_e}")
 
-
-
-        
-      
-        # Sanitizza sistematicamente i valori href/src per rimuovere virgolette interne e slash superflui
-        def _sanitize_attr_double(m):
-            val = m.group(2)
-            val = val.replace('%22', '')
-            val = val.replace('"', '')
-            val = val.replace("'", '')
-            val = re.sub(r"(\.html)/+$", r"\1", val)
-            return f"{m.group(1)}=\"{val}\""
-
-        def _sanitize_attr_single(m):
-            val = m.group(2)
-            val = val.replace('%22', '')
-            val = val.replace('"', '')
-            val = val.replace("'", '')
-            val = re.sub(r"(\.html)/+$", r"\1", val)
-            return f"{m.group(1)}='{val}'"
-
-        html = re.sub(r"(href|src)=\"([^\"]*)\"", _sanitize_attr_double, html)
-        html = re.sub(r"(href|src)='([^']*)'", _sanitize_attr_single, html)
-
-        return HTMLResponse(content=html)
+        return HTMLResponse(content=template.render(user))
     
-    async def _render_chi_siamo_design_page(self, page_name: str, request: Request) -> HTMLResponse:
-        build_dir = BASE_DIR / "Chi Siamo Page Design 1" / "dist"
-        html_path = build_dir / page_name
+    async def _render_chi_siamo_design_page(self, page_name: str, request: Request) -> Response:
+        html_path = BASE_DIR / "Chi Siamo Page Design 1" / "dist" / page_name
         if not html_path.exists():
             raise HTTPException(status_code=404, detail=f"Pagina Chi Siamo non trovata: {page_name}")
-        html = html_path.read_text(encoding="utf-8")
-        if "<base" not in html:
-            html = re.sub(r"(<head[^>]*>)", r"\1\n    <base href=\"/chi_siamo_design/\">", html, count=1)
-        html = re.sub(r"(src|href)=\"src/", r"\1=\"/chi_siamo_design/src/", html)
-        html = re.sub(r"(href|src)=\"/assets/", r"\1=\"/chi_siamo_design/assets/", html)
-        html = re.sub(r"(href|src)=\"/vite\.svg", r"\1=\"/chi_siamo_design/vite.svg", html)
-        return HTMLResponse(content=html)
+        page = prepared_pages.get(
+            ("chi_siamo_design", page_name),
+            [html_path],
+            lambda: self._rewrite_chi_siamo_design(html_path.read_text(encoding="utf-8")),
+        )
+        return page_response(page, request)
     
     async def api_auth_status(self, request: Request):
      auth = request.cookies.get("auth")
@@ -426,31 +375,28 @@ class SiteSenseApp:
         user_email = request.cookies.get("user_email")
         if auth != "1" or not user_email:
             return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "Non autenticato"}), status_code=401)
-        conn = get_connection()
-        if not conn:
-            return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "DB non disponibile"}), status_code=503)
+        def _fetch_user(repo):
+            if repo is None:
+                return None
+            return repo.get_user_by_email(user_email) or {}
+
         try:
-            cur = conn.cursor(dictionary=True)
-            cur.execute("SELECT name, surname, email, profile_image FROM Initalya.users WHERE email = %s", (user_email,))
-            u = cur.fetchone() or {}
-            prof = (u.get("profile_image") or "").strip()
-            if not prof:
-                prof = "/assets/user-variant1.png"
-            return Response(media_type="application/json", content=json.dumps({
-                "ok": True,
-                "name": u.get("name"),
-                "surname": u.get("surname"),
-                "email": u.get("email") or user_email,
-                "profile_image": prof,
-            }))
+            u = await repository.run(_fetch_user)
         except Exception as e:
             logger.exception("Errore in api_current_user: %s", e)
             return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "Errore server"}), status_code=500)
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
+        if u is None:
+            return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "DB non disponibile"}), status_code=503)
+        prof = (u.get("profile_image") or "").strip()
+        if not prof:
+            prof = "/assets/user-variant1.png"
+        return Response(media_type="application/json", content=json.dumps({
+            "ok": True,
+            "name": u.get("name"),
+            "surname": u.get("surname"),
+            "email": u.get("email") or user_email,
+            "profile_image": prof,
+        }))
 
             
     async def api_users_programs(self, request: Request):
@@ -462,31 +408,37 @@ class SiteSenseApp:
         if not ((super_auth == "1" and email) or (super_auth == "1" and role == "super_admin") or (request.cookies.get("auth") == "1" and role == "super_admin")):
             return PlainTextResponse("Non autorizzato", status_code=401)
 
-        conn = get_connection()
-        if not conn:
-            return PlainTextResponse("DB non disponibile", status_code=503)
+        def _fetch_rows(conn):
+            if not conn:
+                return None
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute(
+                    """
+                    SELECT 
+                        u.id AS user_id,
+                        u.name AS name,
+                        u.surname AS surname,
+                        u.email AS email,
+                        u.profile_image AS profile_image,
+                        p.id AS program_id,
+                        p.num_locali AS num_locali,
+                        p.created_at AS created_at,
+                        c.name AS city_name
+                    FROM Initalya.users u
+                    LEFT JOIN Initalya.programs p ON p.user_id = u.id
+                    LEFT JOIN Initalya.cities c ON c.id = p.city_id
+                    ORDER BY u.id ASC, p.id ASC
+                    """
+                )
+                return cur.fetchall() or []
+            finally:
+                cur.close()
 
         try:
-            cur = conn.cursor(dictionary=True)
-            cur.execute(
-                """
-                SELECT 
-                    u.id AS user_id,
-                    u.name AS name,
-                    u.surname AS surname,
-                    u.email AS email,
-                    u.profile_image AS profile_image,
-                    p.id AS program_id,
-                    p.num_locali AS num_locali,
-                    p.created_at AS created_at,
-                    c.name AS city_name
-                FROM Initalya.users u
-                LEFT JOIN Initalya.programs p ON p.user_id = u.id
-                LEFT JOIN Initalya.cities c ON c.id = p.city_id
-                ORDER BY u.id ASC, p.id ASC
-                """
-            )
-            rows = cur.fetchall() or []
+            rows = await database.run(_fetch_rows)
+            if rows is None:
+                return PlainTextResponse("DB non disponibile", status_code=503)
             # Prepara output semplice, una riga per ogni programma (o utente senza programma)
             out = []
             for r in rows:
@@ -507,11 +459,6 @@ class SiteSenseApp:
         except Exception as e:
             logger.exception("Errore in api_users_programs: %s", e)
             return PlainTextResponse("Errore server", status_code=500)
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
 
     async def api_users_programs_count(self, request: Request):
         """Ritorna una riga per utente con il numero totale di programmi."""
@@ -521,29 +468,35 @@ class SiteSenseApp:
         if not ((super_auth == "1" and email) or (super_auth == "1" and role == "super_admin") or (request.cookies.get("auth") == "1" and role == "super_admin")):
             return PlainTextResponse("Non autorizzato", status_code=401)
 
-        conn = get_connection()
-        if not conn:
-            return PlainTextResponse("DB non disponibile", status_code=503)
+        def _fetch_rows(conn):
+            if not conn:
+                return None
+            cur = conn.cursor(dictionary=True)
+            try:
+                # Conta programmi per utente
+                cur.execute(
+                    """
+                    SELECT 
+                        u.id AS user_id,
+                        u.name AS name,
+                        u.surname AS surname,
+                        u.email AS email,
+                        u.profile_image AS profile_image,
+                        COUNT(p.id) AS programs_count
+                    FROM Initalya.users u
+                    LEFT JOIN Initalya.programs p ON p.user_id = u.id
+                    GROUP BY u.id, u.name, u.surname, u.email, u.profile_image
+                    ORDER BY u.id ASC
+                    """
+                )
+                return cur.fetchall() or []
+            finally:
+                cur.close()
 
         try:
-            cur = conn.cursor(dictionary=True)
-            # Conta programmi per utente
-            cur.execute(
-                """
-                SELECT 
-                    u.id AS user_id,
-                    u.name AS name,
-                    u.surname AS surname,
-                    u.email AS email,
-                    u.profile_image AS profile_image,
-                    COUNT(p.id) AS programs_count
-                FROM Initalya.users u
-                LEFT JOIN Initalya.programs p ON p.user_id = u.id
-                GROUP BY u.id, u.name, u.surname, u.email, u.profile_image
-                ORDER BY u.id ASC
-                """
-            )
-            rows = cur.fetchall() or []
+            rows = await database.run(_fetch_rows)
+            if rows is None:
+                return PlainTextResponse("DB non disponibile", status_code=503)
             out = []
             for r in rows:
                 full_name = (r.get("name") or "")
@@ -560,11 +513,6 @@ class SiteSenseApp:
         except Exception as e:
             logger.exception("Errore in api_users_programs_count: %s", e)
             return PlainTextResponse("Errore server", status_code=500)
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
 
 
 
@@ -576,86 +524,42 @@ class SiteSenseApp:
      if auth != "1" or not email:
         return {"success": False, "error": "Non autenticato"}
 
-     conn = get_connection()
-     if not conn:
-        return {"success": False, "error": "DB non disponibile"}
+     def _load_program(repo):
+         if repo is None:
+            return {"success": False, "error": "DB non disponibile"}
 
-     try:
-        cur = conn.cursor(dictionary=True)
-
-        # Utente
-        cur.execute(
-            "SELECT id FROM Initalya.users WHERE email = %s",
-            (email,)
-        )
-        user = cur.fetchone()
-        if not user:
-            return {"success": False, "error": "Utente non trovato"}
-
-        user_id = user["id"]
+         try:
+            user_id = repo.get_user_id(email)
+            if not user_id:
+                return {"success": False, "error": "Utente non trovato"}
 
-        # Programma
-        cur.execute(
-            "SELECT * FROM Initalya.programs WHERE id = %s AND user_id = %s",
-            (program_id, user_id)
-        )
-        program = cur.fetchone()
-        if not program:
-            return {"success": False, "error": "Programma non trovato"}
-
-        # Citt�
-        city_name = ""
-        if program.get("city_id"):
-            cur.execute(
-                "SELECT name FROM Initalya.cities WHERE id = %s",
-                (program["city_id"],)
-            )
-            city = cur.fetchone()
-            city_name = city["name"] if city else ""
-
-        # Locali salvati: includi coordinate, immagine e rating se presenti in DB
-        cur.execute("""
-            SELECT
-                l.place_id,
-                l.name,
-                l.address,
-                COALESCE(t.typology, '') AS type,
-                l.lat,
-                l.lng,
-                l.image,
-                l.rating
-            FROM Initalya.locals l
-            LEFT JOIN Initalya.types t ON l.type_id = t.id
-            WHERE l.program_id = %s
-            ORDER BY l.id ASC
-        """, (program_id,))
-
-        locals_rows = cur.fetchall() or []
-
-        return {
-            "success": True,
-            "program_id": program_id,
-            "city_name": city_name,
-            "locals": [
-                {
-                    "place_id": row.get("place_id", ""),
-                    "name": row.get("name", ""),
-                    "address": row.get("address", ""),
-                    "type": row.get("type", ""),
-                    "lat": row.get("lat"),
-                    "lng": row.get("lng"),
-                    "image": row.get("image", ""),
-                    "rating": row.get("rating", "")
-                }
-                for row in locals_rows
-            ]
-        }
+            details = repo.get_program_with_locals(program_id, user_id)
+            if not details:
+                return {"success": False, "error": "Programma non trovato"}
+
+            return {
+                "success": True,
+                "program_id": program_id,
+                "city_name": details["city_name"],
+                "locals": [
+                    {
+                        "place_id": row.get("place_id", ""),
+                        "name": row.get("name", ""),
+                        "address": row.get("address", ""),
+                        "type": row.get("type", ""),
+                        "lat": row.get("lat"),
+                        "lng": row.get("lng"),
+                        "image": row.get("image", ""),
+                        "rating": row.get("rating", "")
+                    }
+                    for row in details["locals"]
+                ]
+            }
 
-     except Exception as e:
-        return {"success": False, "error": str(e)}
+         except Exception as e:
+            return {"success": False, "error": str(e)}
 
-     finally:
-        conn.close()
+     return await repository.run(_load_program)
    
 
 
@@ -670,43 +574,23 @@ class SiteSenseApp:
             status_code=303
         )
 
-      conn = get_connection()
-      if not conn:
-         return RedirectResponse(url="/area_riservata", status_code=303)
-
-      try:
-        cur = conn.cursor(dictionary=True)
-
-        # Utente
-        cur.execute(
-            "SELECT id FROM Initalya.users WHERE email = %s",
-            (email,)
-        )
-        user = cur.fetchone()
-        if not user:
-            return RedirectResponse(url="/area_riservata", status_code=303)
-
-        # Programma
-        cur.execute(
-            "SELECT id, user_id FROM Initalya.programs WHERE id = %s",
-            (program_id,)
-        )
-        program = cur.fetchone()
-
-        if not program or program["user_id"] != user["id"]:
-            return RedirectResponse(url="/area_riservata", status_code=303)
+      def _owns_program(repo):
+        if repo is None:
+            return False
+        user_id = repo.get_user_id(email)
+        return bool(user_id and repo.get_program(program_id, user_id))
 
-        # ?? Qui � il punto chiave
-        return self.templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "restore_program_id": program_id
-            }
-        )
+      if not await repository.run(_owns_program):
+        return RedirectResponse(url="/area_riservata", status_code=303)
 
-      finally:
-        conn.close()
+      # ?? Qui � il punto chiave
+      return self.templates.TemplateResponse(
+          "index.html",
+          {
+              "request": request,
+              "restore_program_id": program_id
+          }
+      )
 
 
    
@@ -714,6 +598,58 @@ class SiteSenseApp:
 
 
 
+    @staticmethod
+    def _load_area_riservata(conn, user_email: str):
+        """Dati utente, programmi salvati e ruolo (dalla colonna 'ruolo') per l'area riservata."""
+        user_data = None
+        programs = []
+        ruolo_db = None
+        role_num = 3
+        if not conn:
+            return user_data, programs, role_num
+        cursor = conn.cursor(dictionary=True)
+        try:
+            # Dati utente (Initalya.users per coerenza)
+            cursor.execute("SELECT * FROM Initalya.users WHERE email = %s", (user_email,))
+            user_data = cursor.fetchone()
+
+            # Determina ruolo SOLO da DB (colonna 'ruolo'), ignorando cookie
+            if user_data is not None:
+                ruolo_db = user_data.get("ruolo")
+                if ruolo_db is not None:
+                    if isinstance(ruolo_db, int):
+                        role_num = ruolo_db
+                    else:
+                        ruolo_str = str(ruolo_db).strip().lower()
+                        mapping = {
+                            "utente": 1,
+                            "user": 1,
+                            "admin": 2,
+                            "amministratore": 2,
+                            "superadmin": 1,
+                            "3": 3,
+                            "2": 2,
+                            "1": 1,
+                        }
+                        role_num = mapping.get(ruolo_str, 3)
+
+            # Programmi salvati
+            if user_data and user_data.get("id"):
+                cursor.execute(
+                    """
+                    SELECT p.id as program_id, p.num_locali, c.name as city_name, c.photo as city_photo
+                    FROM Initalya.programs p
+                    LEFT JOIN Initalya.cities c ON c.id = p.city_id
+                    WHERE p.user_id = %s
+                    ORDER BY p.id DESC
+                    """,
+                    (user_data["id"],)
+                )
+                programs = cursor.fetchall()
+        finally:
+            cursor.close()
+        return user_data, programs, role_num
+
     async def area_riservata(self, request: Request):
         auth = request.cookies.get("auth")
         if auth != "1":
@@ -724,52 +660,10 @@ class SiteSenseApp:
         programs = []
         view = request.query_params.get("view") or ""
 
-        ruolo_db = None
         role_num = 3
 
         if user_email:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-            try:
-                # Dati utente (Initalya.users per coerenza)
-                cursor.execute("SELECT * FROM Initalya.users WHERE email = %s", (user_email,))
-                user_data = cursor.fetchone()
-
-                # Determina ruolo SOLO da DB (colonna 'ruolo'), ignorando cookie
-                if user_data is not None:
-                    ruolo_db = user_data.get("ruolo")
-                    if ruolo_db is not None:
-                        if isinstance(ruolo_db, int):
-                            role_num = ruolo_db
-                        else:
-                            ruolo_str = str(ruolo_db).strip().lower()
-                            mapping = {
-                                "utente": 1,
-                                "user": 1,
-                                "admin": 2,
-                                "amministratore": 2,
-                                "superadmin": 1,
-                                "3": 3,
-                                "2": 2,
-                                "1": 1,
-                            }
-                            role_num = mapping.get(ruolo_str, 3)
-
-                # Programmi salvati
-                if user_data and user_data.get("id"):
-                    cursor.execute(
-                        """
-                        SELECT p.id as program_id, p.num_locali, c.name as city_name, c.photo as city_photo
-                        FROM Initalya.programs p
-                        LEFT JOIN Initalya.cities c ON c.id = p.city_id
-                        WHERE p.user_id = %s
-                        ORDER BY p.id DESC
-                        """,
-                        (user_data["id"],)
-                    )
-                    programs = cursor.fetchall()
-            finally:
-                conn.close()
+            user_data, programs, role_num = await database.run(self._load_area_riservata, user_email)
 
         template_name = f"area_riservata_{role_num}.html"
         if role_num == 2:
@@ -839,52 +733,10 @@ class SiteSenseApp:
         programs = []
         view = request.query_params.get("view") or ""
 
-        ruolo_db = None
         role_num = 3
 
         if user_email:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-            try:
-                # Dati utente (Initalya.users per coerenza)
-                cursor.execute("SELECT * FROM Initalya.users WHERE email = %s", (user_email,))
-                user_data = cursor.fetchone()
-
-                # Determina ruolo SOLO da DB (colonna 'ruolo'), ignorando cookie
-                if user_data is not None:
-                    ruolo_db = user_data.get("ruolo")
-                    if ruolo_db is not None:
-                        if isinstance(ruolo_db, int):
-                            role_num = ruolo_db
-                        else:
-                            ruolo_str = str(ruolo_db).strip().lower()
-                            mapping = {
-                                "utente": 1,
-                                "user": 1,
-                                "admin": 2,
-                                "amministratore": 2,
-                                "superadmin": 1,
-                                "3": 3,
-                                "2": 2,
-                                "1": 1,
-                            }
-                            role_num = mapping.get(ruolo_str, 3)
-
-                # Programmi salvati
-                if user_data and user_data.get("id"):
-                    cursor.execute(
-                        """
-                        SELECT p.id as program_id, p.num_locali, c.name as city_name, c.photo as city_photo
-                        FROM Initalya.programs p
-                        LEFT JOIN Initalya.cities c ON c.id = p.city_id
-                        WHERE p.user_id = %s
-                        ORDER BY p.id DESC
-                        """,
-                        (user_data["id"],)
-                    )
-                    programs = cursor.fetchall()
-            finally:
-                conn.close()
+            user_data, programs, role_num = await database.run(self._load_area_riservata, user_email)
 
         template_name = f"area_riservata_{role_num}.html"
         
@@ -949,76 +801,84 @@ class SiteSenseApp:
             "vat_cf": data.get("vat_cf"),
         }
 
-        conn = get_connection()
-        if not conn:
-            return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "DB non disponibile"}), status_code=503)
-
-        try:
+        def _apply(conn):
+            """(errore, status, nuova email): errore None se l'aggiornamento è riuscito."""
+            if not conn:
+                return "DB non disponibile", 503, None
             cur = conn.cursor(dictionary=True)
-            # Trova utente corrente
-            cur.execute("SELECT id, email FROM Initalya.users WHERE email = %s", (current_email,))
-            user = cur.fetchone()
-            if not user:
-                conn.close()
-                return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "Utente non trovato"}), status_code=404)
-
-            user_id = user["id"]
-
-            # Legge colonne tabella per aggiornamento dinamico
-            cur.execute("SHOW COLUMNS FROM Initalya.users")
-            rows = cur.fetchall()
-            # Mappa nome colonna -> tipo (lowercase)
-            cols_info = {row["Field"]: (row.get("Type") or "").lower() for row in rows}
-            cols = set(cols_info.keys())
-
-            # Seleziona set di campi secondo sezione
-            incoming = info_fields if section == "info" else addr_fields if section == "address" else {}
-            # Se la colonna "city" esiste ed è numerica, reindirizza a "city_name" per testo libero
-            def _is_numeric(t: str) -> bool:
-                return bool(re.match(r"^(tinyint|smallint|int|bigint|decimal|float|double|real)", t or ""))
-            redirected_incoming = {}
-            for k, v in incoming.items():
-                if v is None:
-                    continue
-                if k == "city" and ("city" in cols) and _is_numeric(cols_info.get("city", "")):
-                    redirected_incoming["city_name"] = v
-                else:
-                    redirected_incoming[k] = v
-            incoming = redirected_incoming
-            # Se alcune colonne richieste non esistono, prova ad aggiungerle dinamicamente
-            # Tipi suggeriti per le nuove colonne
-            suggested_types = {
-                "phone": "VARCHAR(30)",
-                "bio": "TEXT",
-                "country": "VARCHAR(100)",
-                "city": "VARCHAR(100)",
-                "city_name": "VARCHAR(100)",
-                "cap": "VARCHAR(10)",
-                "vat_cf": "VARCHAR(50)",
-            }
-            missing = [k for k, v in incoming.items() if (v is not None and k not in cols and k in suggested_types)]
-            for col in missing:
-                try:
-                    cur.execute(f"ALTER TABLE Initalya.users ADD COLUMN {col} {suggested_types[col]} NULL")
-                    conn.commit()
-                    cols.add(col)
-                except Exception as e:
-                    logger.warning("Impossibile aggiungere colonna %s: %s", col, e)
+            try:
+                # Trova utente corrente
+                cur.execute("SELECT id, email FROM Initalya.users WHERE email = %s", (current_email,))
+                user = cur.fetchone()
+                if not user:
+                    return "Utente non trovato", 404, None
+
+                user_id = user["id"]
+
+                # Legge colonne tabella per aggiornamento dinamico
+                cur.execute("SHOW COLUMNS FROM Initalya.users")
+                rows = cur.fetchall()
+                # Mappa nome colonna -> tipo (lowercase)
+                cols_info = {row["Field"]: (row.get("Type") or "").lower() for row in rows}
+                cols = set(cols_info.keys())
+
+                # Seleziona set di campi secondo sezione
+                incoming = info_fields if section == "info" else addr_fields if section == "address" else {}
+                # Se la colonna "city" esiste ed è numerica, reindirizza a "city_name" per testo libero
+                def _is_numeric(t: str) -> bool:
+                    return bool(re.match(r"^(tinyint|smallint|int|bigint|decimal|float|double|real)", t or ""))
+                redirected_incoming = {}
+                for k, v in incoming.items():
+                    if v is None:
+                        continue
+                    if k == "city" and ("city" in cols) and _is_numeric(cols_info.get("city", "")):
+                        redirected_incoming["city_name"] = v
+                    else:
+                        redirected_incoming[k] = v
+                incoming = redirected_incoming
+                # Se alcune colonne richieste non esistono, prova ad aggiungerle dinamicamente
+                # Tipi suggeriti per le nuove colonne
+                suggested_types = {
+                    "phone": "VARCHAR(30)",
+                    "bio": "TEXT",
+                    "country": "VARCHAR(100)",
+                    "city": "VARCHAR(100)",
+                    "city_name": "VARCHAR(100)",
+                    "cap": "VARCHAR(10)",
+                    "vat_cf": "VARCHAR(50)",
+                }
+                missing = [k for k, v in incoming.items() if (v is not None and k not in cols and k in suggested_types)]
+                for col in missing:
+                    try:
+                        cur.execute(f"ALTER TABLE Initalya.users ADD COLUMN {col} {suggested_types[col]} NULL")
+                        conn.commit()
+                        cols.add(col)
+                    except Exception as e:
+                        logger.warning("Impossibile aggiungere colonna %s: %s", col, e)
 
-            update_pairs = [(k, v) for k, v in incoming.items() if (v is not None and k in cols)]
+                update_pairs = [(k, v) for k, v in incoming.items() if (v is not None and k in cols)]
 
-            if not update_pairs:
-                return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "Nessun campo aggiornabile"}), status_code=400)
+                if not update_pairs:
+                    return "Nessun campo aggiornabile", 400, None
 
-            set_sql = ", ".join([f"{k} = %s" for k, _ in update_pairs])
-            values = [v for _, v in update_pairs]
-            values.append(user_id)
+                set_sql = ", ".join([f"{k} = %s" for k, _ in update_pairs])
+                values = [v for _, v in update_pairs]
+                values.append(user_id)
 
-            cur.execute(f"UPDATE Initalya.users SET {set_sql} WHERE id = %s", tuple(values))
-            conn.commit()
+                cur.execute(f"UPDATE Initalya.users SET {set_sql} WHERE id = %s", tuple(values))
+                conn.commit()
+
+                # Nuova email, se cambiata, per aggiornare il cookie
+                return None, 200, next((v for k, v in update_pairs if k == "email"), None)
+            finally:
+                cur.close()
+
+        try:
+            error, status, changed_email = await database.run(_apply)
+            if error:
+                return Response(media_type="application/json", content=json.dumps({"ok": False, "error": error}), status_code=status)
 
             # Gestisce cambio email: aggiorna cookie se necessario
-            changed_email = next((v for k, v in update_pairs if k == "email"), None)
             resp = Response(media_type="application/json", content=json.dumps({"ok": True}))
             if changed_email and changed_email != current_email:
                 try:
@@ -1029,11 +889,6 @@ class SiteSenseApp:
         except Exception as e:
             logger.exception("Errore update_profile: %s", e)
             return Response(media_type="application/json", content=json.dumps({"ok": False, "error": "Errore server"}), status_code=500)
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
 
 
     
@@ -1070,7 +925,7 @@ class SiteSenseApp:
             return None
 
         try:
-            async with httpx.AsyncClient(follow_redirects=True, timeout=15) as client:
+            async with http_client.session(follow_redirects=True, timeout=15) as client:
                 params = {
                     "key": api_key,
                     "cx": cse_id,
@@ -1115,7 +970,7 @@ class SiteSenseApp:
             logger.warning(f"Google CSE non configurato: {e}")
             return None
         try:
-            async with httpx.AsyncClient(follow_redirects=True, timeout=15) as client:
+            async with http_client.session(follow_redirects=True, timeout=15) as client:
                 params = {
                     "key": api_key,
                     "cx": cse_id,
@@ -1203,25 +1058,18 @@ class SiteSenseApp:
         return None
 
     def _ensure_photo_table(self, conn):
-        """Crea la tabella Initalya.photo se non esiste, secondo photo.sql (city_id, url NOT NULL)."""
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS Initalya.photo (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    city_id INT NOT NULL,
-                    url VARCHAR(255) NOT NULL,
-                    titolo VARCHAR(255) NOT NULL,
-                    FOREIGN KEY (city_id) REFERENCES cities(id) ON DELETE CASCADE
-                )
-                """
-            )
-            conn.commit()
-        except Exception as e:
-            logger.warning(f"Errore creazione tabella Initalya.photo: {e}")
+        """Crea Initalya.photo se non esiste e applica la chiave indicizzata (vedi services/photo_cache.py)."""
+        photo_cache.migrate(conn)
 
     async def get_city_dish_image(self, city: str, dish: str):
+        """URL immagine del piatto per la citt�; richieste contemporanee per la stessa coppia condividono la ricerca."""
+        if not city or not dish:
+            logger.warning(f"Parametri mancanti: city={city}, dish={dish}")
+            return None
+        key = image_key("city_dish", dish, city)
+        return await image_flights.do(key, lambda: self._resolve_city_dish_image(city, dish))
+
+    async def _resolve_city_dish_image(self, city: str, dish: str):
         """Ottieni immagine piatto per citt�: riusa URL salvato in Initalya.photo o scarica e salva la prima volta.
         
         Questa funzione implementa un sistema di caching per le immagini dei piatti specifici di ogni citt�.
@@ -1236,82 +1084,38 @@ class SiteSenseApp:
         dish_name = dish.strip()
         logger.info(f"🔍 Ricerca immagine per piatto: '{dish_name}' nella citt�: '{city_name}'")
         
-        try:
-            conn = get_connection()
+        dish_query = f"{dish_name} {city_name}"
+
+        def _lookup(conn):
             if not conn:
                 logger.warning("Connessione DB non disponibile per get_city_dish_image")
+                return None, None
+            # ID della citt� dall'indice in memoria (inserita se non esiste)
+            city_id = city_index.get_or_create(conn, city_name)
+            # Chiave indicizzata (piatto, citt�); il confronto parziale sul titolo resta come ultimo livello
+            return city_id, photo_cache.lookup(conn, dish_name, city_id, fuzzy_patterns=[dish_name, dish_query, city_name])
+
+        try:
+            city_id, cached_url = await database.run(_lookup)
+            if cached_url:
+                logger.info(f"✅ Immagine trovata in cache per piatto '{dish_name}' in citt� '{city_name}': {cached_url}")
+                return cached_url
+            if not city_id:
                 return None
-                
-            cur = conn.cursor(dictionary=True)
-            
-            # Trova l'ID della citt�
-            cur.execute("SELECT id FROM Initalya.cities WHERE name = %s LIMIT 1", (city_name,))
-            city_row = cur.fetchone()
-            
-            if not city_row:
-                # Se la citt� non esiste, la inseriamo
-                cur.execute("INSERT INTO Initalya.cities (name) VALUES (%s)", (city_name,))
-                city_id = cur.lastrowid
-                conn.commit()
-                logger.info(f"✅ Creata nuova citt�: {city_name} (id: {city_id})")
-            else:
-                city_id = city_row['id']
-                logger.info(f"✅ Citt� trovata: {city_name} (id: {city_id})")
-            
-            # Controlla se esiste gi� un'immagine per questo piatto in questa citt�
-            # Cerca immagini con titolo che contiene il nome del piatto per questa citt� specifica
-            dish_query = f"{dish_name} {city_name}"
-            logger.info(f"🔍 Ricerca immagine per piatto '{dish_name}' in citt� '{city_name}' (city_id: {city_id})")
-            logger.info(f"🔍 Query di ricerca: titolo LIKE '%{dish_name}%' OR titolo LIKE '%{dish_query}%' OR titolo LIKE '%{city_name}%'")
-            
-            cur.execute("""
-                SELECT url, id, titolo FROM Initalya.photo 
-                WHERE city_id = %s AND (
-                    titolo LIKE %s OR 
-                    titolo LIKE %s OR 
-                    titolo LIKE %s
-                )
-                ORDER BY id DESC 
-                LIMIT 1
-            """, (city_id, f"%{dish_name}%", f"%{dish_query}%", f"%{city_name}%"))
-            photo_row = cur.fetchone()
-            
-            # Se troviamo un'immagine per questo piatto in questa citt�, la restituiamo (se non social)
-            if photo_row and photo_row['url']:
-                try:
-                    host = urllib.parse.urlparse(photo_row['url']).netloc.lower()
-                    if any(host == d or host.endswith("." + d) for d in [
-                        "instagram.com", "cdninstagram.com", "instagr.am", "facebook.com", "fbcdn.net", "m.facebook.com", "fbsbx.com", "tiktok.com"
-                    ]):
-                        logger.info(f"⛔ URL cache su dominio social ignorato: {photo_row['url']}")
-                    else:
-                        logger.info(f"✅ Immagine trovata in cache per piatto '{dish_name}' in citt� '{city_name}': {photo_row['url']} (titolo: {photo_row['titolo']})")
-                        conn.close()
-                        return photo_row['url']
-                except Exception:
-                    logger.info(f"✅ Immagine trovata in cache per piatto '{dish_name}' in citt� '{city_name}': {photo_row['url']} (titolo: {photo_row['titolo']})")
-                    conn.close()
-                    return photo_row['url']
-            else:
-                logger.info(f"🔄 Nessuna immagine trovata in cache per piatto '{dish_name}' in citt� '{city_name}'")
-            
+            logger.info(f"🔄 Nessuna immagine trovata in cache per piatto '{dish_name}' in citt� '{city_name}'")
+
             # Se non esiste, scarica l'immagine
             url = await self.google_image_search_url(dish_query, excluded_domains=["wikipedia.org", "wikimedia.org"])
-            
+
             if not url:
                 logger.warning(f"Impossibile trovare immagine per piatto '{dish_name}' in citt� '{city_name}'")
-                conn.close()
                 return None
-            
+
             # Salva l'URL nella tabella photo con il nome del piatto come titolo
             logger.info(f"💾 Salvataggio nuova immagine per piatto '{dish_name}' in citt� '{city_name}' (city_id: {city_id}): {url}")
-            cur.execute("INSERT INTO Initalya.photo (city_id, url, titolo) VALUES (%s, %s, %s)", (city_id, url, dish_name))
-            conn.commit()
-            logger.info(f"✅ Immagine salvata con successo per piatto '{dish_name}' in citt� '{city_name}' (city_id: {city_id})")
-            
-            conn.close()
+            await database.run(lambda conn: photo_cache.store(conn, dish_name, city_id, url) if conn else False)
             return url
-            
+
         except Exception as e:
             logger.error(f"Errore in get_city_dish_image per '{dish_name}' in '{city_name}': {e}")
             return None
@@ -1322,287 +1126,229 @@ class SiteSenseApp:
         query_params = request.query_params
         dish = query_params.get("dish")
         city = query_params.get("city")
-        
+
         if not dish:
             raise HTTPException(status_code=400, detail="Parametro 'dish' mancante")
-        
-        name = dish.strip()
+
+        url = await self.dish_image_url(dish, city)
+        if not url:
+            raise HTTPException(status_code=502, detail="Immagine non disponibile via Google CSE")
+        return await self._serve_image(url, request, query_params.get("v") or "card")
+
+    async def _serve_image(self, url: str, request: Optional[Request], variant: str):
+        """Variante dal proxy immagini (cache su disco); se non disponibile, redirect all'originale."""
+        if settings.image_proxy_enabled:
+            image = await image_proxy.get(url, variant)
+            if image is not None:
+                return image_response(image, request, IMAGE_MAX_AGE_SECONDS)
+        return RedirectResponse(url, status_code=307)
+
+    async def dish_image_url(self, dish: str, city: Optional[str] = None) -> Optional[str]:
+        """URL immagine di un piatto (città facoltativa). Richieste contemporanee per lo stesso
+        piatto e la stessa città condividono un'unica ricerca e un unico salvataggio."""
+        name = (dish or "").strip()
+        city_name = (city or "").strip() or None
+        if not name:
+            return None
+        key = image_key("dish", name, city_name)
+        return await image_flights.do(key, lambda: self._resolve_dish_image(name, city_name))
+
+    async def _resolve_dish_image(self, name: str, city_name: Optional[str]) -> Optional[str]:
         query = name
-        city_name = None
-        
-        if city:
-            c = city.strip()
-            if c:
-                query = f"{name} {c}"
-                city_name = c
-                logger.info(f"🎯 Città '{city_name}' fornita esplicitamente dal parametro city")
-        
-        # Se nessuna città è specificata (esplicitamente), prova a estrarla dal nome del piatto
-        if not city_name:
-            # Estrai la città dal nome del piatto se presente (es. "Spaghetti all'Assassina Bari")
-            # Questo è utile quando il piatto contiene il nome della città
-            words = name.split()
-            for word in words:
-                # Controlla se questa parola potrebbe essere una città italiana
-                if len(word) > 2 and word[0].isupper():
-                    # Prova a cercare questa parola come città nel database
-                    conn = get_connection()
-                    if conn:
-                        try:
-                            cur = conn.cursor(dictionary=True)
-                            # Cerca corrispondenza esatta prima
-                            cur.execute("SELECT name FROM Initalya.cities WHERE name = %s LIMIT 1", (word,))
-                            city_row = cur.fetchone()
-                            if city_row:
-                                city_name = city_row['name']
-                                logger.info(f"🎯 Città '{city_name}' estratta dal nome del piatto '{name}'")
-                                query = f"{name} {city_name}"
-                                conn.close()
-                                break
-                            else:
-                                # Prova con corrispondenza parziale
-                                cur.execute("SELECT name FROM Initalya.cities WHERE name LIKE %s LIMIT 1", (f"%{word}%",))
-                                city_row = cur.fetchone()
-                                if city_row:
-                                    city_name = city_row['name']
-                                    logger.info(f"🎯 Città '{city_name}' estratta (corrispondenza parziale) dal nome del piatto '{name}'")
-                                    query = f"{name} {city_name}"
-                                    conn.close()
-                                    break
-                            conn.close()
-                        except Exception as e:
-                            logger.warning(f"Errore nel tentativo di estrarre città dal piatto: {e}")
-                            if conn:
-                                conn.close()
-        
-        if city_name:
-            logger.info(f"Richiesta immagine per dish='{name}' con city='{city_name}'")
-        else:
-            logger.info(f"Richiesta immagine per dish='{name}' senza città specificata")
-        
-        # Prova a trovare la città nel database
-        city_id = None
         if city_name:
-            conn = get_connection()
-            if conn:
-                try:
-                    cur = conn.cursor(dictionary=True)
-                    cur.execute("SELECT id FROM Initalya.cities WHERE name = %s LIMIT 1", (city_name,))
-                    city_row = cur.fetchone()
-                    if city_row:
-                        city_id = city_row['id']
-                        logger.info(f"✅ Città '{city_name}' trovata con ID: {city_id}")
-                    else:
-                        # Se la città non esiste, la inserisce
-                        logger.info(f"Città '{city_name}' non trovata, la inserisco nel database")
-                        cur.execute("INSERT INTO Initalya.cities (name) VALUES (%s)", (city_name,))
-                        city_id = cur.lastrowid
-                        conn.commit()
-                        logger.info(f"✅ Inserita nuova città '{city_name}' con ID: {city_id}")
-                    conn.close()
-                except Exception as e:
-                    logger.warning(f"Errore nel recupero/inserimento città '{city_name}': {e}")
-                    if conn:
-                        conn.close()
-        
-        # Controlla se l'immagine esiste già nel database (cache) in modo più permissivo
-        if city_id is not None:
-            conn = get_connection()
-            if conn:
-                try:
-                    cur = conn.cursor(dictionary=True)
-                    logger.info(f"🔍 Controllo cache per dish='{name}' e city_id={city_id} (match esatto o parziale)")
-
-                    # Prova prima match esatto, poi parziale sul titolo
-                    cur.execute(
-                        """
-                        SELECT url FROM Initalya.photo
-                        WHERE city_id = %s AND (titolo = %s OR titolo LIKE %s)
-                        ORDER BY id DESC
-                        LIMIT 1
-                        """,
-                        (city_id, name, f"%{name}%")
-                    )
-                    photo_row = cur.fetchone()
-
-                    if photo_row and photo_row['url']:
-                        try:
-                            host = urllib.parse.urlparse(photo_row['url']).netloc.lower()
-                            if any(host == d or host.endswith("." + d) for d in [
-                                "instagram.com", "cdninstagram.com", "instagr.am", "facebook.com", "fbcdn.net", "m.facebook.com", "fbsbx.com", "tiktok.com"
-                            ]):
-                                logger.info(f"⛔ URL cache su dominio social ignorato: {photo_row['url']}")
-                            else:
-                                logger.info(f"✅ Immagine trovata in cache per '{name}' nella città {city_id}: {photo_row['url']}")
-                                conn.close()
-                                return RedirectResponse(photo_row['url'])
-                        except Exception:
-                            logger.info(f"✅ Immagine trovata in cache per '{name}' nella città {city_id}: {photo_row['url']}")
-                            conn.close()
-                            return RedirectResponse(photo_row['url'])
-
-                    logger.info("🔄 Immagine non trovata in cache per città specifica, valuterò fallback globale")
-                    conn.close()
-                except Exception as e:
-                    logger.warning(f"Errore nel controllo cache: {e}")
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
+            query = f"{name} {city_name}"
+            logger.info(f"🎯 Città '{city_name}' fornita esplicitamente dal parametro city")
 
-        # Fallback: cerca in cache globale per titolo quando la città non è disponibile o non dà risultati
-        if city_id is None:
-            conn = get_connection()
-            if conn:
+        def _resolve(conn):
+            """Città (esplicita o dedotta dal piatto), relativo id e immagine già salvata, con una sola connessione."""
+            resolved_city, resolved_query, resolved_city_id, cached_url = city_name, query, None, None
+            if not conn:
+                return resolved_city, resolved_query, resolved_city_id, cached_url
+            city_index.ensure_fresh(conn)
+
+            # Se nessuna città è specificata (esplicitamente), prova a estrarla dal nome del piatto
+            # (es. "Spaghetti all'Assassina Bari") con l'indice in memoria, senza query
+            if not resolved_city:
+                found = city_index.find_in_text(name)
+                if found:
+                    resolved_city = found[1]
+                    resolved_query = f"{name} {resolved_city}"
+                    logger.info(f"🎯 Città '{resolved_city}' estratta dal nome del piatto '{name}'")
+
+            if resolved_city:
+                logger.info(f"Richiesta immagine per dish='{name}' con city='{resolved_city}'")
+                # Id della città dall'indice; inserita nel database solo se nuova
                 try:
-                    cur = conn.cursor(dictionary=True)
-                    logger.info(f"🔍 Fallback cache globale per dish='{name}' (match esatto o parziale)")
-                    cur.execute(
-                        """
-                        SELECT url, city_id, titolo FROM Initalya.photo
-                        WHERE titolo = %s OR titolo LIKE %s
-                        ORDER BY id DESC
-                        LIMIT 1
-                        """,
-                        (name, f"%{name}%")
-                    )
-                    photo_row = cur.fetchone()
-                    if photo_row and photo_row['url']:
-                        try:
-                            host = urllib.parse.urlparse(photo_row['url']).netloc.lower()
-                            if any(host == d or host.endswith("." + d) for d in [
-                                "instagram.com", "cdninstagram.com", "instagr.am", "facebook.com", "fbcdn.net", "tiktok.com"
-                            ]):
-                                logger.info(f"⛔ URL cache su dominio social ignorato: {photo_row['url']}")
-                            else:
-                                logger.info(
-                                    f"✅ Immagine trovata in cache globale per '{name}': {photo_row['url']} (city_id={photo_row.get('city_id')}, titolo='{photo_row.get('titolo')}')"
-                                )
-                                conn.close()
-                                return RedirectResponse(photo_row['url'])
-                        except Exception:
-                            logger.info(
-                                f"✅ Immagine trovata in cache globale per '{name}': {photo_row['url']} (city_id={photo_row.get('city_id')}, titolo='{photo_row.get('titolo')}')"
-                            )
-                            conn.close()
-                            return RedirectResponse(photo_row['url'])
-                    logger.info("🔄 Nessuna immagine trovata in cache globale, procederò con Google CSE")
-                    conn.close()
+                    resolved_city_id = city_index.get_or_create(conn, resolved_city)
                 except Exception as e:
-                    logger.warning(f"Errore nel controllo cache globale: {e}")
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
-        
+                    logger.warning(f"Errore nel recupero/inserimento città '{resolved_city}': {e}")
+            else:
+                logger.info(f"Richiesta immagine per dish='{name}' senza città specificata")
+
+            # Immagine già salvata: chiave indicizzata (piatto, città) o, senza città, su tutte le città;
+            # il confronto parziale sul titolo resta come ultimo livello
+            try:
+                cached_url = photo_cache.lookup(conn, name, resolved_city_id, fuzzy_patterns=[name])
+                if cached_url:
+                    logger.info(f"✅ Immagine trovata in cache per '{name}' (city_id={resolved_city_id}): {cached_url}")
+                else:
+                    logger.info("🔄 Immagine non trovata in cache, procederò con Google CSE")
+            except Exception as e:
+                logger.warning(f"Errore nel controllo cache: {e}")
+            return resolved_city, resolved_query, resolved_city_id, cached_url
+
+        city_id, cached_url = None, None
+        try:
+            city_name, query, city_id, cached_url = await database.run(_resolve)
+        except Exception as e:
+            logger.warning(f"Errore accesso DB per immagine '{name}': {e}")
+        if cached_url:
+            return cached_url
+
         # Scarica l'immagine da Google CSE
         url = await self.google_image_search_url(query, excluded_domains=["wikipedia.org", "wikimedia.org"])
-        
+
         if not url:
             logger.warning(f"❌ Impossibile trovare immagine per '{name}' su Google CSE")
-            raise HTTPException(status_code=502, detail="Immagine non disponibile via Google CSE")
-        
+            return None
+
         logger.info(f"✅ Immagine trovata su Google CSE per '{name}': {url}")
 
-        # Prepara il redirect con status 307
-        redirect_response = RedirectResponse(url, status_code=307)
+        # Salva l'immagine nel database (upsert sulla chiave piatto/città, URL social esclusi)
+        if city_id:
+            def _store(conn):
+                if conn and photo_cache.store(conn, name, city_id, url):
+                    logger.info(f"✅ Immagine salvata con successo per '{name}' nella città {city_id}: {url}")
 
-        # Salva l'immagine nel database SOLO se rispondiamo con messaggio 307
-        if city_id and redirect_response.status_code == 307:
-            conn = get_connection()
-            if conn:
-                try:
-                    cur = conn.cursor()
-                    # Evita salvataggi se l'URL appartiene a un dominio social
-                    try:
-                        host = urllib.parse.urlparse(url).netloc.lower()
-                        if any(host == d or host.endswith("." + d) for d in [
-                            "instagram.com", "cdninstagram.com", "instagr.am", "facebook.com", "fbcdn.net", "m.facebook.com", "fbsbx.com", "tiktok.com"
-                        ]):
-                            logger.info(f"⛔ Salvataggio evitato per URL social: {url}")
-                        else:
-                            logger.info(f"💾 Salvataggio immagine nel database per '{name}' con city_id={city_id} (solo se 307)")
-                            cur.execute("INSERT INTO Initalya.photo (city_id, url, titolo) VALUES (%s, %s, %s)", 
-                                       (city_id, url, name))
-                            conn.commit()
-                            logger.info(f"✅ Immagine salvata con successo per '{name}' nella città {city_id}: {url}")
-                    except Exception as e:
-                        logger.warning(f"Errore nel controllo dominio social per salvataggio: {e}")
-                    conn.close()
-                except Exception as e:
-                    logger.warning(f"Errore nel salvataggio immagine: {e}")
-                    if conn:
-                        conn.close()
+            try:
+                await database.run(_store)
+            except Exception as e:
+                logger.warning(f"Errore nel salvataggio immagine: {e}")
 
-        return redirect_response
+        return url
 
-    async def city_image(self, city: str):
-        """Reindirizza a un'immagine città: riusa URL salvato in Initalya.cities o salva la prima volta."""
-        if not city:
+    async def city_image(self, city: str, v: Optional[str] = None, request: Request = None):
+        """Immagine città: riusa URL salvato in Initalya.cities o salva la prima volta."""
+        if not city or not city.strip():
             raise HTTPException(status_code=400, detail="Parametro 'city' mancante")
-        name = city.strip()
+        url = await self.city_image_url(city)
+        if not url:
+            raise HTTPException(status_code=502, detail="Immagine città non disponibile via Google CSE")
+        return await self._serve_image(url, request, v or "hero")
+
+    async def place_photo(self, ref: str, v: Optional[str] = None, request: Request = None):
+        """Foto di un luogo Google Places alla larghezza della variante richiesta, servita dal proxy."""
+        if not ref or not ref.strip():
+            raise HTTPException(status_code=400, detail="Parametro 'ref' mancante")
+        variant = variant_name(v)
+        url = (
+            "https://maps.googleapis.com/maps/api/place/photo"
+            f"?maxwidth={VARIANTS[variant]}&photo_reference={urllib.parse.quote(ref.strip())}"
+            f"&key={settings.google_maps_api_key}"
+        )
+        if not settings.image_proxy_enabled:
+            # Proxy disattivato (IMAGE_PROXY_ENABLED=false): redirect all'originale, come _serve_image
+            return RedirectResponse(url, status_code=307)
+        image = await image_proxy.get(url, variant)
+        if image is None:
+            raise HTTPException(status_code=502, detail="Foto non disponibile")
+        return image_response(image, request, IMAGE_MAX_AGE_SECONDS)
+
+    async def city_image_url(self, city: str) -> Optional[str]:
+        """URL immagine di una città; richieste contemporanee per la stessa città condividono la ricerca."""
+        name = (city or "").strip()
+        if not name:
+            return None
+        return await image_flights.do(image_key("city", city=name), lambda: self._resolve_city_image(name))
 
+    async def _resolve_city_image(self, name: str) -> Optional[str]:
         # Prima: prova a riutilizzare URL già salvato per questa città
+        def _load_saved_photo(conn):
+            if not conn:
+                return None
+            self._ensure_photo_table(conn)
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT photo FROM Initalya.cities WHERE name = %s LIMIT 1", (name,))
+                row = cur.fetchone()
+                return row[0] if row and row[0] else None
+            except Exception as e:
+                logger.warning(f"Errore lettura Initalya.cities per città '{name}': {e}")
+                return None
+            finally:
+                cur.close()
+
         try:
-            conn = get_connection()
-            if conn:
-                self._ensure_photo_table(conn)
-                cur = conn.cursor()
-                try:
-                    cur.execute("SELECT photo FROM Initalya.cities WHERE name = %s LIMIT 1", (name,))
-                    row = cur.fetchone()
-                    if row and row[0]:
-                        saved_url = row[0]
-                        logger.info(f"URL foto città già salvato trovato: {name} -> {saved_url}")
-                        conn.close()
-                        return RedirectResponse(saved_url)
-                except Exception as e:
-                    logger.warning(f"Errore lettura Initalya.cities per città '{name}': {e}")
-                finally:
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
+            saved_url = await database.run(_load_saved_photo)
+            if saved_url:
+                logger.info(f"URL foto città già salvato trovato: {name} -> {saved_url}")
+                return saved_url
         except Exception as e:
             logger.warning(f"Errore accesso DB per riuso foto città '{name}': {e}")
 
         # Se non c'è già, ottieni esclusivamente un URL immagine via Google CSE
         url = await self.google_image_search_url(name)
         if not url:
-            raise HTTPException(status_code=502, detail="Immagine città non disponibile via Google CSE")
+            return None
 
-        # Inserisci nuova riga (citta, url) solo se non esiste già
-        try:
-            conn = get_connection()
-            if conn:
-                self._ensure_photo_table(conn)
-                cur = conn.cursor()
+        # Upsert: città dall'indice (inserita solo se nuova), poi aggiornamento della foto per id
+        def _store_photo(conn):
+            if not conn:
+                return
+            try:
+                city_id = city_index.get_or_create(conn, name)
+                cur = conn.cursor()
                 try:
-                    # Inserisce solo se non esiste già una riga per la città
-                    cur.execute("SELECT id, photo FROM Initalya.cities WHERE name = %s LIMIT 1", (name,))
-                    exists = cur.fetchone()
-                    if exists:
-                        cur.execute("UPDATE Initalya.cities SET photo = %s WHERE name = %s", (url, name))
-                        conn.commit()
-                        logger.info(f"Aggiornata foto città (colonna 'photo') in Initalya.cities: {name} -> {url}")
-                    else:
-                        cur.execute("INSERT INTO Initalya.cities (name, photo) VALUES (%s, %s)", (name, url))
-                        conn.commit()
-                        logger.info(f"Persistenza foto città (colonna 'photo') in Initalya.cities: {name} -> {url}")
-                except Exception as e:
-                    logger.warning(f"Errore inserimento/aggiornamento Initalya.cities per città '{name}': {e}")
+                    cur.execute("UPDATE Initalya.cities SET photo = %s WHERE id = %s", (url, city_id))
+                    conn.commit()
                 finally:
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
+                    cur.close()
+                logger.info(f"Persistenza foto città (colonna 'photo') in Initalya.cities: {name} -> {url}")
+            except Exception as e:
+                logger.warning(f"Errore inserimento/aggiornamento Initalya.cities per città '{name}': {e}")
+
+        try:
+            await database.run(_store_photo)
         except Exception as e:
             logger.warning(f"Errore nel salvataggio foto città per '{name}': {e}")
 
-        # Reindirizza al link trovato via CSE
-        return RedirectResponse(url)
+        return url
+
+    async def image_batch(self, request: Request):
+        """URL immagine di più piatti/città in una sola chiamata.
+
+        Corpo: {"items": [{"dish": "Orecchiette", "city": "Bari"}, {"city": "Lecce"}, ...]}
+        (solo "city" = foto della città). Risposta: {"results": [{"dish", "city", "url"}, ...]}
+        nello stesso ordine; "url" è null se l'immagine non è disponibile.
+        """
+        try:
+            data = await request.json()
+        except Exception:
+            raise HTTPException(status_code=400, detail="JSON non valido")
+        items = data.get("items") if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Campo 'items' mancante")
+        if len(items) > IMAGE_BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Massimo {IMAGE_BATCH_MAX_ITEMS} elementi per richiesta")
+
+        async def _one(item):
+            item = item if isinstance(item, dict) else {}
+            dish = str(item.get("dish") or "").strip()
+            city = str(item.get("city") or "").strip()
+            url = None
+            try:
+                if dish:
+                    url = await self.dish_image_url(dish, city or None)
+                elif city:
+                    url = await self.city_image_url(city)
+            except Exception as e:
+                logger.warning(f"Errore risoluzione immagine batch dish='{dish}' city='{city}': {e}")
+            return {"dish": dish or None, "city": city or None, "url": url}
+
+        # Gli elementi duplicati nel lotto condividono la stessa ricerca (single-flight)
+        return {"results": await asyncio.gather(*(_one(item) for item in items))}
 
-    async def city_dish_image(self, city: str, dish: str):
+    async def city_dish_image(self, city: str, dish: str, v: Optional[str] = None, request: Request = None):
         """Endpoint per ottenere immagini di piatti specifici per citt� con caching nel database."""
         if not city or not dish:
             raise HTTPException(status_code=400, detail="Parametri 'city' e 'dish' richiesti")
@@ -1614,7 +1360,7 @@ class SiteSenseApp:
         image_url = await self.get_city_dish_image(city_name, dish_name)
         
         if image_url:
-            return RedirectResponse(image_url)
+            return await self._serve_image(image_url, request, v or "card")
         else:
             raise HTTPException(status_code=502, detail="Immagine piatto non disponibile via Google CSE")
 
@@ -1632,74 +1378,35 @@ class SiteSenseApp:
         item_name = item_name.strip()
         logger.info(f"🔍 Ricerca immagine per item='{item_name}' nella città ID={city_id}")
         
+        # Usa direttamente item_name come titolo per la tabella photo
+        titolo = item_name
         try:
-            conn = get_connection()
-            if not conn:
-                logger.warning("❌ Connessione DB non disponibile per get_intro_page_image")
-                return None
-                
-            cur = conn.cursor(dictionary=True)
-            
-            # Controlla se esiste già un'immagine per questo elemento nella città specificata
-            titolo = item_name  # Usa direttamente item_name come titolo per la tabella photo
             logger.info(f"🔍 Controllo cache per titolo='{titolo}' e city_id={city_id}")
-            
-            cur.execute("""
-                SELECT url, id, titolo FROM Initalya.photo 
-                WHERE city_id = %s AND titolo = %s
-                ORDER BY id DESC 
-                LIMIT 1
-            """, (city_id, titolo))
-            photo_row = cur.fetchone()
-            
-            if photo_row and photo_row['url']:
-                # Immagine trovata nel cache: ignora se proviene da domini social
-                try:
-                    host = urllib.parse.urlparse(photo_row['url']).netloc.lower()
-                    if any(host == d or host.endswith("." + d) for d in [
-                        "instagram.com", "cdninstagram.com", "instagr.am", "facebook.com", "fbcdn.net", "tiktok.com"
-                    ]):
-                        logger.info(f"⛔ URL cache su dominio social ignorato: {photo_row['url']}")
-                    else:
-                        logger.info(f"✅ Immagine trovata in cache per '{titolo}' nella città {city_id}: {photo_row['url']}")
-                        conn.close()
-                        return photo_row['url']
-                except Exception:
-                    logger.info(f"✅ Immagine trovata in cache per '{titolo}' nella città {city_id}: {photo_row['url']}")
-                    conn.close()
-                    return photo_row['url']
-            
+            cached_url = await database.run(lambda conn: photo_cache.lookup(conn, titolo, city_id))
+            if cached_url:
+                logger.info(f"✅ Immagine trovata in cache per '{titolo}' nella città {city_id}: {cached_url}")
+                return cached_url
+
             logger.info(f"🔄 Immagine non trovata in cache, procedo con download da Google CSE")
-            
+
             # Se non esiste, scarica l'immagine da Google CSE
             url = await self.google_image_search_url(titolo, excluded_domains=["wikipedia.org", "wikimedia.org"])
-            
+
             if not url:
                 logger.warning(f"❌ Impossibile trovare immagine per '{item_name}' su Google CSE")
-                conn.close()
                 return None
-            
+
             logger.info(f"✅ Immagine trovata su Google CSE per '{item_name}': {url}")
-            
-            # Salva l'URL nella tabella photo con il titolo come identificatore (evita domini social)
+
+            # Salva l'URL nella tabella photo con il titolo come identificatore (URL social esclusi)
             try:
-                host = urllib.parse.urlparse(url).netloc.lower()
-                if any(host == d or host.endswith("." + d) for d in [
-                    "instagram.com", "cdninstagram.com", "instagr.am", "facebook.com", "fbcdn.net", "tiktok.com"
-                ]):
-                    logger.info(f"⛔ Salvataggio evitato per URL social: {url}")
-                else:
-                    logger.info(f"💾 Salvataggio immagine nel database per '{titolo}' con city_id={city_id}")
-                    cur.execute("INSERT INTO Initalya.photo (city_id, url, titolo) VALUES (%s, %s, %s)", 
-                               (city_id, url, titolo))
-                    conn.commit()
+                if await database.run(lambda conn: photo_cache.store(conn, titolo, city_id, url) if conn else False):
                     logger.info(f"✅ Immagine salvata con successo per '{titolo}' nella città {city_id}: {url}")
             except Exception as e:
-                logger.warning(f"Errore controllo dominio social per salvataggio intro: {e}")
-            
-            conn.close()
+                logger.warning(f"Errore nel salvataggio immagine intro: {e}")
+
             return url
-            
+
         except Exception as e:
             logger.error(f"❌ Errore in get_intro_page_image per '{item_name}' città {city_id}: {e}")
             return None
@@ -1714,33 +1421,18 @@ class SiteSenseApp:
         item_name = item.strip()
         logger.info(f"Richiesta immagine intro per città='{city_name}', item='{item_name}'")
         
-        # Trova o crea la città nel database
-        conn = get_connection()
-        if not conn:
+        # Trova o crea la città (indice in memoria, DB solo se non la conosce)
+        try:
+            city_id = await database.run(city_index.get_or_create, city_name)
+        except Exception as e:
+            logger.error(f"❌ Errore nel recupero città per intro_page_image: {e}")
+            raise HTTPException(status_code=500, detail="Errore interno del server")
+        if city_id is None:
             logger.error("Database non disponibile per intro_page_image")
             raise HTTPException(status_code=503, detail="Database non disponibile")
-        
+        logger.info(f"✅ Città '{city_name}' con ID: {city_id}")
+
         try:
-            cur = conn.cursor(dictionary=True)
-            
-            # Verifica se la città esiste
-            logger.info(f"Verifico esistenza città '{city_name}' nel database")
-            cur.execute("SELECT id FROM Initalya.cities WHERE name = %s LIMIT 1", (city_name,))
-            city_row = cur.fetchone()
-            
-            if not city_row:
-                # Se la città non esiste, la inserisce nel database
-                logger.info(f"Città '{city_name}' non trovata, la inserisco nel database")
-                cur.execute("INSERT INTO Initalya.cities (name) VALUES (%s)", (city_name,))
-                city_id = cur.lastrowid
-                conn.commit()
-                logger.info(f"✅ Inserita nuova città '{city_name}' con ID: {city_id}")
-            else:
-                city_id = city_row['id']
-                logger.info(f"✅ Città '{city_name}' trovata con ID: {city_id}")
-            
-            conn.close()
-            
             # Prova a recuperare l'immagine salvata per questa città
             logger.info(f"Provo a recuperare immagine per item='{item_name}' e città ID={city_id}")
             image_url = await self.get_intro_page_image(item_name, city_id)
@@ -1755,7 +1447,7 @@ class SiteSenseApp:
         except HTTPException:
             raise
         except Exception as e:
-            logger.error(f"❌ Errore nel recupero città per intro_page_image: {e}")
+            logger.error(f"❌ Errore nel recupero immagine per intro_page_image: {e}")
             raise HTTPException(status_code=500, detail="Errore interno del server")
 
     async def login_page(self, request: Request, next: str = "/"):
@@ -1786,22 +1478,19 @@ class SiteSenseApp:
                 "login_super_admin.html",
                 {"request": request, "error_message": "Credenziali mancanti."}
             )
-        conn = get_connection()
-        if not conn:
-            return self.templates.TemplateResponse(
-                "login_super_admin.html",
-                {"request": request, "error_message": "Database non disponibile."}
-            )
-        try:
+        def _verify(conn):
+            """(utente trovato, password corretta, messaggio d'errore); None se il DB non è disponibile.
+            Anche bcrypt gira qui, fuori dall'event loop."""
+            if not conn:
+                return None
             cur = conn.cursor(dictionary=True)
-            cur.execute("SELECT * FROM Initalya.superadmins WHERE email = %s", (email,))
-            row = cur.fetchone()
+            try:
+                cur.execute("SELECT * FROM Initalya.superadmins WHERE email = %s", (email,))
+                row = cur.fetchone()
+            finally:
+                cur.close()
             if not row:
-                conn.close()
-                return self.templates.TemplateResponse(
-                    "login_super_admin.html",
-                    {"request": request, "error_message": "Email o password non corretti."}
-                )
+                return False, False, None
             ok = False
             err_msg = None
             # Verifica password con bcrypt se disponibile
@@ -1826,7 +1515,21 @@ class SiteSenseApp:
                         logger.warning(f"Errore verifica bcrypt: {_e}")
                         err_msg = "Errore durante la verifica della password."
                         ok = False
-            conn.close()
+            return True, ok, err_msg
+
+        try:
+            result = await database.run(_verify)
+            if result is None:
+                return self.templates.TemplateResponse(
+                    "login_super_admin.html",
+                    {"request": request, "error_message": "Database non disponibile."}
+                )
+            found, ok, err_msg = result
+            if not found:
+                return self.templates.TemplateResponse(
+                    "login_super_admin.html",
+                    {"request": request, "error_message": "Email o password non corretti."}
+                )
             if not ok:
                 return self.templates.TemplateResponse(
                     "login_super_admin.html",
@@ -1848,10 +1551,6 @@ class SiteSenseApp:
                     pass
             return resp
         except Exception as e:
-            try:
-                conn.close()
-            except Exception:
-                pass
             return self.templates.TemplateResponse(
                 "login_super_admin.html",
                 {"request": request, "error_message": f"Errore imprevisto: {str(e)}"}
@@ -1866,27 +1565,27 @@ class SiteSenseApp:
         resp.set_cookie(key="user_email",value=user_email,path="/",samesite="lax")
 
         # Imposta cookie con numero ruolo se disponibile nel DB (fallback 3)
+        def _fetch_user(conn):
+            if not conn:
+                return {}
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("SELECT * FROM Initalya.users WHERE email = %s", (user_email,))
+                return cur.fetchone() or {}
+            finally:
+                cur.close()
+
         role_num = 3
-        conn = get_connection()
         try:
-            if conn:
-                cur = conn.cursor(dictionary=True)
-                try:
-                    cur.execute("SELECT * FROM Initalya.users WHERE email = %s", (user_email,))
-                    row = cur.fetchone() or {}
-                    for key in ("role_number", "role", "user_role"):
-                        val = row.get(key)
-                        if val is not None:
-                            try:
-                                role_num = int(val)
-                            except Exception:
-                                pass
-                            break
-                finally:
+            row = await database.run(_fetch_user)
+            for key in ("role_number", "role", "user_role"):
+                val = row.get(key)
+                if val is not None:
                     try:
-                        conn.close()
+                        role_num = int(val)
                     except Exception:
                         pass
+                    break
         except Exception:
             pass
         try:
@@ -1913,257 +1612,65 @@ class SiteSenseApp:
         except Exception:
             num_locali = len(locali)
 
-        conn = get_connection()
-        if not conn:
-            return {"success": False, "error": "Connessione DB non disponibile"}
-        try:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT id FROM Initalya.users WHERE email = %s", (email,))
-            user = cursor.fetchone()
-            if not user:
-                return {"success": False, "error": "Utente non trovato"}
-
-            user_id = user["id"]
-
-            has_city = False
-            has_city_id = False
+        def _save(repo):
+            if repo is None:
+                return {"success": False, "error": "Connessione DB non disponibile"}
             try:
-                cursor.execute("SHOW COLUMNS FROM Initalya.programs LIKE 'city'")
-                has_city = cursor.fetchone() is not None
-                cursor.execute("SHOW COLUMNS FROM Initalya.programs LIKE 'city_id'")
-                has_city_id = cursor.fetchone() is not None
-            except Exception:
-                pass
-
-            if has_city_id:
-                def _norm_city(s: str) -> str:
-                    t = (s or "").strip()
-                    if not t or t.lower() == "none":
-                        return ""
-                    t = re.sub(r",.*$", "", t)
-                    t = re.sub(r"\s+[A-Z]{2}$", "", t)
-                    t = re.sub(r"\b(italia|italy)\b", "", t, flags=re.I)
-                    t = re.sub(r"\s+", " ", t).strip()
-                    return t
-                city_name = _norm_city(city) or "Non specificata"
-                cursor.execute("SELECT id FROM Initalya.cities WHERE LOWER(name) = LOWER(%s)", (city_name,))
-                c = cursor.fetchone()
-                if not c:
-                    cursor.execute("SELECT id FROM Initalya.cities WHERE name LIKE %s", (f"%{city_name}%",))
-                    c = cursor.fetchone()
-                if c:
-                    city_id = c.get("id") if isinstance(c, dict) else c[0]
-                else:
-                    cursor.execute("INSERT INTO Initalya.cities (name) VALUES (%s)", (city_name,))
-                    city_id = cursor.lastrowid
-                cursor.execute(
-                    "INSERT INTO Initalya.programs (user_id, num_locali, city_id) VALUES (%s, %s, %s)",
-                    (user_id, num_locali, city_id)
-                )
-            elif has_city:
-                cursor.execute(
-                    "INSERT INTO Initalya.programs (user_id, num_locali, city) VALUES (%s, %s, %s)",
-                    (user_id, num_locali, (city or ""))
-                )
-            else:
-                cursor.execute(
-                    "INSERT INTO Initalya.programs (user_id, num_locali) VALUES (%s, %s)",
-                    (user_id, num_locali)
-                )
-            program_id = cursor.lastrowid
+                user_id = repo.get_user_id(email)
+                if not user_id:
+                    return {"success": False, "error": "Utente non trovato"}
+                # Programma e locali in un'unica transazione; i locali con un solo INSERT multi-riga
+                with repo.transaction("save_itinerary"):
+                    program_id = repo.create_program(user_id, num_locali, city)
+                    repo.insert_locals(program_id, locali)
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            return program_id
+
+        result = await repository.run(_save)
+        if isinstance(result, dict):
+            return result
+        # Salva due file JSON: (1) contenuto pagina 1 (piatti tipici), (2) risultati strutturati pagina 3.
+        # Dopo aver restituito la connessione al pool: la scrittura su disco non la tiene occupata.
+        return await self._save_itinerary_files(result, city, data, "Itinerario salvato su file")
+
+    async def _save_itinerary_files(self, program_id: int, city: Optional[str], data: dict, log_label: str) -> dict:
+        """Scrive page1_<id>.json (HTML piatti tipici) e page3_<id>.json (risultati strutturati)."""
+        try:
+            # Usa BASE_DIR per garantire il percorso assoluto corretto dentro il package sitesense
+            save_dir = os.path.join(str(BASE_DIR), "assets", "saved_itineraries")
+
+            # (1) Pagina 1: piatti tipici (HTML)
+            page1_payload = {
+                "program_id": program_id,
+                "city": (city or ""),
+                "page1_html": data.get("page1_html") or "",
+            }
+            page1_path = os.path.join(save_dir, f"page1_{program_id}.json")
 
-            # Inserimento locali con rilevamento dinamico delle colonne per compatibilit� schema
-            try:
-                cursor.execute("SHOW COLUMNS FROM Initalya.locals")
-                rows = cursor.fetchall() or []
-                loc_cols = [ (r.get("Field") if isinstance(r, dict) else r[0]) for r in rows ]
-            except Exception:
-                loc_cols = []
-
-            prog_candidates = ["program_id", "programma_id", "programId", "program", "id_programma"]
-            prog_col = next((c for c in prog_candidates if c in loc_cols), "program_id")
-            name_col = "name" if "name" in loc_cols else ("nome" if "nome" in loc_cols else "name")
-            addr_col = "address" if "address" in loc_cols else ("indirizzo" if "indirizzo" in loc_cols else "address")
-            type_col = "type_id" if "type_id" in loc_cols else ("type" if "type" in loc_cols else None)
-            place_col = "place_id" if "place_id" in loc_cols else None
-            # Coordinate e immagine (persistenza opzionale se colonne presenti)
-            lat_col = "lat" if "lat" in loc_cols else ("latitude" if "latitude" in loc_cols else None)
-            lng_col = "lng" if "lng" in loc_cols else ("longitude" if "longitude" in loc_cols else ("long" if "long" in loc_cols else None))
-            image_col = (
-                "image" if "image" in loc_cols else (
-                    "photo" if "photo" in loc_cols else (
-                        "photo_url" if "photo_url" in loc_cols else None
-                    )
-                )
+            # (2) Risultati strutturati pagina 3
+            page3_payload = {
+                "program_id": program_id,
+                "city": (city or ""),
+                "ranked": data.get("page3_ranked") or data.get("ranked") or {},
+            }
+            page3_path = os.path.join(save_dir, f"page3_{program_id}.json")
+            # Scritture atomiche in parallelo, fuori dall'event loop
+            await asyncio.gather(
+                json_storage.write(page1_path, page1_payload),
+                json_storage.write(page3_path, page3_payload),
             )
-            rating_col = "rating" if "rating" in loc_cols else None
 
-            def _extract_pid_from_url(u: str) -> str:
-                try:
-                    m = re.search(r"place_id:([^&]+)", u or "")
-                    return m.group(1) if m else ""
-                except Exception:
-                    return ""
-
-            def _fallback_pid(loc: dict) -> str:
-                base = f"{loc.get('name','').strip()}|{loc.get('address','').strip()}"
-                h = hashlib.md5(base.encode("utf-8")).hexdigest()[:16]
-                return f"manual_{h}"
-
-            for loc in locali:
-                columns = [prog_col]
-                values = [program_id]
-
-                if name_col:
-                    columns.append(name_col)
-                    values.append((loc.get("name") or ""))
-                if addr_col:
-                    columns.append(addr_col)
-                    values.append((loc.get("address") or ""))
-
-                if type_col:
-                    if type_col == "type_id":
-                        type_str = (loc.get("type") or "").strip()
-                        type_id = None
-                        try:
-                            cursor.execute("SELECT id FROM Initalya.types WHERE LOWER(typology) = LOWER(%s)", (type_str,))
-                            rr = cursor.fetchone()
-                            type_id = (rr.get("id") if isinstance(rr, dict) else (rr[0] if rr else None))
-                        except Exception:
-                            type_id = None
-                        if not type_id:
-                            # fallback: 3 = Ristoranti se presente, altrimenti 1
-                            try:
-                                cursor.execute("SELECT id FROM Initalya.types WHERE LOWER(typology) = LOWER(%s)", ("ristoranti",))
-                                rr2 = cursor.fetchone()
-                                type_id = (rr2.get("id") if isinstance(rr2, dict) else (rr2[0] if rr2 else None)) or 1
-                            except Exception:
-                                type_id = 1
-                        columns.append(type_col)
-                        values.append(type_id)
-                    else:
-                        columns.append(type_col)
-                        values.append((loc.get("type") or ""))
-
-                if place_col:
-                    pid = (loc.get("place_id") or _extract_pid_from_url(loc.get("url") or "") or "").strip()
-                    if not pid:
-                        pid = _fallback_pid(loc)
-                    columns.append(place_col)
-                    values.append(pid)
-
-                # Persisti lat/lng se presenti nello schema
-                if lat_col:
-                    columns.append(lat_col)
-                    try:
-                        values.append(loc.get("lat", None))
-                    except Exception:
-                        values.append(None)
-                if lng_col:
-                    columns.append(lng_col)
-                    try:
-                        values.append(loc.get("lng", None))
-                    except Exception:
-                        values.append(None)
-
-                # Persisti immagine se presente nello schema, tronca dinamicamente alla lunghezza della colonna (default 512)
-                if image_col:
-                    columns.append(image_col)
-                    img = (loc.get("image") or loc.get("photo") or loc.get("photo_url") or "")
-                    try:
-                        if isinstance(img, str):
-                            try:
-                                # Prova a leggere la lunghezza della colonna da INFORMATION_SCHEMA
-                                cursor.execute(
-                                    "SELECT CHARACTER_MAXIMUM_LENGTH, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
-                                    "WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s AND COLUMN_NAME=%s",
-                                    ("Initalya", "locals", image_col)
-                                )
-                                row = cursor.fetchone()
-                                if row:
-                                    max_len, data_type = row
-                                    # Se TEXT/xxxTEXT, non troncare; se VARCHAR/CHAR, tronca alla lunghezza
-                                    if data_type and str(data_type).lower().endswith("text"):
-                                        pass
-                                    elif max_len and isinstance(max_len, int) and len(img) > max_len:
-                                        img = img[:max_len]
-                                else:
-                                    # Fallback: tronca a 512
-                                    if len(img) > 512:
-                                        img = img[:512]
-                            except Exception:
-                                # Fallback sicuro: tronca a 512
-                                if len(img) > 512:
-                                    img = img[:512]
-                    except Exception:
-                        pass
-                    values.append(img)
-
-                # Persisti rating se presente nello schema
-                if rating_col:
-                    columns.append(rating_col)
-                    try:
-                        values.append(loc.get("rating", None))
-                    except Exception:
-                        values.append(None)
-
-                placeholders = ", ".join(["%s"] * len(values))
-                sql = f"INSERT INTO Initalya.locals ({', '.join(columns)}) VALUES ({placeholders})"
-                cursor.execute(sql, tuple(values))
-
-            conn.commit()
-            # Salva due file JSON: (1) contenuto pagina 1 (piatti tipici), (2) risultati strutturati pagina 3
-            try:
-                import os as _os, json as _json
-                # Usa BASE_DIR per garantire il percorso assoluto corretto dentro il package sitesense
-                save_dir = _os.path.join(str(BASE_DIR), "assets", "saved_itineraries")
-                _os.makedirs(save_dir, exist_ok=True)
-
-                # (1) Pagina 1: piatti tipici (HTML)
-                page1_html = data.get("page1_html") or ""
-                page1_payload = {
-                    "program_id": program_id,
-                    "city": (city or ""),
-                    "page1_html": page1_html,
-                }
-                page1_path = _os.path.join(save_dir, f"page1_{program_id}.json")
-                with open(page1_path, "w", encoding="utf-8") as f:
-                    _json.dump(page1_payload, f, ensure_ascii=False)
-
-                # (2) Risultati strutturati pagina 3
-                ranked_struct = data.get("page3_ranked") or data.get("ranked") or {}
-                page3_payload = {
-                    "program_id": program_id,
-                    "city": (city or ""),
-                    "ranked": ranked_struct,
-                }
-                page3_path = _os.path.join(save_dir, f"page3_{program_id}.json")
-                with open(page3_path, "w", encoding="utf-8") as f:
-                    _json.dump(page3_payload, f, ensure_ascii=False)
-
-                logger.info(
-                    f"Itinerario salvato su file: page1={page1_path}, page3={page3_path}"
-                )
-                return {
-                    "success": True,
-                    "program_id": program_id,
-                    "files_saved": {"page1": True, "page3": True},
-                    "file_paths": {"page1": page1_path, "page3": page3_path},
-                }
-            except Exception as _e:
-                logger.warning(f"Salvataggio file JSON (page1/page3) fallito: {_e}")
-                return {"success": True, "program_id": program_id, "files_saved": {"page1": False, "page3": False}}
-        except Exception as e:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
-            return {"success": False, "error": str(e)}
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
+            logger.info(f"{log_label}: page1={page1_path}, page3={page3_path}")
+            return {
+                "success": True,
+                "program_id": program_id,
+                "files_saved": {"page1": True, "page3": True},
+                "file_paths": {"page1": page1_path, "page3": page3_path},
+            }
+        except Exception as _e:
+            logger.warning(f"Salvataggio file JSON (page1/page3) fallito: {_e}")
+            return {"success": True, "program_id": program_id, "files_saved": {"page1": False, "page3": False}}
 
     async def update_program(self, request: Request):
         auth = request.cookies.get("auth")
@@ -2188,208 +1695,31 @@ class SiteSenseApp:
         except Exception:
             num_locali = len(locali)
 
-        conn = get_connection()
-        if not conn:
-            return {"success": False, "error": "Connessione DB non disponibile"}
-
-        try:
-            cursor = conn.cursor(dictionary=True)
-            # Utente corrente
-            cursor.execute("SELECT id FROM Initalya.users WHERE email = %s", (email,))
-            user = cursor.fetchone()
-            if not user:
-                conn.close()
-                return {"success": False, "error": "Utente non trovato"}
-
-            user_id = user["id"]
-
-            # Verifica propriet� del programma
-            cursor.execute(
-                "SELECT * FROM Initalya.programs WHERE id = %s AND user_id = %s",
-                (program_id, user_id)
-            )
-            program = cursor.fetchone()
-            if not program:
-                conn.close()
-                return {"success": False, "error": "Programma non trovato o non autorizzato"}
-
-            # Rileva colonne disponibili su programs
-            has_city = False
-            has_city_id = False
-            try:
-                cursor.execute("SHOW COLUMNS FROM Initalya.programs LIKE 'city'")
-                has_city = cursor.fetchone() is not None
-                cursor.execute("SHOW COLUMNS FROM Initalya.programs LIKE 'city_id'")
-                has_city_id = cursor.fetchone() is not None
-            except Exception:
-                pass
-
-            # Aggiorna programmi: city/city_id e num_locali
-            if has_city_id and city is not None:
-                def _norm_city(s: str) -> str:
-                    import re as _re
-                    t = (s or "").strip()
-                    if not t:
-                        return ""
-                    t = _re.sub(r",.*$", "", t)
-                    t = _re.sub(r"\s+[A-Z]{2}$", "", t)
-                    t = _re.sub(r"\b(italia|italy)\b", "", t, flags=_re.I)
-                    t = _re.sub(r"\s+", " ", t).strip()
-                    return t
-                city_name = _norm_city(city) or "Non specificata"
-                cursor.execute("SELECT id FROM Initalya.cities WHERE LOWER(name) = LOWER(%s)", (city_name,))
-                c = cursor.fetchone()
-                if not c:
-                    cursor.execute("SELECT id FROM Initalya.cities WHERE name LIKE %s", (f"%{city_name}%",))
-                    c = cursor.fetchone()
-                if c:
-                    city_id = c.get("id") if isinstance(c, dict) else c[0]
-                else:
-                    cursor.execute("INSERT INTO Initalya.cities (name) VALUES (%s)", (city_name,))
-                    city_id = cursor.lastrowid
-                cursor.execute(
-                    "UPDATE Initalya.programs SET city_id = %s, num_locali = %s WHERE id = %s AND user_id = %s",
-                    (city_id, num_locali, program_id, user_id)
-                )
-            elif has_city and city is not None:
-                cursor.execute(
-                    "UPDATE Initalya.programs SET city = %s, num_locali = %s WHERE id = %s AND user_id = %s",
-                    (city or "", num_locali, program_id, user_id)
-                )
-            else:
-                cursor.execute(
-                    "UPDATE Initalya.programs SET num_locali = %s WHERE id = %s AND user_id = %s",
-                    (num_locali, program_id, user_id)
-                )
-
-            # Aggiorna i locali: cancella esistenti e reinserisci
-            cursor.execute("DELETE FROM Initalya.locals WHERE program_id = %s", (program_id,))
-
-            # Rilevamento dinamico delle colonne in locals
-            try:
-                cursor.execute("SHOW COLUMNS FROM Initalya.locals")
-                rows = cursor.fetchall() or []
-                loc_cols = [ (r.get("Field") if isinstance(r, dict) else r[0]) for r in rows ]
-            except Exception:
-                loc_cols = []
-
-            prog_candidates = ["program_id", "programma_id", "programId", "program", "id_programma"]
-            prog_col = next((c for c in prog_candidates if c in loc_cols), "program_id")
-            name_col = "name" if "name" in loc_cols else ("nome" if "nome" in loc_cols else "name")
-            addr_col = "address" if "address" in loc_cols else ("indirizzo" if "indirizzo" in loc_cols else "address")
-            type_col = "type_id" if "type_id" in loc_cols else ("type" if "type" in loc_cols else None)
-            place_col = "place_id" if "place_id" in loc_cols else None
-
-            import re as _re
-            import hashlib as _hashlib
-
-            def _extract_pid_from_url(u: str) -> str:
-                try:
-                    m = _re.search(r"place_id:([^&]+)", u or "")
-                    return m.group(1) if m else ""
-                except Exception:
-                    return ""
-
-            def _fallback_pid(loc: dict) -> str:
-                base = f"{loc.get('name','').strip()}|{loc.get('address','').strip()}"
-                h = _hashlib.md5(base.encode("utf-8")).hexdigest()[:16]
-                return f"manual_{h}"
-
-            for loc in locali:
-                columns = [prog_col]
-                values = [program_id]
-
-                if name_col:
-                    columns.append(name_col)
-                    values.append((loc.get("name") or ""))
-                if addr_col:
-                    columns.append(addr_col)
-                    values.append((loc.get("address") or ""))
-
-                if type_col:
-                    if type_col == "type_id":
-                        type_str = (loc.get("type") or "").strip()
-                        type_id = None
-                        try:
-                            cursor.execute("SELECT id FROM Initalya.types WHERE LOWER(typology) = LOWER(%s)", (type_str,))
-                            rr = cursor.fetchone()
-                            type_id = (rr.get("id") if isinstance(rr, dict) else (rr[0] if rr else None))
-                        except Exception:
-                            type_id = None
-                        if not type_id:
-                            try:
-                                cursor.execute("SELECT id FROM Initalya.types WHERE LOWER(typology) = LOWER(%s)", ("ristoranti",))
-                                rr2 = cursor.fetchone()
-                                type_id = (rr2.get("id") if isinstance(rr2, dict) else (rr2[0] if rr2 else None)) or 1
-                            except Exception:
-                                type_id = 1
-                        columns.append(type_col)
-                        values.append(type_id)
-                    else:
-                        columns.append(type_col)
-                        values.append((loc.get("type") or ""))
-
-                if place_col:
-                    pid = (loc.get("place_id") or _extract_pid_from_url(loc.get("url") or "") or "").strip()
-                    if not pid:
-                        pid = _fallback_pid(loc)
-                    columns.append(place_col)
-                    values.append(pid)
-
-                placeholders = ", ".join(["%s"] * len(values))
-                sql = f"INSERT INTO Initalya.locals ({', '.join(columns)}) VALUES ({placeholders})"
-                cursor.execute(sql, tuple(values))
-
-            conn.commit()
-            # Salva due file JSON anche in aggiornamento: page1 (HTML) e page3 (ranked)
+        def _update(repo):
+            if repo is None:
+                return {"success": False, "error": "Connessione DB non disponibile"}
             try:
-                import os as _os, json as _json
-                # Usa BASE_DIR per garantire il percorso assoluto corretto dentro il package sitesense
-                save_dir = _os.path.join(str(BASE_DIR), "assets", "saved_itineraries")
-                _os.makedirs(save_dir, exist_ok=True)
-
-                page1_html = data.get("page1_html") or ""
-                page1_payload = {
-                    "program_id": program_id,
-                    "city": (city or ""),
-                    "page1_html": page1_html,
-                }
-                page1_path = _os.path.join(save_dir, f"page1_{program_id}.json")
-                with open(page1_path, "w", encoding="utf-8") as f:
-                    _json.dump(page1_payload, f, ensure_ascii=False)
-
-                ranked_struct = data.get("page3_ranked") or data.get("ranked") or {}
-                page3_payload = {
-                    "program_id": program_id,
-                    "city": (city or ""),
-                    "ranked": ranked_struct,
-                }
-                page3_path = _os.path.join(save_dir, f"page3_{program_id}.json")
-                with open(page3_path, "w", encoding="utf-8") as f:
-                    _json.dump(page3_payload, f, ensure_ascii=False)
+                # Utente corrente e verifica proprietà del programma
+                user_id = repo.get_user_id(email)
+                if not user_id:
+                    return {"success": False, "error": "Utente non trovato"}
+                if not repo.get_program(program_id, user_id):
+                    return {"success": False, "error": "Programma non trovato o non autorizzato"}
+
+                with repo.transaction("update_program"):
+                    # Aggiorna programmi: city/city_id e num_locali
+                    repo.update_program(program_id, user_id, num_locali, city)
+                    # Aggiorna i locali: cancella esistenti e reinserisci
+                    repo.replace_locals(program_id, locali)
+            except Exception as e:
+                return {"success": False, "error": str(e)}
+            return None
 
-                logger.info(
-                    f"Programma aggiornato e salvato su file: page1={page1_path}, page3={page3_path}"
-                )
-                return {
-                    "success": True,
-                    "program_id": program_id,
-                    "files_saved": {"page1": True, "page3": True},
-                    "file_paths": {"page1": page1_path, "page3": page3_path},
-                }
-            except Exception:
-                return {"success": True, "program_id": program_id, "files_saved": {"page1": False, "page3": False}}
-        except Exception as e:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
-            return {"success": False, "error": str(e)}
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
+        error = await repository.run(_update)
+        if error:
+            return error
+        # Salva due file JSON anche in aggiornamento: page1 (HTML) e page3 (ranked)
+        return await self._save_itinerary_files(program_id, city, data, "Programma aggiornato e salvato su file")
 
 
     
@@ -2414,49 +1744,26 @@ class SiteSenseApp:
         if not program_id:
             return {"success": False, "error": "program_id mancante"}
 
-        conn = get_connection()
-        if not conn:
-            return {"success": False, "error": "Connessione DB non disponibile"}
-
-        try:
-            cursor = conn.cursor(dictionary=True)
-            # Recupera l'utente corrente
-            cursor.execute("SELECT id FROM Initalya.users WHERE email = %s", (email,))
-            user = cursor.fetchone()
-            if not user:
-                conn.close()
-                return {"success": False, "error": "Utente non trovato"}
-
-            user_id = user["id"]
-
-            # Verifica che il programma appartenga all'utente
-            cursor.execute(
-                "SELECT id FROM Initalya.programs WHERE id = %s AND user_id = %s",
-                (program_id, user_id)
-            )
-            prog = cursor.fetchone()
-            if not prog:
-                conn.close()
-                return {"success": False, "error": "Programma non trovato o non autorizzato"}
-
-            # Esegue la cancellazione (ON DELETE CASCADE gestisce le relazioni)
-            cursor.execute(
-                "DELETE FROM Initalya.programs WHERE id = %s AND user_id = %s",
-                (program_id, user_id)
-            )
-            conn.commit()
-            conn.close()
-            return {"success": True}
-        except Exception as e:
+        def _delete(repo):
+            if repo is None:
+                return {"success": False, "error": "Connessione DB non disponibile"}
             try:
-                conn.rollback()
-            except Exception:
-                pass
-            try:
-                conn.close()
-            except Exception:
-                pass
-            return {"success": False, "error": str(e)}
+                # Recupera l'utente corrente e verifica che il programma gli appartenga
+                user_id = repo.get_user_id(email)
+                if not user_id:
+                    return {"success": False, "error": "Utente non trovato"}
+                if not repo.get_program(program_id, user_id):
+                    return {"success": False, "error": "Programma non trovato o non autorizzato"}
+
+                # Esegue la cancellazione (ON DELETE CASCADE gestisce le relazioni)
+                repo.delete_program(program_id, user_id)
+                repo.commit()
+                return {"success": True}
+            except Exception as e:
+                repo.rollback()
+                return {"success": False, "error": str(e)}
+
+        return await repository.run(_delete)
     
     async def google_login(self, request: Request, next: str = "/"):
         # Gestione sicura: se le variabili OAuth non sono configurate, mostra messaggio
@@ -2556,7 +1863,7 @@ class SiteSenseApp:
             "redirect_uri": redir,
             "grant_type": "authorization_code",
         }
-        async with httpx.AsyncClient(timeout=15) as client:
+        async with http_client.session(timeout=15) as client:
             tr = await client.post(token_url, data=data)
             if tr.status_code != 200:
                 return RedirectResponse(url="/login?next=/area_riservata", status_code=303)
@@ -2575,34 +1882,7 @@ class SiteSenseApp:
                     name = info.get("given_name")
                     surname = info.get("family_name")
                     profile_image = info.get("picture")
-                    user = get_user_by_google_id(google_id)
-                    logger.info(f"DEBUG Google callback: user found by google_id={google_id}: {user is not None}")
-                    if not user:
-                      # Controlla se esiste già un utente con la stessa email
-                      existing_user = get_user_by_email(user_email)
-                      if existing_user:
-                        logger.info(f"DEBUG Google callback: found existing user with email={user_email}, updating google_id")
-                        # Aggiorna l'utente esistente con il google_id
-                        conn = get_connection()
-                        if conn:
-                          cursor = conn.cursor()
-                          cursor.execute(
-                            "UPDATE Initalya.users SET google_id = %s WHERE email = %s",
-                            (google_id, user_email)
-                          )
-                          conn.commit()
-                          conn.close()
-                        user = get_user_by_google_id(google_id)
-                      else:
-                        logger.info(f"DEBUG Google callback: creating new user with google_id={google_id}, email={user_email}")
-                        create_user(
-                             google_id=google_id,
-                             email=user_email,
-                             name=name,
-                             surname=surname,
-                             profile_image=profile_image
-                       )
-                        logger.info(f"DEBUG Google callback: user created successfully")
+                    await database.run(_sync_google_user, google_id, user_email, name, surname, profile_image)
                    
         target_url = state or "/area_riservata"# Sanifica l'URL di redirect rimuovendo parametri come restore e retSel
         
@@ -2618,43 +1898,42 @@ class SiteSenseApp:
         """Restituisce l'istanza FastAPI"""
         return self.app
 
-def get_user_by_google_id(google_id: str):
-    conn = get_connection()
+def get_user_by_google_id(conn, google_id: str):
     if not conn:
         return None
 
     cursor = conn.cursor(dictionary=True)
-    cursor.execute(
-        "SELECT * FROM Initalya.users WHERE google_id = %s",
-        (google_id,)
-    )
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    try:
+        cursor.execute(
+            "SELECT * FROM Initalya.users WHERE google_id = %s",
+            (google_id,)
+        )
+        return cursor.fetchone()
+    finally:
+        cursor.close()
 
-def get_user_by_email(email: str):
-    conn = get_connection()
+def get_user_by_email(conn, email: str):
     if not conn:
         return None
 
     cursor = conn.cursor(dictionary=True)
-    cursor.execute(
-        "SELECT * FROM Initalya.users WHERE email = %s",
-        (email,)
-    )
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    try:
+        cursor.execute(
+            "SELECT * FROM Initalya.users WHERE email = %s",
+            (email,)
+        )
+        return cursor.fetchone()
+    finally:
+        cursor.close()
 
 
-def create_user(google_id, email, name, surname, profile_image, phone=None, bio=None, country=None, city=None):
+def create_user(conn, google_id, email, name, surname, profile_image, phone=None, bio=None, country=None, city=None):
     """Crea un utente inserendo anche phone, bio, country, city se le colonne esistono.
 
     La funzione rileva dinamicamente la presenza delle colonne nel DB e le
     include nell'INSERT solo se presenti, mantenendo compatibilità con schemi
     precedenti.
     """
-    conn = get_connection()
     cursor = conn.cursor()
     try:
         # Colonne base sempre presenti
@@ -2684,7 +1963,43 @@ def create_user(google_id, email, name, surname, profile_image, phone=None, bio=
         cursor.execute(sql, tuple(values))
         conn.commit()
     finally:
-        conn.close()
+        cursor.close()
+
+
+def _sync_google_user(conn, google_id, user_email, name, surname, profile_image) -> None:
+    """Utente del login Google: collega il google_id a un utente con la stessa email o lo crea.
+    Eseguita con ``database.run`` (una sola connessione del pool, fuori dall'event loop)."""
+    if not conn:
+        return
+    user = get_user_by_google_id(conn, google_id)
+    logger.info(f"DEBUG Google callback: user found by google_id={google_id}: {user is not None}")
+    if user:
+        return
+    # Controlla se esiste già un utente con la stessa email
+    existing_user = get_user_by_email(conn, user_email)
+    if existing_user:
+        logger.info(f"DEBUG Google callback: found existing user with email={user_email}, updating google_id")
+        # Aggiorna l'utente esistente con il google_id
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "UPDATE Initalya.users SET google_id = %s WHERE email = %s",
+                (google_id, user_email)
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+    else:
+        logger.info(f"DEBUG Google callback: creating new user with google_id={google_id}, email={user_email}")
+        create_user(
+            conn,
+            google_id=google_id,
+            email=user_email,
+            name=name,
+            surname=surname,
+            profile_image=profile_image
+        )
+        logger.info(f"DEBUG Google callback: user created successfully")
 
 
 
@@ -2693,17 +2008,22 @@ async def login_super_admin_submit(request: Request):
     email = form.get("email")
     password = form.get("password")
 
-    conn = get_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="DB non disponibile")
+    def _fetch_superadmin(conn):
+        if not conn:
+            return None
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT * FROM Initalya.superadmins WHERE email = %s",
+                (email,)
+            )
+            return cursor.fetchone() or {}
+        finally:
+            cursor.close()
 
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute(
-        "SELECT * FROM Initalya.superadmins WHERE email = %s",
-        (email,)
-    )
-    superadmin = cursor.fetchone()
-    conn.close()
+    superadmin = await database.run(_fetch_superadmin)
+    if superadmin is None:
+        raise HTTPException(status_code=500, detail="DB non disponibile")
 
     if not superadmin:
         return RedirectResponse("/login_super_admin?error=1", status_code=303)
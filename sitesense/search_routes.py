@@ -3,7 +3,6 @@
 import os
 import logging
 import asyncio
-import httpx
 from fastapi import APIRouter, FastAPI, Request
 from google import genai
 from google.genai import types
@@ -12,6 +11,8 @@ import json
 
 from pydantic import BaseModel, Field
 
+from .services import http_client
+
 # ─── CONFIG ────────────────────────────────────────────────────────────────────
 
 # Carica le variabili d'ambiente (se usi un .env)
@@ -241,7 +242,7 @@ async def places_search(search: str):
         "language": "it"
     }
     logger.info(f"Chiamata API Google Maps Places: URL='{url}', Params='{params}'")
-    async with httpx.AsyncClient() as client:
+    async with http_client.session() as client:
         r = await client.get(url, params=params)
         data = r.json()
     #logger.info(f"Risposta API Google Maps Places: Status={r.status_code}, Data='{data}'")
@@ -286,7 +287,7 @@ async def get_place_details(place_id: str):
         "key": GOOGLE_MAPS_API_KEY,
         "language": "it"
     }
-    async with httpx.AsyncClient() as client:
+    async with http_client.session() as client:
         r = await client.get(url, params=params)
         data = r.json()
     #logger.info(f"Risposta API Google Maps Place Details: Status={r.status_code}")
@@ -315,7 +316,7 @@ async def get_directions(origin: str, destination: str):
         "language": "it"
     }
     logger.info(f"Chiamata API Google Maps Directions: URL='{url}', Params='{params}'")
-    async with httpx.AsyncClient() as client:
+    async with http_client.session() as client:
         r = await client.get(url, params=params)
         data = r.json()
     #logger.info(f"Risposta API Google Maps Directions: Status={r.status_code}, Data='{data}'")
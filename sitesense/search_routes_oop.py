@@ -2,8 +2,10 @@ import logging
 import json
 from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
+from .config.settings import settings
 from .controllers.search_controller import SearchController, ChatRequest
 from .services.ChatterService import Chatter
+from .services.session_store import SESSION_COOKIE_NAME, session_store
 
 # Configurazione logging
 logging.basicConfig(
@@ -12,6 +14,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Stream NDJSON con i risultati come record compatti (resi dal client)
+RECORDS_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _accepts_records(accept: str) -> bool:
+    """True se l'header Accept elenca esplicitamente application/x-ndjson con q > 0.
+    I tipi generici (application/json, */*) non bastano: molti client li inviano sempre."""
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if media_type.lower() != RECORDS_MEDIA_TYPE:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+def negotiate_results_format(request: Request) -> str:
+    """Formato dei risultati classificati: "json" con ?format=json o Accept: application/x-ndjson
+    esplicito, altrimenti "html" (card già rese dal server, comportamento storico).
+    Il parametro ?format ha la precedenza sull'header."""
+    requested = (request.query_params.get("format") or "").strip().lower()
+    if requested in ("json", "html"):
+        return requested
+    return "json" if _accepts_records(request.headers.get("accept") or "") else "html"
+
+
 class SearchRoutes:
     """Classe per gestire le route di ricerca in modo orientato agli oggetti"""
     
@@ -36,24 +71,34 @@ class SearchRoutes:
         referer = request.headers.get("referer", "") or ""
         is_program_page = ("/program/" in referer)
         logger.info(f"Richiesta streaming ricevuta su /search: {chat_request.query} | referer='{referer}' program_mode={is_program_page}")
-        try:
-            controller = self.get_controller()
-            controller.gemini_service.programMode = bool(is_program_page)
-            if is_program_page:
-                controller.gemini_service.chatMode = True
-            
-            # --- LOGICA SOSTITUZIONE QUERY SU 'RICARICO' ---
-            # Recuperiamo l'istanza del bot attiva dal servizio Gemini
-            chat_bot = getattr(controller.gemini_service, 'chatBot', None)
-            
-          
-            # -----------------------------------------------
-
-            logger.info(f"ProgramMode={controller.gemini_service.programMode} chatMode={controller.gemini_service.chatMode} referer='{referer}'")
-        except Exception as e:
-            logger.warning(f"Impostazione programMode/chatMode fallita: {e}")
-        
+        # Stato della conversazione legato al cookie di sessione dell'utente
+        state = session_store.get_or_create(request.cookies.get(SESSION_COOKIE_NAME))
+        results_format = negotiate_results_format(request)
+
         async def stream_generator():
+            # Le richieste concorrenti della stessa sessione vengono servite in ordine:
+            # modalità e chatbot si leggono solo dopo aver preso il lock, così una
+            # richiesta non cambia lo stato di quella ancora in corso
+            async with state.lock:
+                chat_bot = None
+                try:
+                    state.programMode = bool(is_program_page)
+                    if is_program_page:
+                        state.chatMode = True
+
+                    # --- LOGICA SOSTITUZIONE QUERY SU 'RICARICO' ---
+                    # Recuperiamo l'istanza del bot attiva dalla sessione
+                    chat_bot = state.chatBot
+                    # -----------------------------------------------
+
+                    logger.info(f"ProgramMode={state.programMode} chatMode={state.chatMode} referer='{referer}'")
+                except Exception as e:
+                    logger.warning(f"Impostazione programMode/chatMode fallita: {e}")
+
+                async for line in _locked_stream(chat_bot):
+                    yield line
+
+        async def _locked_stream(chat_bot):
             try:
                 # Usa il metodo di streaming del controller
                 # Verifichiamo se esiste ed è un'istanza di Chatter
@@ -61,7 +106,7 @@ class SearchRoutes:
                     try:
                         logger.info(f"Verifica preventiva 'ricarico' per query: {chat_request.query}")
                         # Chiamiamo il metodo sull'istanza, passando la query dell'utente
-                        bot_response = chat_bot.getResponse(chat_request.query)
+                        bot_response = await chat_bot.getResponse(chat_request.query)
                         logger.info(f"Risposta preventiva ChatterService: '{bot_response}'")
                         
                         if bot_response and "ricarico" in bot_response.lower().strip():
@@ -105,7 +150,7 @@ class SearchRoutes:
                                     chat_request.skip_echo = True  
                                   
                                     logger.info("ChatMode forzato a False dopo sostituzione 'ricarico' per rigenerare il contenuto.")
-                                    controller.gemini_service.chatMode = False
+                                    state.chatMode = False
                                         # Flag per evitare duplicazione messaggio utente e risposta incoerente
                                 except Exception as e:
                                     logger.error(f"Errore estrazione testo penultimo messaggio: {e}")
@@ -115,7 +160,7 @@ class SearchRoutes:
                     except Exception as e:
                         logger.warning(f"Errore durante verifica ChatterService: {e}")
 
-                async for chunk in self.get_controller().handle_chat_request_stream(chat_request):
+                async for chunk in self.get_controller().handle_chat_request_stream(chat_request, session=state, results_format=results_format):
                     yield json.dumps(chunk) + "\n"
             except Exception as e:
                 logger.error(f"Errore nello stream generator: {e}", exc_info=True)
@@ -124,7 +169,21 @@ class SearchRoutes:
                 }
                 yield json.dumps(error_payload) + "\n"
 
-        return StreamingResponse(stream_generator(), media_type="text/plain")
+        response = StreamingResponse(
+            stream_generator(),
+            media_type=RECORDS_MEDIA_TYPE if results_format == "json" else "text/plain",
+            headers={"Vary": "Accept"},
+        )
+        response.set_cookie(
+            key=SESSION_COOKIE_NAME,
+            value=state.session_id,
+            httponly=True,
+            # Il cookie identifica lo stato della conversazione: solo HTTPS fuori dal debug
+            secure=not settings.debug_mode,
+            samesite="lax",
+            path="/",
+        )
+        return response
     
     def get_router(self) -> APIRouter:
         """Restituisce il router configurato"""
@@ -10,11 +10,11 @@ import logging
 import re
 from typing import Dict, Optional
 import os
-from google import genai
 from google.genai import types
 
 from ..config.settings import settings
 from .google_maps_service import GoogleMapsService
+from . import gemini_client
 
 logger = logging.getLogger(__name__)
 GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL")
@@ -24,10 +24,10 @@ class Chatter:
     """Servizio per analizzare il contenuto generato e determinare le azioni successive."""
 
     def __init__(self, html):
-        self.client = genai.Client(api_key=settings.gemini_api_key)
+        self.client = gemini_client.get_client()
         self.html = html
         self.config = self.generateConfig()
-        self.chat = self.client.chats.create(model=GEMINI_MODEL, config=self.config)
+        self.chat = gemini_client.create_chat(model=GEMINI_MODEL, config=self.config)
         
         
 
@@ -42,12 +42,12 @@ class Chatter:
         """Restituisce il prompt per l'analyzer client"""
         return """Sei un assistente virtuale del portale Initalya. Il tuo obiettivo è aiutare gli utenti a creare un programma di viaggio personalizzato, scoprendo borghi e città attraverso i prodotti tipici locali (primi, secondi, dolci, vini), fiere, eventi culinari e attività selezionate.
 
-                Il tuo compito è analizzare il codice HTML fornito per estrarre informazioni sulla località corrente e rispondere alle domande dell'utente.
+                Il tuo compito è analizzare i dati della pagina forniti in fondo a queste istruzioni (località, contenuto, "La nostra selezione") per estrarre informazioni sulla località corrente e rispondere alle domande dell'utente.
 
                 LINEE GUIDA FONDAMENTALI:
-                1.Tecnologia: Sei basato su tecnologie proprietarie Initalya. Non menzionare mai che stai leggendo un codice HTML. L'utente deve percepire una conversazione naturale.
+                1.Tecnologia: Sei basato su tecnologie proprietarie Initalya. Non menzionare mai che stai leggendo i dati della pagina. L'utente deve percepire una conversazione naturale.
                 2.Veridicità: Puoi cercare informazioni in rete, ma DEVONO essere verificate. Verifica sempre che un luogo citato esista davvero.
-                3.Promozione Attività (CRUCIALE):Nell'HTML troverai una sezione "La nostra selezione". Se l'utente chiede consigli su dove mangiare o comprare prodotti, DEVI consigliare ESCLUSIVAMENTE le attività presenti in quella lista. Non suggerire mai attività esterne alla selezione Initalya.
+                3.Promozione Attività (CRUCIALE):Nei dati della pagina troverai una sezione "La nostra selezione". Se l'utente chiede consigli su dove mangiare o comprare prodotti, DEVI consigliare ESCLUSIVAMENTE le attività presenti in quella lista. Non suggerire mai attività esterne alla selezione Initalya.
                 4.Specificità: Se ti chiedono "dove mangiare la focaccia", non dire "nei forni in centro", ma indica precisamente un attività pertinente della lista "la nostra selezione"(se presente nella selezione).
                 5.Sintesi: Rispondi in maniera diretta, utile e sintetica.
                 6.Il testo del messaggio non deve contenere mai asterischi e non deve superare i 200 caratteri.
@@ -71,7 +71,7 @@ class Chatter:
                 - L'utente vuole **restringere/filtrare** drasticamente la ricerca attuale a una sola categoria della stessa città caricata per incentrare il programma di viaggio su quella (es. "Fammi vedere solo i vini di questa zona", "Voglio un itinerario solo sui dolci", "Resetta e mostrami solo le fiere").
 
                 ### CASO B: RISPOSTA TESTUALE NORMALE
-                Rispondi conversando normalmente (usando i dati dell'HTML e web search verificata) quando:
+                Rispondi conversando normalmente (usando i dati della pagina e web search verificata) quando:
                 - L'utente fa domande specifiche su un prodotto o un luogo già caricato (es. "Che sapore ha questo vino?", "Il ristorante X ha il parcheggio?").
                 - L'utente chiede consigli generici basati sulla lista attuale (es. "Cosa mi consigli per cena tra quelli proposti?").
                 - L'utente fa domande di cultura generale o curiosità sulla città (es. "C'è il mare a Monopoli?", "Quanti abitanti fa?").
@@ -109,6 +109,8 @@ class Chatter:
                 Assistant: "Vuoi filtrare la ricerca per mostrare solo i primi piatti?"
                 User: "Certo"
                 Assistant: "ricarico"
+
+                DATI DELLA PAGINA:
                 """ + self.html
 
 
@@ -116,14 +118,14 @@ class Chatter:
 
   
 
-    def getResponse(self, prompt: str) -> str:
+    async def getResponse(self, prompt: str) -> str:
         """Restituisce la risposta dall'analyzer client"""
         try:
             # Se il client o il modello non sono configurati, rispondi con fallback locale
             if not settings.gemini_api_key or not GEMINI_MODEL or not getattr(self, 'chat', None):
                 return self._localFallback(prompt)
 
-            response = self.chat.send_message(prompt)
+            response = await gemini_client.send_message(self.chat, prompt)
             text = getattr(response, 'text', '') or ''
             if not text.strip():
                 return self._localFallback(prompt)
@@ -11,11 +11,10 @@ import logging
 import re
 from typing import Dict, Optional
 import os
-from google import genai
 from google.genai import types
 
-from ..config.settings import settings
 from .google_maps_service import GoogleMapsService
+from . import gemini_client
 
 logger = logging.getLogger(__name__)
 GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL") or os.getenv("GEMINI_MODEL") or "gemini-2.5-flash"
@@ -24,7 +23,7 @@ class ContextDetector:
 
 
     def __init__(self):
-        self.client = genai.Client(api_key=settings.gemini_api_key)
+        self.client = gemini_client.get_client()
         self.config = self.generateConfig()
         
         
@@ -60,8 +59,8 @@ class ContextDetector:
         """ 
 
     
-    def checkLocation(self, prompt):
-        response = self.client.models.generate_content(config=self.config, contents=prompt, model=GEMINI_MODEL)
+    async def checkLocation(self, prompt):
+        response = await gemini_client.generate_content(model=GEMINI_MODEL, contents=prompt, config=self.config)
         logger.info("Località rilevata " + str(response.text))
         return response.text
     
@@ -4,11 +4,10 @@ import logging
 import re
 from typing import Dict, Optional
 import os
-from google import genai
 from google.genai import types
 
-from ..config.settings import settings
 from .google_maps_service import GoogleMapsService
+from . import gemini_client
 
 logger = logging.getLogger(__name__)
 GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL") or os.getenv("GEMINI_MODEL") or "gemini-2.5-flash"
@@ -18,9 +17,9 @@ class Locator:
 
 
     def __init__(self):
-        self.client = genai.Client(api_key=settings.gemini_api_key)
+        self.client = gemini_client.get_client()
         self.config = self.generateConfig()
-        self.chat = self.client.chats.create(model=GEMINI_MODEL, config=self.config)
+        self.chat = gemini_client.create_chat(model=GEMINI_MODEL, config=self.config)
         
         
 
@@ -59,7 +58,7 @@ class Locator:
         
         """ 
 
-    def isCity(self, prompt: str) -> str:
+    async def isCity(self, prompt: str) -> str:
         """Restituisce la risposta dall'analyzer client"""
-        response = self.chat.send_message(prompt)
+        response = await gemini_client.send_message(self.chat, prompt)
         return response.text
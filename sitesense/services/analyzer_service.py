@@ -4,11 +4,10 @@ import re
 from typing import Dict, Optional, Any
 import os
 
-from google import genai
 from google.genai import types
 
-from ..config.settings import settings
 from .google_maps_service import GoogleMapsService
+from . import gemini_client
 
 logger = logging.getLogger(__name__)
 GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL")
@@ -18,7 +17,7 @@ class AnalyzerService:
     """Analizza contenuti e genera ricerche Google Maps con località dedotta da Gemini."""
 
     def __init__(self, google_maps_service: GoogleMapsService):
-        self.analyzer_client = genai.Client(api_key=settings.gemini_api_key)
+        self.analyzer_client = gemini_client.get_client()
         self.analyzer_config = self._setup_analyzer_generation_config()
         self.google_maps_service = google_maps_service
 
@@ -91,7 +90,7 @@ Restituisci SOLO un JSON valido, senza markdown e senza intestazioni:
         try:
             logger.info("Analisi contenuto per Google Maps (località dedotta da Gemini)")
 
-            analyzer_chat = self.analyzer_client.chats.create(
+            analyzer_chat = gemini_client.create_chat(
                 model=GEMINI_MODEL,
                 config=self.analyzer_config
             )
@@ -108,7 +107,7 @@ LOCALITÀ CORRENTE (se presente): {current_location or ''}
 Genera il JSON delle ricerche Google Maps.
 """
 
-            response = analyzer_chat.send_message(prompt)
+            response = await gemini_client.send_message(analyzer_chat, prompt)
             raw_text = response.candidates[0].content.parts[0].text.strip()
 
             match = re.search(r"```json\s*(\{.*?\})\s*```", raw_text, re.DOTALL)
@@ -1,8 +1,9 @@
-import json
 import re
 from pathlib import Path
 from typing import Dict, Any, List
 
+from .json_storage import json_storage
+
 BASE_DIR = Path(__file__).resolve().parents[1]
 CACHE_DIR = BASE_DIR / "assets" / "cities_cache"
 
@@ -54,8 +55,7 @@ def save_city_cache(city: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     # Percorso del vecchio file combinato (non più usato): lo cancelliamo se presente
     old_combined_path = CACHE_DIR / f"{slug}.json"
     try:
-        if old_combined_path.exists():
-            old_combined_path.unlink()
+        json_storage.delete_sync(old_combined_path)
     except Exception:
         # Ignora errori di cancellazione; l'obiettivo è non mantenere il file combinato
         pass
@@ -159,20 +159,18 @@ def save_city_cache(city: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         suggests_list = list(locals_list)
 
     if selection_list:
-        sel_path.write_text(json.dumps(selection_list, ensure_ascii=False, indent=2), encoding="utf-8")
+        json_storage.write_sync(sel_path, selection_list)
     else:
         try:
-            if sel_path.exists():
-                sel_path.unlink()
+            json_storage.delete_sync(sel_path)
         except Exception:
             pass
 
     if suggests_list:
-        sug_path.write_text(json.dumps(suggests_list, ensure_ascii=False, indent=2), encoding="utf-8")
+        json_storage.write_sync(sug_path, suggests_list)
     else:
         try:
-            if sug_path.exists():
-                sug_path.unlink()
+            json_storage.delete_sync(sug_path)
         except Exception:
             pass
 
@@ -180,8 +178,7 @@ def save_city_cache(city: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     # rimuovilo comunque al termine.
     legacy_path = CACHE_DIR / f"{slug}.json"
     try:
-        if legacy_path.exists():
-            legacy_path.unlink()
+        json_storage.delete_sync(legacy_path)
     except Exception:
         pass
 
@@ -200,31 +197,20 @@ def load_city_cache(city: str) -> Dict[str, Any]:
     sug_path = CACHE_DIR / f"{slug}_suggests.json"
     locals_list: List[Dict[str, Any]] = []
 
-    try:
-        if sel_path.exists():
-            sel = json.loads(sel_path.read_text(encoding="utf-8"))
-            if isinstance(sel, list):
-                locals_list.extend(sel)
-        if sug_path.exists():
-            sug = json.loads(sug_path.read_text(encoding="utf-8"))
-            if isinstance(sug, list):
-                locals_list.extend(sug)
-    except Exception:
-        locals_list = []
+    # Letture memorizzate: il file viene decodificato di nuovo solo se è cambiato
+    for path in (sel_path, sug_path):
+        data = json_storage.read_sync(path)
+        if isinstance(data, list):
+            locals_list.extend(data)
 
     if locals_list:
         return {"city": city, "locals": locals_list}
 
     # Fallback: generic local suggestions
-    other_path = CACHE_DIR / "other_locals.json"
-    if other_path.exists():
-        try:
-            data = json.loads(other_path.read_text(encoding="utf-8"))
-            if isinstance(data, list):
-                return {"city": city, "locals": data}
-            if isinstance(data, dict) and isinstance(data.get("locals"), list):
-                return {"city": city, "locals": data.get("locals", [])}
-        except Exception:
-            pass
+    data = json_storage.read_sync(CACHE_DIR / "other_locals.json")
+    if isinstance(data, list):
+        return {"city": city, "locals": data}
+    if isinstance(data, dict) and isinstance(data.get("locals"), list):
+        return {"city": city, "locals": data.get("locals", [])}
 
     return {"city": city, "locals": []}
\ No newline at end of file
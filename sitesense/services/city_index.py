@@ -0,0 +1,158 @@
+"""Indice in memoria delle città di Initalya.cities.
+
+Caricato all'avvio con una sola query, aggiornato a ogni inserimento fatto da
+questo worker e ricaricato periodicamente (``CITY_INDEX_REFRESH_SECONDS``) per
+vedere le città aggiunte dagli altri worker. Offre:
+- risoluzione esatta del nome (senza accenti e maiuscole, come la collation
+  utf8mb4_unicode_ci della tabella);
+- ricerca di una città dentro un testo (es. "Spaghetti all'Assassina Bari")
+  con un trie sulle parole dei nomi, in un'unica passata e senza query.
+"""
+
+import logging
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from ..config.settings import settings
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Chiave del trie che marca la fine di un nome di città
+_END = ""
+
+City = Tuple[int, str]
+
+
+def fold(text: str) -> List[str]:
+    """Parole del testo senza accenti, in minuscolo: "Forlì-Cesena" -> ["forli", "cesena"]."""
+    s = unicodedata.normalize("NFD", text or "")
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn").lower()
+    return re.findall(r"[a-z0-9]+", s)
+
+
+class CityIndex:
+    """Città per nome normalizzato e trie per la ricerca nel testo."""
+
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, City] = {}
+        self._by_first_word: Dict[str, City] = {}
+        self._trie: Dict[str, dict] = {}
+        self._loaded_at = 0.0
+
+    def _add_locked(self, city_id: int, name: str) -> None:
+        words = fold(name)
+        if not words:
+            return
+        city = (city_id, name)
+        # A parità di nome resta la prima riga (id più basso), come le vecchie SELECT ... LIMIT 1
+        self._by_key.setdefault(" ".join(words), city)
+        self._by_first_word.setdefault(words[0], city)
+        node = self._trie
+        for word in words:
+            node = node.setdefault(word, {})
+        node.setdefault(_END, city)
+
+    def load(self, conn) -> None:
+        """(Ri)carica l'indice da Initalya.cities."""
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT id, name FROM Initalya.cities ORDER BY id")
+            rows = cur.fetchall() or []
+        finally:
+            cur.close()
+        with self._lock:
+            self._by_key, self._by_first_word, self._trie = {}, {}, {}
+            for city_id, name in rows:
+                self._add_locked(city_id, name)
+            self._loaded_at = time.monotonic()
+        logger.info(f"Indice città caricato: {len(self._by_key)} città")
+
+    def ensure_fresh(self, conn) -> None:
+        if conn is None:
+            return
+        if self._loaded_at and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        try:
+            self.load(conn)
+        except Exception as e:
+            logger.warning(f"Caricamento indice città fallito: {e}")
+
+    def add(self, city_id: int, name: str) -> None:
+        """Registra una città appena inserita."""
+        with self._lock:
+            self._add_locked(city_id, name)
+
+    def resolve(self, name: str) -> Optional[City]:
+        """(id, nome) della città con questo nome, senza distinzione di accenti e maiuscole."""
+        with self._lock:
+            return self._by_key.get(" ".join(fold(name)))
+
+    def find_in_text(self, text: str) -> Optional[City]:
+        """Prima città citata nel testo. Come nella vecchia ricerca per parola, si parte solo da
+        parole con iniziale maiuscola e più lunghe di 2 caratteri; per ognuna vince il nome
+        completo più lungo, altrimenti una città il cui nome inizia con quella parola
+        (es. "Reggio" -> "Reggio Calabria")."""
+        tokens = [(m.group(0), fold(m.group(0))) for m in re.finditer(r"[^\W_]+", text or "")]
+        words = [w for _, folded in tokens for w in folded[:1]]
+        starts = [original[0].isupper() and len(original) > 2 for original, folded in tokens if folded[:1]]
+        with self._lock:
+            for i, is_start in enumerate(starts):
+                if not is_start:
+                    continue
+                node, found = self._trie, None
+                for word in words[i:]:
+                    node = node.get(word)
+                    if node is None:
+                        break
+                    found = node.get(_END, found)
+                if found is None:
+                    found = self._by_first_word.get(words[i])
+                if found is not None:
+                    return found
+        return None
+
+    def get_or_create(self, conn, name: str) -> Optional[int]:
+        """Id della città (inserita se non esiste). Interroga il DB solo se l'indice non la conosce."""
+        self.ensure_fresh(conn)
+        city = self.resolve(name)
+        if city is not None:
+            return city[0]
+        if conn is None:
+            return None
+        cur = conn.cursor()
+        try:
+            # Può essere stata inserita da un altro worker dopo l'ultimo caricamento
+            cur.execute("SELECT id, name FROM Initalya.cities WHERE name = %s LIMIT 1", (name,))
+            row = cur.fetchone()
+            if row:
+                city_id, stored_name = row
+            else:
+                cur.execute("INSERT INTO Initalya.cities (name) VALUES (%s)", (name,))
+                conn.commit()
+                city_id, stored_name = cur.lastrowid, name
+                logger.info(f"✅ Inserita nuova città '{name}' con ID: {city_id}")
+        finally:
+            cur.close()
+        self.add(city_id, stored_name)
+        return city_id
+
+    async def startup(self) -> None:
+        """Carica l'indice all'avvio; se il DB non è raggiungibile verrà caricato al primo uso."""
+        try:
+            await database.run(self.ensure_fresh)
+        except Exception as e:
+            logger.warning(f"Caricamento indice città rimandato: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"cities": len(self._by_key)}
+
+
+# Istanza condivisa per il worker corrente
+city_index = CityIndex(refresh_seconds=settings.city_index_refresh_seconds)
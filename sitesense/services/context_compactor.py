@@ -0,0 +1,304 @@
+"""Contesto compatto per il chatbot (Chatter/ProgramService).
+
+La pagina della prima ricerca (articolo culinario + card dei locali) è HTML con
+CSS inline, attributi di stile e markup ripetuto: inviarla a Gemini come
+istruzione di sistema costa molti token a ogni turno di chat. ``compact()`` la
+riduce a un riassunto testuale con solo ciò che serve al chatbot:
+- località;
+- titoli e testi dell'articolo, più l'elenco dei piatti citati;
+- "La nostra selezione" e gli altri suggerimenti, una riga per locale con
+  place_id, nome, categoria, valutazione e indirizzo.
+
+Il riassunto è memorizzato per contenuto (le ricerche servite dalla cache dei
+risultati condividono lo stesso) e per sessione (``for_session``).
+"""
+
+import hashlib
+import html
+import json
+import logging
+import re
+import threading
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional
+
+from ..config.settings import settings
+from .image_prefetch import extract_image_requests
+from .ttl_cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+_CACHE_MAX_ENTRIES = 500
+_CACHE_TTL_SECONDS = 6 * 3600
+# Testo massimo per paragrafo dell'articolo
+_MAX_PARAGRAPH_CHARS = 300
+SELECTION_KEY = "la nostra selezione"
+
+# Elementi il cui contenuto non serve al chatbot
+_SKIP_TAGS = {"style", "script", "head", "title", "button", "svg", "noscript", "iframe"}
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+_BLOCK_TAGS = {"h1", "h2", "h3", "h4", "p", "li"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Stima dei token (circa 4 caratteri per token), sufficiente per confronti e log."""
+    return (len(text or "") + 3) // 4
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", html.unescape(text or "")).strip()
+
+
+class _PageParser(HTMLParser):
+    """Raccoglie blocchi di testo dell'articolo e card dei locali (``data-place-id``)."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[tuple] = []
+        self.cards: List[Dict[str, Any]] = []
+        # categoria -> testo grezzo della sezione (record JSON nel formato "json" dei risultati)
+        self.section_text: Dict[str, List[str]] = {}
+        self._stack: List[str] = []
+        self._skip_depth = 0
+        self._block: Optional[List[str]] = None
+        self._block_tag = ""
+        self._category: Optional[str] = None
+        self._in_title = False
+        self._title: List[str] = []
+        self._card: Optional[Dict[str, Any]] = None
+        self._card_depth = 0
+        self._card_field: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        if tag in _VOID_TAGS:
+            # <br> e simili separano le parole
+            self.handle_data(" ")
+            return
+        self._stack.append(tag)
+        if self._skip_depth or tag in _SKIP_TAGS or "material-icons" in classes:
+            self._skip_depth += 1
+            return
+        if tag == "h2" and "category-title" in classes:
+            self._in_title, self._title = True, []
+            return
+        if self._card is None and attrs.get("data-place-id") is not None:
+            self._card = {
+                "place_id": attrs.get("data-place-id") or "",
+                "category": attrs.get("data-category") or "",
+                "rating": attrs.get("data-rating") or "",
+                "reviews": attrs.get("data-reviews") or "",
+                "address": attrs.get("data-address") or "",
+                "section": self._category,
+                "selection": "selection-card" in classes,
+                "name": [],
+                "text": [],
+            }
+            self._card_depth = len(self._stack)
+            return
+        if self._card is not None:
+            if tag == "h3":
+                self._card_field = "name"
+            elif tag == "p":
+                self._card_field = "text"
+            return
+        if tag in _BLOCK_TAGS and self._category is None and self._block is None:
+            self._block, self._block_tag = [], tag
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS or tag not in self._stack:
+            return
+        # Chiude anche i tag rimasti aperti (HTML generato non sempre ben formato)
+        while self._stack:
+            depth = len(self._stack)
+            closed = self._stack.pop()
+            if self._skip_depth:
+                self._skip_depth -= 1
+            elif self._card is not None and depth == self._card_depth:
+                self._finish_card()
+            elif self._card is not None and closed in ("h3", "p"):
+                self._card_field = None
+            elif self._in_title and closed == "h2":
+                self._in_title = False
+                self._category = _clean("".join(self._title)).lower()
+                self.section_text.setdefault(self._category, [])
+            elif self._block is not None and closed == self._block_tag:
+                text = _clean("".join(self._block))
+                if text:
+                    self.blocks.append((self._block_tag, text))
+                self._block = None
+            if closed == tag:
+                break
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._in_title:
+            self._title.append(data)
+        elif self._card is not None:
+            if self._card_field:
+                self._card[self._card_field].append(data)
+        elif self._block is not None:
+            self._block.append(data)
+        elif self._category is not None and data.strip():
+            self.section_text[self._category].append(data)
+
+    def _finish_card(self):
+        card = self._card
+        self._card, self._card_field = None, None
+        card["name"] = _clean("".join(card["name"]))
+        card["text"] = _clean("".join(card["text"]))
+        if card["name"]:
+            self.cards.append(card)
+
+    def close(self):
+        super().close()
+        if self._card is not None:
+            self._finish_card()
+
+
+def _card_line(card: Dict[str, Any]) -> str:
+    parts = [f"id={card['place_id']}" if card.get("place_id") else "", card.get("name", "")]
+    category = str(card.get("category") or "").replace("_", " ")
+    if category:
+        parts.append(category)
+    rating, reviews = card.get("rating"), card.get("reviews")
+    if rating not in (None, "", "N/A"):
+        parts.append(f"voto {rating}" + (f" ({reviews} recensioni)" if reviews not in (None, "", "N/A") else ""))
+    elif card.get("text"):
+        # Card senza attributi data-*: "⭐ 4.5 · 120 recensioni"
+        parts.append(_clean(card["text"].replace("⭐", "voto").replace("·", "")))
+    if card.get("address"):
+        parts.append(card["address"])
+    return "- " + " | ".join(p for p in parts if p)
+
+
+def _records_to_cards(raw: str) -> List[Dict[str, Any]]:
+    """Card dai record compatti (formato "json" dei risultati) inseriti come testo nella sezione."""
+    try:
+        records = json.loads(raw)
+    except ValueError:
+        return []
+    if not isinstance(records, list):
+        return []
+    return [
+        {
+            "place_id": r.get("place_id") or "",
+            "name": r.get("name") or "",
+            "category": r.get("category") or "",
+            "rating": r.get("rating"),
+            "reviews": r.get("reviews"),
+            "address": r.get("address") or "",
+        }
+        for r in records
+        if isinstance(r, dict) and r.get("name")
+    ]
+
+
+class ContextCompactor:
+    """Riassunto strutturato della pagina per il chatbot, memorizzato per contenuto."""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._cache = TTLCache(max_entries=_CACHE_MAX_ENTRIES, default_ttl=_CACHE_TTL_SECONDS, name="chat_context")
+        self._counters = {"compacted": 0, "cached": 0, "session_hits": 0, "source_tokens": 0, "context_tokens": 0}
+
+    @staticmethod
+    def _key(page_html: str, location: Optional[str]) -> str:
+        return hashlib.sha1(f"{location or ''}\n{page_html or ''}".encode("utf-8")).hexdigest()
+
+    def compact(self, page_html: str, location: Optional[str] = None) -> str:
+        """Riassunto della pagina; con CHAT_CONTEXT_COMPACT=false restituisce l'HTML invariato."""
+        if not self.enabled or not page_html:
+            return page_html or ""
+        key = self._key(page_html, location)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not MISSING:
+                self._counters["cached"] += 1
+                return cached
+        context = self._build(page_html, location)
+        source_tokens, context_tokens = estimate_tokens(page_html), estimate_tokens(context)
+        with self._lock:
+            self._cache.set(key, context)
+            self._counters["compacted"] += 1
+            self._counters["source_tokens"] += source_tokens
+            self._counters["context_tokens"] += context_tokens
+        logger.info(f"Contesto chatbot compattato: ~{source_tokens} -> ~{context_tokens} token stimati")
+        return context
+
+    def for_session(self, state) -> str:
+        """Contesto della pagina corrente della sessione, ricalcolato solo se la pagina è cambiata."""
+        page_html = state.last_complete_html or ""
+        key = self._key(page_html, state.location)
+        if state.chat_context_key == key:
+            with self._lock:
+                self._counters["session_hits"] += 1
+            return state.chat_context
+        state.chat_context = self.compact(page_html, state.location)
+        state.chat_context_key = key
+        return state.chat_context
+
+    def _build(self, page_html: str, location: Optional[str]) -> str:
+        parser = _PageParser()
+        try:
+            parser.feed(page_html)
+            parser.close()
+        except Exception as e:
+            logger.warning(f"Compattazione contesto fallita, uso l'HTML completo: {e}")
+            return page_html
+
+        lines: List[str] = []
+        if location:
+            lines.append(f"LOCALITÀ: {location}")
+
+        dishes = []
+        for kind, dish, _city in extract_image_requests(page_html):
+            if dish and dish not in dishes and kind in ("dish", "city_dish"):
+                dishes.append(dish)
+        if dishes:
+            lines.append("PIATTI CITATI: " + "; ".join(dishes))
+
+        if parser.blocks:
+            lines.append("CONTENUTO DELLA PAGINA:")
+            for tag, text in parser.blocks:
+                if tag.startswith("h"):
+                    lines.append("#" * int(tag[1]) + " " + text)
+                else:
+                    if len(text) > _MAX_PARAGRAPH_CHARS:
+                        text = text[:_MAX_PARAGRAPH_CHARS].rsplit(" ", 1)[0] + "…"
+                    lines.append(("- " if tag == "li" else "") + text)
+
+        sections: Dict[str, List[Dict[str, Any]]] = {}
+        for card in parser.cards:
+            section = SELECTION_KEY if card["selection"] else (card["section"] or "altri suggerimenti")
+            sections.setdefault(section, []).append(card)
+        for section, texts in parser.section_text.items():
+            if section not in sections:
+                cards = _records_to_cards("".join(texts).strip())
+                if cards:
+                    sections[section] = cards
+
+        # "La nostra selezione" per prima: è l'unica lista da cui il chatbot può consigliare
+        ordered = sorted(sections.items(), key=lambda item: item[0].replace("_", " ") != SELECTION_KEY)
+        for section, cards in ordered:
+            title = "LA NOSTRA SELEZIONE" if section.replace("_", " ") == SELECTION_KEY else f"ALTRI SUGGERIMENTI - {section.upper()}"
+            lines.append(f"{title} (id = place_id):")
+            seen = set()
+            for card in cards:
+                ident = card.get("place_id") or card.get("name")
+                if ident in seen:
+                    continue
+                seen.add(ident)
+                lines.append(_card_line(card))
+        return "\n".join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._cache)}
+
+
+# Istanza condivisa per il worker corrente
+context_compactor = ContextCompactor(enabled=settings.chat_context_compact)
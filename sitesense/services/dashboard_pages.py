@@ -0,0 +1,224 @@
+"""Pagine del dashboard (``dashboard/build``) pronte da servire.
+
+Le riscritture statiche (base href, percorsi degli asset, link tra pagine,
+pulizia di ``%22`` e virgolette negli attributi href/src) dipendono solo dal
+file e dall'area (``/area_riservata`` o ``/area_super_admin``): vengono fatte
+una volta per file e il risultato è tenuto in memoria come template,
+ricostruito se cambiano mtime o dimensione del file.
+
+Le parti che dipendono dall'utente (avatar, nome, email, script dell'avatar,
+bottone hamburger) sono segnaposto del template: per ogni richiesta resta solo
+la concatenazione dei pezzi con i valori dell'utente.
+"""
+
+import logging
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+AREA_RISERVATA = "area_riservata"
+AREA_SUPER_ADMIN = "area_super_admin"
+
+# Segnaposto nel testo durante la costruzione del template (indice del segnaposto tra \x00)
+_SLOT = re.compile(r"\x00(\d+)\x00")
+
+# Pezzi del template: testo fisso oppure (nome del segnaposto, testo originale)
+Part = Union[str, Tuple[str, str]]
+
+
+def _sanitize_value(val: str) -> str:
+    """Pulizia di un valore href/src: niente %22 o virgolette interne, niente slash dopo .html."""
+    val = val.replace('%22', '').replace('"', '').replace("'", '')
+    return re.sub(r"(\.html)/+$", r"\1", val)
+
+
+def _static_rewrite(html: str, area: str) -> str:
+    """Riscritture che dipendono solo dal file e dall'area."""
+    # Inietta il base href se non presente per risolvere asset relativi
+    if "<base" not in html:
+        html = re.sub(r"(<head[^>]*>)", r"\1\n    <base href=\"/dashboard/\">", html, count=1)
+
+    # Riscrivi percorsi critici (CSS/JS/favicon/src assets) e link HTML
+    html = re.sub(r"href=\"style\.css\"", "href=\"/dashboard/style.css\"", html)
+    html = re.sub(r"src=\"bundle\.js\"", "src=\"/dashboard/bundle.js\"", html)
+    html = re.sub(r"href=\"favicon\.ico\"", "href=\"/dashboard/favicon.ico\"", html)
+    # Riscrivi riferimenti a src/ per immagini e altri asset
+    html = re.sub(r"(src|href)=\"src/", r"\1=\"/dashboard/src/", html)
+    if area == AREA_RISERVATA:
+        html = re.sub(r"href=\"(?!http)(?!/)([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
+        html = re.sub(r"href='(?!http)(?!/)([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
+        html = re.sub(r"href=\"/dashboard/([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
+        html = re.sub(r"href='/dashboard/([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
+        html = re.sub(r"href=\"\./([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
+        html = re.sub(r"href='\./([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
+        html = re.sub(r"href=\"/([A-Za-z0-9._-]+\.html)\"", r"href=\"/area_riservata?dashboard_page=\1\"", html)
+        html = re.sub(r"href='/([A-Za-z0-9._-]+\.html)'", r"href='/area_riservata?dashboard_page=\1'", html)
+    else:
+        html = re.sub(r"href=\"(?!http)(?!/)([A-Za-z0-9_-]+\.html)\"", r"href=\"/area_super_admin/\1\"", html)
+        html = re.sub(r"href='(?!http)(?!/)([A-Za-z0-9_-]+\.html)'", r"href='/area_super_admin/\1'", html)
+    # Pulisci virgolette codificate %22 eventualmente presenti nei valori href/src
+    # Inizio valore attributo
+    html = re.sub(r"(href|src)=(\"|')%22/", r"\1=\2/", html)
+    # Fine valore attributo
+    html = re.sub(r"%22(\"|')", r"\1", html)
+    # Gestisci anche il caso con slash finale prima della chiusura
+    html = re.sub(r"/%22(\"|')", r"\1", html)
+    # Rimuovi qualsiasi occorrenza di %22 all'interno dei valori href/src
+    html = re.sub(r"(href|src)=(\"|')([^\"']*?)%22([^\"']*?)(\"|')", r"\1=\2\3\4\5", html)
+    return html
+
+
+def _sanitize_attrs(html: str) -> str:
+    """Sanitizza sistematicamente i valori href/src per rimuovere virgolette interne e slash superflui."""
+    html = re.sub(r"(href|src)=\"([^\"]*)\"", lambda m: f"{m.group(1)}=\"{_sanitize_value(m.group(2))}\"", html)
+    html = re.sub(r"(href|src)='([^']*)'", lambda m: f"{m.group(1)}='{_sanitize_value(m.group(2))}'", html)
+    return html
+
+
+def _esc(v) -> str:
+    s = "" if v is None else str(v)
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+class DashboardUser:
+    """Valori dell'header utente da inserire nel template."""
+
+    def __init__(self, name: str, full_name: str, email: str, image: str):
+        self.name = name
+        self.full_name = full_name
+        self.email = email
+        self.image = image
+
+    @classmethod
+    def from_row(cls, row: dict, fallback_email: str) -> "DashboardUser":
+        name = (row.get("name") or "").strip()
+        surname = (row.get("surname") or "").strip()
+        email = (row.get("email") or fallback_email or "").strip()
+        image = (row.get("profile_image") or "").strip() or "/assets/user-variant1.png"
+        return cls(name=name, full_name=(f"{name} {surname}".strip() or email), email=email, image=image)
+
+
+class DashboardTemplate:
+    """Pagina già riscritta, divisa in testo fisso e segnaposto utente."""
+
+    def __init__(self, parts: List[Part]):
+        self.parts = parts
+
+    def render(self, user: Optional[DashboardUser] = None) -> str:
+        if user is None:
+            return "".join(p if isinstance(p, str) else p[1] for p in self.parts)
+        img_src = _esc(user.image)
+        values = {
+            # Avatar nell'header (il valore passa dalla stessa pulizia degli altri src)
+            "avatar": f'src="{_sanitize_value(img_src)}"',
+            # Nome breve vicino all'avatar: invariato se l'utente non ha un nome
+            "name": f">{_esc(user.name)}<" if user.name else None,
+            # Nome completo ed email nel dropdown utente
+            "full_name": f">{_esc(user.full_name)}<",
+            "email": f">{_esc(user.email)}<",
+            # Bottone hamburger con prevent.stop
+            "hamburger": '@click.prevent.stop="sidebarToggle = !sidebarToggle"',
+            # Forza avatar lato client se presenti residui non catturati
+            "avatar_script": (
+                f"<script>try{{var img='{img_src}';var el=document.getElementById('user-avatar-img');if(el){{el.src=img;}}"
+                f"var q=document.querySelector('img[src*=\"owner.jpg\"]');if(q){{q.src=img;}}}}catch(e){{}}</script>"
+            ),
+        }
+        out = []
+        for p in self.parts:
+            if isinstance(p, str):
+                out.append(p)
+            else:
+                value = values.get(p[0])
+                out.append(p[1] if value is None else value)
+        return "".join(out)
+
+
+def build_template(html: str, area: str) -> DashboardTemplate:
+    """Applica le riscritture statiche e marca le parti che dipendono dall'utente."""
+    html = _static_rewrite(html, area)
+    slots: List[Tuple[str, str]] = []
+
+    def _slot(name: str):
+        def repl(m):
+            slots.append((name, m.group(0)))
+            return f"\x00{len(slots) - 1}\x00"
+        return repl
+
+    if area == AREA_RISERVATA:
+        html = re.sub(r'src="/dashboard/src/images/user/owner\.jpg"', _slot("avatar"), html)
+        html = re.sub(r'src="src/images/user/owner\.jpg"', _slot("avatar"), html)
+        html = re.sub(r">\s*Musharof\s*<", _slot("name"), html)
+        html = re.sub(r">\s*Musharof Chowdhury\s*<", _slot("full_name"), html)
+        html = re.sub(r">\s*randomuser@pimjo\.com\s*<", _slot("email"), html)
+        html = re.sub(r"@click\.stop=\"sidebarToggle\s*=\s*!sidebarToggle\"", _slot("hamburger"), html)
+        html = re.sub(r"(?=</body>)", _slot("avatar_script"), html, count=1, flags=re.IGNORECASE)
+    html = _sanitize_attrs(html)
+
+    parts: List[Part] = []
+    pos = 0
+    for m in _SLOT.finditer(html):
+        if m.start() > pos:
+            parts.append(html[pos:m.start()])
+        name, original = slots[int(m.group(1))]
+        # Il testo originale è quello che la pulizia degli attributi avrebbe prodotto
+        parts.append((name, _sanitize_attrs(original)))
+        pos = m.end()
+    if pos < len(html):
+        parts.append(html[pos:])
+    return DashboardTemplate(parts)
+
+
+class DashboardPages:
+    """Template delle pagine del dashboard per (file, area), invalidati su mtime/dimensione."""
+
+    def __init__(self, build_dir: Path):
+        self.build_dir = build_dir
+        self._lock = threading.Lock()
+        self._templates: Dict[Tuple[str, str], Tuple[int, int, DashboardTemplate]] = {}
+        self._counters = {"hits": 0, "builds": 0}
+
+    def get(self, page_name: str, area: str) -> Optional[DashboardTemplate]:
+        """Template della pagina, None se il file non esiste."""
+        path = self.build_dir / page_name
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        key = (page_name, area)
+        with self._lock:
+            cached = self._templates.get(key)
+            if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                self._counters["hits"] += 1
+                return cached[2]
+        template = build_template(path.read_text(encoding="utf-8"), area)
+        with self._lock:
+            self._templates[key] = (st.st_mtime_ns, st.st_size, template)
+            self._counters["builds"] += 1
+        return template
+
+    def warm(self) -> int:
+        """Prepara i template di tutte le pagine del build per entrambe le aree (all'avvio)."""
+        if not self.build_dir.is_dir():
+            return 0
+        count = 0
+        for path in self.build_dir.glob("*.html"):
+            for area in (AREA_RISERVATA, AREA_SUPER_ADMIN):
+                try:
+                    if self.get(path.name, area) is not None:
+                        count += 1
+                except Exception as e:
+                    logger.warning(f"Template dashboard {path.name} ({area}) non preparato: {e}")
+        logger.info(f"Template dashboard pronti: {count}")
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "templates": len(self._templates)}
+
+
+# Istanza condivisa per il worker corrente
+dashboard_pages = DashboardPages(build_dir=Path(__file__).resolve().parents[1] / "dashboard" / "build")
@@ -1,32 +1,256 @@
+"""Accesso a MySQL tramite un pool di connessioni per worker.
+
+Il pool (``mysql.connector.pooling``) viene creato all'avvio dell'applicazione
+(lifespan) con ``DB_POOL_SIZE`` connessioni già configurate in utf8mb4;
+``get_connection()`` restituisce una connessione del pool e ``conn.close()`` la
+rimette a disposizione invece di chiuderla. Il pool verifica la connessione a
+ogni prelievo e la riapre se il server l'ha chiusa.
+
+Dai gestori asincroni il lavoro sul database va eseguito con ``run()`` (o
+``acquire()``), che lo sposta in un thread: così le query non bloccano l'event
+loop e le richieste oltre la dimensione del pool attendono il proprio turno.
+"""
+
+import asyncio
+import logging
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, TypeVar
+
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
 
-def get_connection():
-    try:
-        conn = mysql.connector.connect(
-            host=os.getenv("MYSQL_HOST", "localhost"),
-            user=os.getenv("MYSQL_USER", "root"),
-            password=os.getenv("MYSQL_PASSWORD", "root"),
-            database=os.getenv("MYSQL_DATABASE", "Initalya"),
-            charset="utf8mb4",
-            use_unicode=True,
-        )
-        try:
-            # Imposta charset/collation a livello di sessione per massima compatibilità
-            conn.set_charset_collation("utf8mb4", "utf8mb4_unicode_ci")
-        except Exception:
+from ..config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+POOL_NAME = "sitesense"
+# Limite imposto da mysql.connector alla dimensione di un pool
+_POOL_MAX_SIZE = pooling.CNX_POOL_MAXSIZE
+# Dopo un errore di creazione del pool (DB irraggiungibile) si riprova non prima di così
+_POOL_RETRY_SECONDS = 30.0
+
+_pool: Optional["_MetricsPool"] = None
+_pool_failed_at = 0.0
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats: Dict[str, float] = {
+    "acquired": 0,
+    "released": 0,
+    "in_use": 0,
+    "peak_in_use": 0,
+    "overflow": 0,
+    "failures": 0,
+    "wait_seconds": 0.0,
+}
+_async_slots: Optional[asyncio.Semaphore] = None
+
+
+def _connection_config() -> Dict[str, Any]:
+    return {
+        "host": os.getenv("MYSQL_HOST", "localhost"),
+        "user": os.getenv("MYSQL_USER", "root"),
+        "password": os.getenv("MYSQL_PASSWORD", "root"),
+        "database": os.getenv("MYSQL_DATABASE", "Initalya"),
+        "charset": "utf8mb4",
+        "collation": "utf8mb4_unicode_ci",
+        "use_unicode": True,
+        # Le scritture non restano bloccate su un lock oltre questo limite (default MySQL: 50s)
+        "init_command": f"SET SESSION innodb_lock_wait_timeout = {max(1, settings.db_lock_wait_seconds)}",
+    }
+
+
+def _pool_size() -> int:
+    return max(1, min(settings.db_pool_size, _POOL_MAX_SIZE))
+
+
+def _count(key: str, delta: float = 1) -> None:
+    with _stats_lock:
+        _stats[key] += delta
+        if key == "in_use" and _stats["in_use"] > _stats["peak_in_use"]:
+            _stats["peak_in_use"] = _stats["in_use"]
+
+
+class _MetricsPool(pooling.MySQLConnectionPool):
+    """Pool che conta le restituzioni e annulla le transazioni lasciate aperte."""
+
+    def add_connection(self, cnx=None):
+        if cnx is not None:
+            # Connessione restituita da conn.close(): la sessione (charset) resta valida,
+            # eventuali transazioni non confermate vengono annullate
             try:
-                cur = conn.cursor()
-                cur.execute("SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci")
-                cur.close()
+                if cnx.in_transaction:
+                    cnx.rollback()
             except Exception:
                 pass
-        return conn
+            _count("in_use", -1)
+            _count("released")
+        super().add_connection(cnx)
+
+
+def _get_pool() -> Optional[_MetricsPool]:
+    """Restituisce il pool, creandolo se necessario (None se il DB non è raggiungibile)."""
+    global _pool, _pool_failed_at
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        if _pool_failed_at and time.monotonic() - _pool_failed_at < _POOL_RETRY_SECONDS:
+            return None
+        try:
+            _pool = _MetricsPool(
+                pool_name=POOL_NAME,
+                pool_size=_pool_size(),
+                # La sessione contiene solo il charset: non serve azzerarla a ogni restituzione
+                pool_reset_session=False,
+                **_connection_config(),
+            )
+            _pool_failed_at = 0.0
+            logger.info(f"Pool MySQL creato ({_pool_size()} connessioni)")
+        except Error as e:
+            _pool_failed_at = time.monotonic()
+            logger.error(f"Creazione pool MySQL fallita: {e}")
+    return _pool
+
+
+def _connect_direct():
+    """Connessione singola fuori dal pool (pool esaurito o non disponibile)."""
+    try:
+        return mysql.connector.connect(**_connection_config())
     except Error as e:
-        print("Errore connessione MySQL:", e)
+        _count("failures")
+        logger.error(f"Errore connessione MySQL: {e}")
         return None
 
+
+def get_connection():
+    """Connessione dal pool (o diretta se il pool è esaurito); None se il DB non è disponibile.
+    Va sempre chiusa con conn.close(), che la restituisce al pool."""
+    pool = _get_pool()
+    if pool is not None:
+        start = time.perf_counter()
+        try:
+            conn = pool.get_connection()
+            _count("wait_seconds", time.perf_counter() - start)
+            _count("acquired")
+            _count("in_use")
+            return conn
+        except PoolError:
+            _count("overflow")
+            logger.warning("Pool MySQL esaurito: uso una connessione diretta")
+        except Error as e:
+            _count("failures")
+            logger.error(f"Errore prelievo connessione dal pool MySQL: {e}")
+            return None
+    return _connect_direct()
+
+
+def _close_quietly(conn) -> None:
+    if conn is None:
+        return
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _slots() -> asyncio.Semaphore:
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(_pool_size())
+    return _async_slots
+
+
+def _run_with_connection(fn: Callable[..., T], args, kwargs) -> T:
+    conn = get_connection()
+    try:
+        return fn(conn, *args, **kwargs)
+    finally:
+        _close_quietly(conn)
+
+
+async def run(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Esegue ``fn(conn, *args, **kwargs)`` in un thread con una connessione del pool.
+
+    ``conn`` è None se il database non è disponibile; la connessione viene
+    restituita al pool al termine, anche in caso di eccezione.
+    """
+    async with _slots():
+        return await asyncio.to_thread(_run_with_connection, fn, args, kwargs)
+
+
+@asynccontextmanager
+async def acquire():
+    """Connessione del pool per un blocco ``async with``; le query vanno comunque
+    eseguite fuori dall'event loop (``asyncio.to_thread``) oppure tramite ``run()``."""
+    async with _slots():
+        conn = await asyncio.to_thread(get_connection)
+        try:
+            yield conn
+        finally:
+            await asyncio.to_thread(_close_quietly, conn)
+
+
+def _ping(conn) -> bool:
+    if conn is None:
+        return False
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1")
+        cur.fetchall()
+        return True
+    finally:
+        cur.close()
+
+
+async def health_check() -> bool:
+    """True se il database risponde a una query banale."""
+    try:
+        return await run(_ping)
+    except Exception as e:
+        logger.warning(f"Health check MySQL fallito: {e}")
+        return False
+
+
+async def startup() -> None:
+    """Crea il pool all'avvio (chiamato dal lifespan dell'applicazione)."""
+    await asyncio.to_thread(_get_pool)
+
+
+async def shutdown() -> None:
+    """Chiude le connessioni inattive del pool."""
+    global _pool, _async_slots
+    pool = _pool
+    _pool = None
+    _async_slots = None
+    if pool is not None:
+        # API non pubblica di mysql.connector, unico modo per chiudere le connessioni del pool
+        remove = getattr(pool, "_remove_connections", None)
+        if remove is not None:
+            try:
+                await asyncio.to_thread(remove)
+            except Exception as e:
+                logger.warning(f"Chiusura pool MySQL incompleta: {e}")
+
+
+def stats() -> Dict[str, Any]:
+    """Metriche di utilizzo del pool (per log e diagnostica)."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    acquired = snapshot["acquired"]
+    snapshot["avg_wait_ms"] = round(snapshot.pop("wait_seconds") * 1000 / acquired, 3) if acquired else 0.0
+    snapshot["pool_size"] = _pool_size()
+    snapshot["pool_active"] = _pool is not None
+    return snapshot
+
+
 if __name__ == "__main__":
     conn = get_connection()
     if conn:
@@ -1,11 +1,13 @@
+import asyncio
 import logging
-import math
 import json
 import re
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from urllib.parse import quote_plus
 from .preferences_checker_service import PreferencesCheckerService
+from .scoring import rank_top_k
+from .json_storage import json_storage
 
 logger = logging.getLogger(__name__)
 
@@ -80,26 +82,16 @@ class FilteringRankingService:
         selection: List[Dict[str, Any]] = []
         suggests: List[Dict[str, Any]] = []
 
-        try:
-            if sel_path.exists():
-                selection = json.loads(sel_path.read_text(encoding="utf-8")) or []
-            if sug_path.exists():
-                suggests = json.loads(sug_path.read_text(encoding="utf-8")) or []
-        except Exception:
-            selection, suggests = [], []
+        selection = json_storage.read_sync(sel_path) or []
+        suggests = json_storage.read_sync(sug_path) or []
 
         # Fallback other_locals.json
         if not selection and not suggests:
-            other_path = CACHE_DIR / "other_locals.json"
-            try:
-                if other_path.exists():
-                    data = json.loads(other_path.read_text(encoding="utf-8"))
-                    if isinstance(data, list):
-                        suggests = data
-                    elif isinstance(data, dict) and isinstance(data.get("locals"), list):
-                        suggests = data.get("locals", [])
-            except Exception:
-                pass
+            data = json_storage.read_sync(CACHE_DIR / "other_locals.json")
+            if isinstance(data, list):
+                suggests = data
+            elif isinstance(data, dict) and isinstance(data.get("locals"), list):
+                suggests = data.get("locals", [])
 
         return {"selection": selection, "suggests": suggests}
 
@@ -378,9 +370,11 @@ class FilteringRankingService:
         except Exception:
             return None
 
-    async def filter_rank_and_present(self, search_queries: Dict[str, Any], maps_data: Dict[str, Any], user_query: str) -> Dict[str, Any]:
+    async def filter_rank_and_present(self, search_queries: Dict[str, Any], maps_data: Dict[str, Any], user_query: str, preferences_task: Optional["asyncio.Task"] = None, results_format: str = "html") -> Dict[str, Any]:
         """
         Metodo principale che orchestra il processo di filtering, ranking e presentazione.
+        `preferences_task` è l'eventuale verifica preferenze avviata in anticipo (start_preferences_check);
+        `results_format` sceglie tra card HTML ("html") e record compatti ("json").
         """
         # Se la chiave Maps NON è attiva, carica dai JSON salvati e presenta i risultati.
         if not self._is_maps_key_active():
@@ -393,7 +387,10 @@ class FilteringRankingService:
 
             # Sezione "La nostra selezione" (usa il renderer generico delle card)
             if selection:
-                sel_html = self._format_selection_to_html(selection)
+                if results_format == "json":
+                    sel_html = [self._to_record(item) for item in selection]
+                else:
+                    sel_html = self._format_selection_to_html(selection)
                 if sel_html:
                     ranked_results["la_nostra_selezione"] = {
                         "results": sel_html,
@@ -408,13 +405,13 @@ class FilteringRankingService:
 
             for cat, items in groups.items():
                 ranked_results[cat] = {
-                    "results": self._format_to_html(items, None),
+                    "results": self._present(items, cat, results_format),
                     "iframe_url": None,
                 }
 
             return ranked_results
 
-        preferences = await self.preferences_checker_service.check_preferences(user_query)
+        preferences = await self.resolve_preferences(user_query, preferences_task)
         logger.info(f"Preferenze dell'utente: {preferences}")
         
         # ogni ciclo contiene le attività per una determinata categoria
@@ -422,49 +419,114 @@ class FilteringRankingService:
         all_activities = {}  # Raccoglie tutte le attività per categoria per la selezione
         
         for category, query in search_queries.items():
-            cat_lower = str(category).lower()
-            if ('prodotti' in cat_lower) or ('eventi' in cat_lower):
-                logger.info(f"Salto categoria '{category}' (prodotti/eventi non caricati lato server)")
+            entry, ranked_selection = self.rank_category(category, query, maps_data.get(category, {}), preferences, results_format)
+            if entry is None:
                 continue
-            data = maps_data.get(category, {})
-            activities = data.get("results", [])
-            if activities:
-                # Se la query è una lista, si tratta di luoghi specifici e non vengono filtrati
-                if isinstance(query, list):
-                    logger.info(f"----------------------Query per '{category}' è una lista. Salto i filtri e il ranking.")
-                    final_selection = activities
-                else:
-                    logger.info(f"----------------------Query per '{category}' non è una lista, quindi sono delle ricerche generiche.")
-                    final_selection = self.orchestrate_preferences_filtering(activities, preferences)
-
-                # Dopo aver filtrato, ordino le attività
-                ranked_selection = self._rank_activities(final_selection)
+            if ranked_selection:
                 all_activities[category] = ranked_selection  # Salva per la selezione
-
-                ranked_html = self._format_to_html(ranked_selection, None)
-                ranked_results[category] = {
-                    "results": ranked_html,
-                    "iframe_url": data.get("iframe_url")
-                }
-            else:
-                ranked_results[category] = data
+            ranked_results[category] = entry
         
         # Crea la sezione "La nostra selezione" e la inserisce all'inizio
-        our_selection = self._create_our_selection(all_activities)
-        if our_selection:
+        selection_entry = self.build_selection_entry(all_activities, results_format)
+        if selection_entry:
             # Crea un nuovo dizionario con "La nostra selezione" come primo elemento
-            new_ranked_results = {
-                "la_nostra_selezione": {
-                    "results": our_selection,
-                    "iframe_url": None
-                }
-            }
+            new_ranked_results = {"la_nostra_selezione": selection_entry}
             # Aggiungi tutti gli altri risultati dopo
             new_ranked_results.update(ranked_results)
             ranked_results = new_ranked_results
         
         return ranked_results
 
+    def start_preferences_check(self, user_query: str) -> "asyncio.Task":
+        """Avvia in background l'estrazione delle preferenze, da attendere al momento del filtraggio."""
+        return asyncio.create_task(self.preferences_checker_service.check_preferences(user_query))
+
+    async def resolve_preferences(self, user_query: str, preferences_task: Optional["asyncio.Task"] = None) -> str:
+        """Restituisce le preferenze dal task avviato in anticipo oppure le calcola ora."""
+        if preferences_task is not None:
+            try:
+                return await preferences_task
+            except Exception as e:
+                logger.warning(f"Verifica preferenze anticipata fallita: {e}. Nuovo tentativo.")
+        return await self.preferences_checker_service.check_preferences(user_query)
+
+    def rank_category(self, category: str, query: Any, data: Dict[str, Any], preferences: str, results_format: str = "html") -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Filtra, ordina e formatta i risultati Maps di una singola categoria.
+
+        Restituisce (voce per i risultati, attività selezionate); la voce è None
+        per le categorie che non vengono mostrate lato server. Con
+        ``results_format="json"`` i risultati sono record compatti invece di HTML.
+        """
+        cat_lower = str(category).lower()
+        if ('prodotti' in cat_lower) or ('eventi' in cat_lower):
+            logger.info(f"Salto categoria '{category}' (prodotti/eventi non caricati lato server)")
+            return None, []
+        activities = data.get("results", [])
+        if not activities:
+            return data, []
+
+        # Se la query è una lista, si tratta di luoghi specifici e non vengono filtrati
+        if isinstance(query, list):
+            logger.info(f"----------------------Query per '{category}' è una lista. Salto i filtri e il ranking.")
+            final_selection = activities
+        else:
+            logger.info(f"----------------------Query per '{category}' non è una lista, quindi sono delle ricerche generiche.")
+            final_selection = self.orchestrate_preferences_filtering(activities, preferences)
+
+        # Dopo aver filtrato, ordino le attività
+        ranked_selection = self._rank_activities(final_selection)
+
+        entry = {
+            "results": self._present(ranked_selection, category, results_format),
+            "iframe_url": data.get("iframe_url")
+        }
+        return entry, ranked_selection
+
+    def build_selection_entry(self, all_activities: Dict[str, List[Dict[str, Any]]], results_format: str = "html") -> Optional[Dict[str, Any]]:
+        """Voce "La nostra selezione" a partire dalle attività classificate per categoria."""
+        if results_format == "json":
+            items = self._pick_our_selection(all_activities)
+            our_selection = [self._to_record(item) for item in items] or None
+        else:
+            our_selection = self._create_our_selection(all_activities)
+        if not our_selection:
+            return None
+        return {"results": our_selection, "iframe_url": None}
+
+    def _present(self, activities: List[Dict[str, Any]], category: str, results_format: str) -> Any:
+        """Risultati di una categoria: card HTML oppure, in formato JSON, record compatti resi dal client."""
+        if results_format == "json":
+            return [self._to_record(activity, category) for activity in activities]
+        return self._format_to_html(activities, None)
+
+    def _to_record(self, activity: Dict[str, Any], category: str = "") -> Dict[str, Any]:
+        """Record compatto di un'attività: solo i campi usati dalle card, senza markup.
+        Le foto Places sono indicate dal riferimento (``photo_ref``, servito da /place_photo);
+        gli URL diretti restano in ``image``. I campi assenti vengono omessi."""
+        location = (activity.get("geometry") or {}).get("location") or activity.get("location")
+        if not isinstance(location, dict):
+            location = {}
+        lat = activity.get("lat") if activity.get("lat") not in (None, "") else location.get("lat")
+        lng = activity.get("lng") if activity.get("lng") not in (None, "") else location.get("lng")
+        photos = activity.get("photos")
+        photo_ref = None
+        if isinstance(photos, list) and photos and isinstance(photos[0], dict):
+            photo_ref = photos[0].get("photo_reference")
+        record = {
+            "place_id": activity.get("place_id") or activity.get("id"),
+            "name": activity.get("name") or activity.get("nome"),
+            "address": activity.get("formatted_address") or activity.get("vicinity") or activity.get("indirizzo"),
+            "lat": lat,
+            "lng": lng,
+            "rating": activity.get("rating") or activity.get("valutazione"),
+            "reviews": activity.get("user_ratings_total") or activity.get("reviews_count"),
+            "price_level": activity.get("price_level"),
+            "category": activity.get("display_category") or activity.get("category") or category,
+            "photo_ref": photo_ref,
+            "image": None if photo_ref else self._resolve_photo_url(activity),
+        }
+        return {k: v for k, v in record.items() if v not in (None, "")}
+
 
 
 
@@ -594,49 +656,8 @@ class FilteringRankingService:
         4. Distanza
         5. Seleziona 24 attività scegliendo di mostarne inizialmente fino a 8, cliccando il tasto "Carica altri suggerimenti" si mostrano altre 8 attività
         """
-        # Calcolo del punteggio di qualità per ogni attività
-        for activity in activities:
-            rating_raw = activity.get('rating')
-            reviews_raw = activity.get('user_ratings_total')
-
-            # Normalizza rating a float; valori mancanti o non numerici diventano 0.0
-            try:
-                rating = float(rating_raw)
-            except (TypeError, ValueError):
-                rating = 0.0
-
-            # Normalizza reviews a int; valori None/str non numerici diventano 0
-            try:
-                reviews = int(reviews_raw)
-            except (TypeError, ValueError):
-                reviews = 0
-            if reviews < 0:
-                reviews = 0
-            # Usiamo log10(reviews + 1) per evitare log(0) e per dare peso alle recensioni
-            quality_score = rating * math.log10(reviews + 1)
-            activity['quality_score'] = quality_score
-            logger.info(f"Attività: {activity.get('name')}, Rating: {rating}, Recensioni: {reviews}, Punteggio Qualità: {quality_score}")
-
-        # Ordinamento delle attività in base al punteggio di qualità (decrescente)
-        sorted_activities = sorted(activities, key=lambda x: x.get('quality_score', 0), reverse=True)
-
-        logger.info("Attività ordinate per punteggio di qualità:")
-        for activity in sorted_activities:
-            logger.info(f"  - {activity.get('name')}: {activity.get('quality_score')}")
-
-        # 5. Seleziona le migliori attività
-        num_activities = len(sorted_activities)
-        if num_activities <= 3:
-            top_activities = sorted_activities
-            logger.info(f"Selezionate tutte le {num_activities} attività disponibili.")
-        else:
-            # Seleziona un numero di attività compreso tra 3 e 5
-            # In questo caso, ne selezioniamo 5 se ce ne sono abbastanza
-            num_to_select = min(5, num_activities)
-            top_activities = sorted_activities[:num_to_select]
-            logger.info(f"Selezionate le prime {num_to_select} attività su {num_activities}.")
-
-        return top_activities
+        # Punteggio di qualità calcolato sull'intero lotto e selezione top-k parziale
+        return rank_top_k(activities, 5)
 
     def _format_selection_to_html(self, items: List[Dict[str, Any]]) -> Optional[str]:
         """
@@ -809,10 +830,10 @@ class FilteringRankingService:
         html_parts.append('</div></div>')
         return "\n".join(html_parts)
 
-    def _create_our_selection(self, all_activities: Dict[str, List[Dict[str, Any]]]) -> Optional[str]:
+    def _pick_our_selection(self, all_activities: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
         """
-        Crea la sezione "La nostra selezione" selezionando automaticamente
-        la migliore attività solo per le categorie specifiche: Hotel, Vini, Dolci, Cucina tipica.
+        Seleziona automaticamente per "La nostra selezione" la migliore attività
+        solo per le categorie specifiche: Hotel, Vini, Dolci, Cucina tipica.
         """
         selected_items = []
         
@@ -842,11 +863,16 @@ class FilteringRankingService:
             if not found_activity:
                 logger.info(f"Nessuna attività trovata per la categoria target '{target_key}'")
         
-        # Se non ci sono attività selezionate, restituisci None
         if not selected_items:
             logger.info("Nessuna attività disponibile per 'La nostra selezione' nelle categorie specificate")
-            return None
-        
+        return selected_items
+
+    def _create_our_selection(self, all_activities: Dict[str, List[Dict[str, Any]]]) -> Optional[str]:
+        """
+        Crea la sezione "La nostra selezione" (HTML) con le attività scelte da _pick_our_selection.
+        """
+        selected_items = self._pick_our_selection(all_activities)
+        # Se non ci sono attività selezionate, restituisci None
         if not selected_items:
             return None
         
@@ -1,8 +1,8 @@
 import logging
-import math
 import json
 from typing import List, Dict, Any, Optional
 from .preferences_checker_service import PreferencesCheckerService
+from .scoring import rank_top_k
 
 logger = logging.getLogger(__name__)
 
@@ -328,35 +328,8 @@ class FilteringRankingService:
         4. Distanza
         5. Seleziona 24 attività scegliendo di mostarne inizialmente fino a 8, cliccando il tasto "Carica altri suggerimenti" si mostrano altre 8 attività
         """
-        # Calcolo del punteggio di qualità per ogni attività
-        for activity in activities:
-            rating = activity.get('rating', 0)
-            reviews = activity.get('user_ratings_total', 0)
-            # Usiamo log10(reviews + 1) per evitare log(0) e per dare peso alle recensioni
-            quality_score = rating * math.log10(reviews + 1)
-            activity['quality_score'] = quality_score
-            logger.info(f"Attività: {activity.get('name')}, Rating: {rating}, Recensioni: {reviews}, Punteggio Qualità: {quality_score}")
-
-        # Ordinamento delle attività in base al punteggio di qualità (decrescente)
-        sorted_activities = sorted(activities, key=lambda x: x.get('quality_score', 0), reverse=True)
-
-        logger.info("Attività ordinate per punteggio di qualità:")
-        for activity in sorted_activities:
-            logger.info(f"  - {activity.get('name')}: {activity.get('quality_score')}")
-
-        # 5. Seleziona le migliori attività
-        num_activities = len(sorted_activities)
-        if num_activities <= 3:
-            top_activities = sorted_activities
-            logger.info(f"Selezionate tutte le {num_activities} attività disponibili.")
-        else:
-            # Seleziona un numero di attività compreso tra 3 e 5
-            # In questo caso, ne selezioniamo 5 se ce ne sono abbastanza
-            num_to_select = min(24, num_activities)
-            top_activities = sorted_activities[:num_to_select]
-            logger.info(f"Selezionate le prime {num_to_select} attività su {num_activities}.")
-
-        return top_activities
+        # Punteggio di qualità calcolato sull'intero lotto e selezione top-k parziale
+        return rank_top_k(activities, 24)
 
     def _create_our_selection(self, all_activities: Dict[str, List[Dict[str, Any]]]) -> Optional[str]:
         """
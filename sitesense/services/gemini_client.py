@@ -0,0 +1,102 @@
+"""Livello condiviso per le chiamate ai modelli Gemini.
+
+Tutti i servizi passano da qui: un unico client google-genai per processo,
+chiamate eseguite con il client asincrono dell'SDK (``client.aio``) e un
+semaforo globale che limita le richieste contemporanee verso il modello.
+In questo modo nessuna chiamata blocca l'event loop di uvicorn.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from google import genai
+from google.genai import types
+
+from ..config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[genai.Client] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_stats: Dict[str, Any] = {
+    "calls": 0,
+    "errors": 0,
+    "in_flight": 0,
+    "max_in_flight": 0,
+    "total_wait_seconds": 0.0,
+    "total_call_seconds": 0.0,
+}
+
+
+def get_client() -> genai.Client:
+    """Restituisce il client google-genai condiviso (creato alla prima richiesta)."""
+    global _client
+    if _client is None:
+        _client = genai.Client(api_key=settings.gemini_api_key)
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.gemini_max_concurrency)
+    return _semaphore
+
+
+@asynccontextmanager
+async def _model_slot():
+    """Acquisisce uno slot del limite di concorrenza e aggiorna le metriche."""
+    wait_start = time.perf_counter()
+    async with _get_semaphore():
+        call_start = time.perf_counter()
+        _stats["total_wait_seconds"] += call_start - wait_start
+        _stats["calls"] += 1
+        _stats["in_flight"] += 1
+        _stats["max_in_flight"] = max(_stats["max_in_flight"], _stats["in_flight"])
+        try:
+            yield
+        except Exception:
+            _stats["errors"] += 1
+            raise
+        finally:
+            _stats["in_flight"] -= 1
+            _stats["total_call_seconds"] += time.perf_counter() - call_start
+
+
+async def generate_content(model: str, contents: Any, config: Optional[types.GenerateContentConfig] = None):
+    """Equivalente asincrono di ``client.models.generate_content``."""
+    async with _model_slot():
+        return await get_client().aio.models.generate_content(model=model, contents=contents, config=config)
+
+
+def create_chat(model: str, config: Optional[types.GenerateContentConfig] = None, history: Optional[List] = None):
+    """Crea una chat asincrona (``AsyncChat``) sul client condiviso.
+
+    La creazione è locale e non effettua chiamate di rete: il limite di
+    concorrenza si applica solo a ``send_message``.
+    """
+    return get_client().aio.chats.create(model=model, config=config, history=history or [])
+
+
+async def send_message(chat, message: Any):
+    """Invia un messaggio su una chat creata con ``create_chat``."""
+    async with _model_slot():
+        return await chat.send_message(message)
+
+
+async def send_message_stream(chat, message: Any) -> AsyncIterator[Any]:
+    """Invia un messaggio in streaming: restituisce i chunk man mano che arrivano.
+    Lo slot di concorrenza resta occupato fino alla fine dello stream."""
+    async with _model_slot():
+        async for chunk in await chat.send_message_stream(message):
+            yield chunk
+
+
+def stats() -> Dict[str, Any]:
+    """Metriche di utilizzo del livello di chiamata (per log e diagnostica)."""
+    snapshot = dict(_stats)
+    snapshot["max_concurrency"] = settings.gemini_max_concurrency
+    return snapshot
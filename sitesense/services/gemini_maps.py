@@ -1,13 +1,16 @@
+import asyncio
 import logging
 import os
 import json
 import re
-from typing import Dict, Any, List, Optional, Union
+from urllib.parse import quote_plus
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple, Union
 
-import httpx
-from google import genai
 from google.genai import types
 from ..config.settings import settings
+from . import gemini_client, http_client
+from .places_cache import details_key, find_key, places_cache
+from .ttl_cache import MISSING
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +22,7 @@ class GeminiMapsService:
     """
 
     def __init__(self):
-        self.client = genai.Client(api_key=settings.gemini_api_key)
+        self.client = gemini_client.get_client()
         self.model = os.getenv("GEMINI_MAPS_MODEL", "gemini-2.5-flash")
 
         self.google_maps_api_key = settings.google_maps_api_key
@@ -118,12 +121,20 @@ Formato:
             "language": "it"
         }
 
-        async with httpx.AsyncClient(timeout=10) as c:
-            r = await c.get(url, params=params)
-            r.raise_for_status()
-            data = r.json()
+        key = find_key(query, "gemini_maps")
+        cached = await places_cache.get(key)
+        if cached is not MISSING:
+            return cached
 
-        return data["candidates"][0] if data.get("candidates") else None
+        r = await http_client.get(url, params=params, timeout=10)
+        r.raise_for_status()
+        data = r.json()
+
+        candidate = data["candidates"][0] if data.get("candidates") else None
+        # Memorizza anche "nessun candidato"; gli errori di quota/chiave no
+        if data.get("status") in ("OK", "ZERO_RESULTS"):
+            await places_cache.set(key, candidate)
+        return candidate
 
     async def _place_details(self, place_id: str) -> Dict[str, Any]:
         url = f"{self.places_base}/details/json"
@@ -134,10 +145,15 @@ Formato:
             "key": self.google_maps_api_key
         }
 
-        async with httpx.AsyncClient(timeout=10) as c:
-            r = await c.get(url, params=params)
-            r.raise_for_status()
-            result = r.json().get("result", {})
+        key = details_key(place_id, "gemini_maps")
+        cached = await places_cache.get(key)
+        if cached is not MISSING and cached is not None:
+            return cached
+
+        r = await http_client.get(url, params=params, timeout=10)
+        r.raise_for_status()
+        data = r.json()
+        result = data.get("result", {})
 
         photo_url = None
         if result.get("photos"):
@@ -145,7 +161,7 @@ Formato:
             if ref:
                 photo_url = self._photo_url(ref)
 
-        return {
+        details = {
             "name": result.get("name"),
             "formatted_address": result.get("formatted_address"),
             "geometry": result.get("geometry"),
@@ -159,6 +175,9 @@ Formato:
             "photo_url": photo_url,
             "place_id": place_id,
         }
+        if data.get("status") == "OK" and result:
+            await places_cache.set(key, details)
+        return details
 
     async def get_place_details(self, place_id: str) -> Dict[str, Any]:
         """Endpoint backend per /api/place_details/{place_id}. Restituisce dettagli completi.
@@ -172,124 +191,176 @@ Formato:
             return {"error": "Errore nel recupero dei dettagli del luogo"}
 
     def _photo_url(self, ref: str) -> str:
-        return (
-            f"{self.places_base}/photo"
-            f"?maxwidth=1600"
-            f"&photo_reference={ref}"
-            f"&key={self.google_maps_api_key}"
-        )
+        # Servita dal proxy immagini locale: variante ridimensionata e cache su disco
+        return f"/place_photo?ref={quote_plus(ref)}&v=hero"
 
     # ------------------------------------------------------------------
     # MAIN
     # ------------------------------------------------------------------
 
-    async def search_places(self, categories: Dict[str, Any], user_message: str) -> Dict[str, Any]:
-        results = {}
+    async def _lookup_venue(self, search_query: str, sem: asyncio.Semaphore, calls: Dict[str, int]) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Catena find-place -> details per un singolo luogo, limitata dal semaforo della ricerca."""
+        async with sem:
+            calls["findplace"] += 1
+            place = await self._places_find(search_query)
+        if not place:
+            return None
+
+        async with sem:
+            calls["details"] += 1
+            details = await self._place_details(place.get("place_id"))
+        return place, details
+
+    async def _lookup_venues(self, search_queries: List[str], sem: asyncio.Semaphore, calls: Dict[str, int]) -> List[Optional[Tuple[Dict[str, Any], Dict[str, Any]]]]:
+        """Esegue le catene in parallelo mantenendo l'ordine delle query.
+        Un errore su un luogo fa fallire la categoria, come nella versione sequenziale."""
+        outcomes = await asyncio.gather(
+            *(self._lookup_venue(q, sem, calls) for q in search_queries),
+            return_exceptions=True
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return outcomes
+
+    async def _search_category(self, category: str, query: Any, user_message: str, sem: asyncio.Semaphore, calls: Dict[str, int]) -> List[Dict[str, Any]]:
+        # Gestione liste di query (es. luoghi specifici): cerca direttamente ciascun luogo
+        if isinstance(query, list):
+            q_strings = [q for q in query if isinstance(q, str) and q.strip()]
+            venues: List[Dict[str, Any]] = []
+
+            for found in await self._lookup_venues(q_strings, sem, calls):
+                if not found:
+                    continue
+                place, details = found
+                place_id = place.get("place_id")
+
+                venues.append({
+                    "name": place.get("name"),
+                    "formatted_address": place.get("formatted_address"),
+                    "geometry": details.get("geometry") or place.get("geometry"),
+                    "rating": details.get("rating"),
+                    "user_ratings_total": details.get("user_ratings_total"),
+                    "place_id": place_id,
+                    "photo_url": details.get("photo_url"),
+                    "website": details.get("website"),
+                    "maps_url": f"https://www.google.com/maps/place/?q=place_id:{place_id}"
+                })
+
+            return venues
+
+        # Gestione query string (generazione + validazione con Places)
+        city = self._extract_city(query) or self._extract_city(user_message)
+        query_str = query if isinstance(query, str) else ""
+
+        prompt = self._build_prompt(query_str, city)
+
+        gen_config = types.GenerateContentConfig(
+            tools=[self.google_maps_tool]
+        )
+
+        response = await gemini_client.generate_content(
+            model=self.model,
+            contents=prompt,
+            config=gen_config
+        )
+
+        parsed = self._parse_json(response.text)
+        items = parsed.get("results", [])
+        search_queries = [
+            f"{item.get('name')}, {item.get('formatted_address')}, {city or ''}"
+            for item in items
+        ]
+        venues: List[Dict[str, Any]] = []
+
+        for item, found in zip(items, await self._lookup_venues(search_queries, sem, calls)):
+            if not found:
+                continue
+            place, details = found
+            place_id = place.get("place_id")
+
+            venues.append({
+                "name": item.get("name"),
+                "formatted_address": place.get("formatted_address"),
+                # Usa i valori reali dai dettagli
+                "rating": details.get("rating"),
+                "user_ratings_total": details.get("user_ratings_total"),
+                "place_id": place_id,
+                # Includi le coordinate corrette
+                "geometry": details.get("geometry") or place.get("geometry"),
+                "photo_url": details.get("photo_url"),
+                "website": details.get("website"),
+                # Allinea lo schema del link alla versione con ':'
+                "maps_url": f"https://www.google.com/maps/place/?q=place_id:{place_id}"
+            })
+
+        return venues
+
+    async def iter_search_places(self, categories: Dict[str, Any], user_message: str, meta: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Cerca i luoghi di tutte le categorie in parallelo, restituendo ogni
+        categoria (category, {"results": [...]}) appena è pronta.
+
+        Categorie e catene find-place/details dei singoli luoghi vengono eseguite
+        insieme, con al massimo `MAPS_MAX_CONCURRENCY` chiamate Places in volo.
+        Un errore in una categoria produce una lista vuota senza influire sulle altre.
+        Al termine, se passato, `meta` viene riempito con i contatori delle chiamate.
+        """
         categories_count = len(categories) if isinstance(categories, dict) else 0
-        findplace_calls = 0
-        details_calls = 0
+        calls = {"findplace": 0, "details": 0}
         per_category_results: Dict[str, int] = {}
+        sem = asyncio.Semaphore(settings.maps_max_concurrency)
 
-        for category, query in categories.items():
+        async def run(category: str, query: Any):
             try:
-                # Gestione liste di query (es. luoghi specifici): cerca direttamente ciascun luogo
-                if isinstance(query, list):
-                    q_strings = [q for q in query if isinstance(q, str) and q.strip()]
-                    city = self._extract_city(q_strings) or self._extract_city(user_message)
-                    venues: List[Dict[str, Any]] = []
-
-                    for q in q_strings:
-                        findplace_calls += 1
-                        place = await self._places_find(q)
-                        if not place:
-                            continue
-
-                        place_id = place.get("place_id")
-                        details_calls += 1
-                        details = await self._place_details(place_id)
-
-                        venues.append({
-                            "name": place.get("name"),
-                            "formatted_address": place.get("formatted_address"),
-                            "geometry": details.get("geometry") or place.get("geometry"),
-                            "rating": details.get("rating"),
-                            "user_ratings_total": details.get("user_ratings_total"),
-                            "place_id": place_id,
-                            "photo_url": details.get("photo_url"),
-                            "website": details.get("website"),
-                            "maps_url": f"https://www.google.com/maps/place/?q=place_id:{place_id}"
-                        })
-
-                    results[category] = {"results": venues}
-                    per_category_results[category] = len(venues)
-                    continue
-
-                # Gestione query string (generazione + validazione con Places)
-                city = self._extract_city(query) or self._extract_city(user_message)
-                query_str = query if isinstance(query, str) else ""
-
-                prompt = self._build_prompt(query_str, city)
-
-                gen_config = types.GenerateContentConfig(
-                    tools=[self.google_maps_tool]
-                )
-
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=prompt,
-                    config=gen_config
-                )
-
-                parsed = self._parse_json(response.text)
-                venues: List[Dict[str, Any]] = []
-
-                for item in parsed.get("results", []):
-                    search_query = f"{item.get('name')}, {item.get('formatted_address')}, {city or ''}"
-
-                    findplace_calls += 1
-                    place = await self._places_find(search_query)
-                    if not place:
-                        continue
-
-                    place_id = place.get("place_id")
-                    details_calls += 1
-                    details = await self._place_details(place_id)
-
-                    venues.append({
-                        "name": item.get("name"),
-                        "formatted_address": place.get("formatted_address"),
-                        # Usa i valori reali dai dettagli
-                        "rating": details.get("rating"),
-                        "user_ratings_total": details.get("user_ratings_total"),
-                        "place_id": place_id,
-                        # Includi le coordinate corrette
-                        "geometry": details.get("geometry") or place.get("geometry"),
-                        "photo_url": details.get("photo_url"),
-                        "website": details.get("website"),
-                        # Allinea lo schema del link alla versione con ':'
-                        "maps_url": f"https://www.google.com/maps/place/?q=place_id:{place_id}"
-                    })
-
-                results[category] = {"results": venues}
-                per_category_results[category] = len(venues)
+                return category, await self._search_category(category, query, user_message, sem, calls)
             except Exception as e:
                 logger.warning(f"Categoria '{category}' fallita: {e}")
-                results[category] = {"results": []}
-                per_category_results[category] = 0
+                return category, []
 
+        tasks = [asyncio.create_task(run(category, query)) for category, query in categories.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                category, venues = await next_done
+                per_category_results[category] = len(venues)
+                yield category, {"results": venues}
+        finally:
+            # Se il chiamante interrompe l'iterazione, non lasciare ricerche orfane
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        findplace_calls = calls["findplace"]
+        details_calls = calls["details"]
         total_calls = findplace_calls + details_calls
         logger.info(
             f"[GeminiMaps] Places API calls: categories={categories_count}, "
             f"results_per_category={per_category_results}, "
             f"findplace={findplace_calls}, details={details_calls}, total={total_calls}"
         )
+        cache_stats = places_cache.stats()
+        logger.info(
+            f"[GeminiMaps] Places cache: hits={cache_stats['hits']}, misses={cache_stats['misses']}, "
+            f"negative_hits={cache_stats['negative_hits']}, entries={cache_stats['entries']}"
+        )
 
-        results["_meta"] = {
-            "categories": categories_count,
-            "per_category_results": per_category_results,
-            "findplace_calls": findplace_calls,
-            "details_calls": details_calls,
-            "total_calls": total_calls,
-        }
+        if meta is not None:
+            meta.update({
+                "categories": categories_count,
+                "per_category_results": per_category_results,
+                "findplace_calls": findplace_calls,
+                "details_calls": details_calls,
+                "total_calls": total_calls,
+                "cache": cache_stats,
+            })
 
+    async def search_places(self, categories: Dict[str, Any], user_message: str) -> Dict[str, Any]:
+        """Cerca i luoghi di tutte le categorie in parallelo e restituisce i risultati
+        nell'ordine delle categorie richieste, con i contatori in `_meta`."""
+        collected: Dict[str, Dict[str, Any]] = {}
+        meta: Dict[str, Any] = {}
+        async for category, data in self.iter_search_places(categories, user_message, meta):
+            collected[category] = data
+
+        results = {category: collected[category] for category in categories if category in collected}
+        results["_meta"] = meta
         return results
\ No newline at end of file
@@ -2,8 +2,7 @@ import asyncio
 import json
 import logging
 import time
-from typing import Dict, List, Any, Optional
-from google import genai
+from typing import AsyncIterator, Dict, List, Any, Optional
 from google.genai import types
 from ..config.settings import settings
 from .gemini_maps import GeminiMapsService
@@ -13,6 +12,12 @@ import os
 from .ChatterService import Chatter
 from .program_service import ProgramService
 from .ContextDetection import ContextDetector
+from . import gemini_client
+from .session_store import ConversationState
+from .result_cache import result_cache
+from .image_prefetch import image_prefetcher
+from .json_storage import json_storage
+from .context_compactor import context_compactor
 
 
 logger = logging.getLogger(__name__)
@@ -20,12 +25,15 @@ GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL")
 
 class GeminiService:
     """Servizio per gestire l'integrazione con Gemini AI con architettura a tre agenti"""
+
+    # Testi restituiti al posto del contenuto quando la generazione non riesce
+    CONTENT_EMPTY_MESSAGE = "Spiacente, non sono riuscito a generare una risposta."
+    CONTENT_ERROR_PREFIX = "Errore tecnico nella generazione del contenuto"
     
     def __init__(self, gemini_maps: GeminiMapsService, analyzer_service: AnalyzerService):
-        # Client per il contenuto (con grounding per piatti/dolci/vini)
-        self.content_client = genai.Client(api_key=settings.gemini_api_key)
-        # Client per i tool (search_google_maps)
-        self.tool_client = genai.Client(api_key=settings.gemini_api_key)
+        # Client condiviso per contenuto (grounding) e tool: le chiamate passano da gemini_client
+        self.content_client = gemini_client.get_client()
+        self.tool_client = self.content_client
         
         self.gemini_maps = gemini_maps
         self.analyzer_service = analyzer_service
@@ -36,10 +44,6 @@ class GeminiService:
         self.content_config = self._setup_content_generation_config()
         self.tool_config = self._setup_tool_generation_config()
         self.contextDetector = ContextDetector()
-        self.chatMode = False
-        self.location = None
-        self.chatBot = None
-        self.programMode = False
 
         # Configurazione soglie per il monitoraggio grounding
         self.grounding_thresholds = {
@@ -569,8 +573,15 @@ Ricevi una stringa di ricerca e devi chiamare la funzione search_google_maps con
 Non fare altro, esegui semplicemente la ricerca richiesta.
 """
     
-    async def chat_stream(self, user_message: str, history: Optional[List] = None, skip_echo: bool = False):
-        """Gestisce una conversazione in modalità streaming, inviando aggiornamenti in tempo reale."""
+    async def chat_stream(self, user_message: str, history: Optional[List] = None, skip_echo: bool = False, session: Optional[ConversationState] = None, results_format: str = "html"):
+        """Gestisce una conversazione in modalità streaming, inviando aggiornamenti in tempo reale.
+
+        Lo stato della conversazione (modalità, località, chatbot, HTML) vive in `session`;
+        se non viene passato si usa uno stato nuovo, valido solo per questa richiesta.
+        Con `results_format="json"` i risultati classificati arrivano come record compatti
+        (vedi FilteringRankingService._to_record) e le card vengono rese dal client.
+        """
+        state = session if session is not None else ConversationState("ephemeral")
         logger.info(f"Inizio chat (streaming) con messaggio: '{user_message}' skip_echo={skip_echo}")
         if history and isinstance(history, list):
                 # Filtra solo i messaggi dell'utente
@@ -588,19 +599,19 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 logger.info("History vuota o non valida.")
       
         # Forza chat mode in pagina Programma di viaggio
-        if getattr(self, "programMode", True):
-            self.chatMode = True
+        if state.programMode:
+            state.chatMode = True
         
         # Prima ricerca: esegui la ricerca completa
-        if(self.chatMode == False):
+        if(state.chatMode == False):
             start_time = time.time()
             
             # Variabile per raccogliere tutto il codice HTML generato
             complete_html_content = ""
-            self.chatMode = True
+            state.chatMode = True
             
             # Salva l'istanza corrente del servizio per accedere alla variabile dall'esterno
-            self.last_complete_html = ""
+            state.last_complete_html = ""
             
             # Attiva subito la modalità chatbot e mostra il messaggio
             yield {"chatbot_mode_activated": True}
@@ -637,76 +648,107 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
 
 
 
+            # Risultato già calcolato per una richiesta equivalente: riproduce lo stream
+            cache_key = None
+            if self._use_live_maps():
+                mode = "program" if state.programMode else "search"
+                cache_key = result_cache.key_for(user_message, mode if results_format == "html" else f"{mode}:{results_format}")
+                cached = result_cache.get(cache_key)
+                if cached:
+                    logger.info(f"Risultato in cache per '{user_message}' (chiave '{cache_key}')")
+                    for event in self._replay_cached_result(cached, state, results_format):
+                        yield event
+                    return
+
+            location_task = None
+            preferences_task = None
             try:
+                # Avvio in parallelo alla generazione del contenuto: località e preferenze
+                # dipendono solo dalla query dell'utente
+                location_task = asyncio.create_task(self._detect_location(user_message))
+                if self._use_live_maps():
+                    preferences_task = self.filtering_ranking_service.start_preferences_check(user_message)
+
                 # Step 1: Generazione Contenuto in Streaming
                 yield {"status": "Sto cercando informazioni aggiornate..."}
-                full_content_response = ""
-                msg_for_content = user_message
-                
-                #
-
-
-                full_content_response = await self._generate_culinary_content_stream(msg_for_content, history)
+                content_parts: List[str] = []
+                location_sent = False
+                # Testo non ancora passato al prefetch immagini: si invia fino all'ultima
+                # virgoletta, così un URL non viene mai spezzato tra due pezzi
+                prefetch_tail = ""
+                async for piece in self._stream_culinary_content(user_message, history, session=state):
+                    content_parts.append(piece)
+                    yield {"content_chunk": piece}
+                    prefetch_tail += piece
+                    cut = prefetch_tail.rfind('"') + 1
+                    if cut:
+                        image_prefetcher.submit(prefetch_tail[:cut])
+                        prefetch_tail = prefetch_tail[cut:]
+                    if not location_sent and location_task.done():
+                        location_sent = True
+                        loc = location_task.result()
+                        if loc:
+                            state.location = loc
+                            yield {"detected_location": state.location}
+                full_content_response = "".join(content_parts)
+                image_prefetcher.submit(prefetch_tail)
                 
                 # Salva l'HTML del contenuto principale
                 complete_html_content = full_content_response
-                self.last_complete_html = complete_html_content
-                
-       
-                
-                # Rimuovo l'invio del messaggio al chatbot per evitare duplicazioni
-                # chatbot_payload = self.chatTalk("Prova")
-                # logger.info(f"Payload chatbot generato: {chatbot_payload}")
-                # yield chatbot_payload
+                state.last_complete_html = complete_html_content
                 
                 yield {"content_payload": {"answer": full_content_response}}
 
+                if not location_sent:
+                    loc = await location_task
+                    if loc:
+                        state.location = loc
+                        yield {"detected_location": state.location}
+
                 # Step 2: Analisi per ricerca su Mappe
                 yield {"status": "Sto preparando i suggerimenti sulla mappa..."}
                 if settings.debug_mode:
                     logger.info("Modalità debug attiva: caricamento delle query di ricerca da file.")
-                    try:
-                        with open("generated_content_test_files/search_queries_cache.json", "r") as f:
-                            cached = json.load(f)
+                    cached = await json_storage.read("generated_content_test_files/search_queries_cache.json")
+                    if cached is not None:
                         if isinstance(cached, dict) and "queries" in cached:
                             loc = cached.get("localita")
                             if loc:
-                                self.location = loc
-                                yield {"detected_location": self.location}
+                                state.location = loc
+                                yield {"detected_location": state.location}
                             search_queries = cached.get("queries", {})
                         else:
                             search_queries = cached
-                    except (FileNotFoundError, json.JSONDecodeError):
+                    else:
                         logger.warning("File di cache delle query non trovato o corrotto. Analisi in corso.")
-                        res = await self.analyzer_service.analyze_content_for_maps_search(full_content_response, user_message, current_location=self.location)
+                        res = await self.analyzer_service.analyze_content_for_maps_search(full_content_response, user_message, current_location=state.location)
                         if isinstance(res, dict) and "queries" in res:
                             loc = res.get("localita")
                             if loc:
-                                self.location = loc
-                                yield {"detected_location": self.location}
+                                state.location = loc
+                                yield {"detected_location": state.location}
                             search_queries = res.get("queries", {})
                         else:
                             search_queries = res
                 else:
                     # Produzione: se l'analisi fallisce (es. 429), usa fallback deterministici
                     try:
-                        res = await self.analyzer_service.analyze_content_for_maps_search(full_content_response, user_message, current_location=self.location)
+                        res = await self.analyzer_service.analyze_content_for_maps_search(full_content_response, user_message, current_location=state.location)
                         if isinstance(res, dict) and "queries" in res:
                             loc = res.get("localita")
                             if loc:
-                                self.location = loc
-                                yield {"detected_location": self.location}
+                                state.location = loc
+                                yield {"detected_location": state.location}
                             search_queries = res.get("queries", {})
                             try:
-                                with open("generated_content_test_files/search_queries_cache.json", "w") as f:
-                                    json.dump(res, f, indent=4)
+                                await json_storage.write("generated_content_test_files/search_queries_cache.json", res)
                             except Exception as _e:
                                 logger.warning(f"Scrittura cache query fallita: {_e}")
                         else:
                             search_queries = res
                     except Exception as e:
                         logger.warning(f"Analisi query fallita: {e}. Applico fallback locale per proseguire col ranking.")
-                        location_hint = (self.location or user_message or "località").strip()
+                        location_hint = (state.location or user_message or "località").strip()
                         search_queries = {
                             "strutture ricettive": f"hotel a {location_hint}",
                             "vini": f"enoteche e cantine a {location_hint}",
@@ -719,7 +761,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 # Se dopo il filtro non resta nulla, crea un fallback deterministico
                 if not search_queries:
                     logger.warning("Nessuna categoria valida dopo filtro; uso fallback di base per proseguire.")
-                    location_hint = (self.location or user_message or "località").strip()
+                    location_hint = (state.location or user_message or "località").strip()
                     search_queries = {
                         "strutture ricettive": f"hotel a {location_hint}",
                         "vini": f"enoteche e cantine a {location_hint}",
@@ -728,54 +770,41 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                     }
                 
                 # Step 3: Ricerca su Mappe (se necessaria)
+                ranked_results: Dict[str, Any] = {}
                 if search_queries:
                     yield {"status": "Sto cercando i luoghi migliori su Google Maps..."}
-                    if settings.debug_mode:
-                        logger.info("Modalità debug attiva: caricamento dei dati di Google Maps da file (assets/generata).")
-                        candidate_paths = [
-                            os.path.join("assets", "cities_cache", "maps_data_cache.json"),
-                            os.path.join("generated_content_test_files", "maps_data_cache.json"),
-                        ]
-                        maps_data = None
-                        for p in candidate_paths:
-                            try:
-                                if os.path.exists(p):
-                                    with open(p, "r", encoding="utf-8") as f:
-                                        maps_data = json.load(f)
-                                    logger.info(f"Caricati dati Maps da: {p}")
-                                    break
-                            except Exception as e:
-                                logger.warning(f"Errore nel caricamento file Maps '{p}': {e}")
-
-                        if not maps_data:
-                            logger.warning("Cache Maps non trovata/valida. Uso struttura vuota per consentire suggerimenti locali.")
-                            maps_data = {cat: {"results": [], "iframe_url": None} for cat in search_queries.keys()}
+                    augmented_user_message = (f"{user_message} a {state.location}" if isinstance(user_message, str) and state.location else user_message)
+                    if self._use_live_maps():
+                        # Ogni categoria viene classificata e inviata appena la sua ricerca termina
+                        sequence = 0
+                        async for category, entry, is_final in self._stream_ranked_categories(search_queries, user_message, augmented_user_message, preferences_task, results_format):
+                            ranked_results[category] = entry
+                            image_prefetcher.submit(json.dumps(entry, ensure_ascii=False, default=str))
+                            yield {"map_payload": {
+                                "tool_name": "search_google_maps",
+                                "tool_data": {category: entry},
+                                "format": results_format,
+                                "partial": True,
+                                "sequence": sequence,
+                                "final": is_final,
+                            }}
+                            sequence += 1
+                        # Ordine canonico: selezione in testa, poi le categorie come richieste
+                        ranked_results = {
+                            key: ranked_results[key]
+                            for key in ["la_nostra_selezione", *search_queries.keys()]
+                            if key in ranked_results
+                        }
                     else:
-                        # Produzione: se la ricerca Maps fallisce (es. API error), crea struttura vuota
-                        try:
-                            logger.info(f"Chiamo gemini_maps.search_places con categorie: {list(search_queries.keys())}")
-                            print(f"[GeminiService] CALL gemini_maps.search_places -> categories={list(search_queries.keys())}")
-                            maps_data = await self.gemini_maps.search_places(search_queries, user_message)
-                            logger.info("gemini_maps.search_places completata senza eccezioni")
-                            print("[GeminiService] gemini_maps.search_places DONE")
-                            with open("generated_content_test_files/maps_data_cache.json", "w") as f:
-                                json.dump(maps_data, f, indent=4)
-                        except Exception as e:
-                            logger.warning(f"Ricerca Maps fallita: {e}. Uso struttura vuota per consentire suggerimenti locali.")
-                            print(f"[GeminiService] gemini_maps.search_places FAILED: {e}")
-                            maps_data = {cat: {"results": [], "iframe_url": None} for cat in search_queries.keys()}
-
-                    if maps_data:
-                        yield {"status": "Applico filtri e ranking ai risultati..."}
-                        
-                        augmented_user_message = (f"{user_message} a {self.location}" if isinstance(user_message, str) and self.location else user_message)
-                        ranked_results = await self.filtering_ranking_service.filter_rank_and_present(search_queries, maps_data, augmented_user_message)
-                        # Ulteriore protezione: rimuove sezioni non desiderate dall'output
-                        ranked_results = self._filter_out_unwanted_categories(ranked_results)
-                        yield {"map_payload": {"tool_name": "search_google_maps", "tool_data": ranked_results}}
-
-    
-                        
+                        maps_data = self._load_maps_data_fallback(search_queries)
+                        if maps_data:
+                            yield {"status": "Applico filtri e ranking ai risultati..."}
+                            ranked_results = await self.filtering_ranking_service.filter_rank_and_present(search_queries, maps_data, augmented_user_message, preferences_task=preferences_task, results_format=results_format)
+                            # Ulteriore protezione: rimuove sezioni non desiderate dall'output
+                            ranked_results = self._filter_out_unwanted_categories(ranked_results)
+                            yield {"map_payload": {"tool_name": "search_google_maps", "tool_data": ranked_results, "format": results_format}}
+
+                    if ranked_results:
                         # Combina il contenuto culinario con i risultati delle attività per il chatbot
                         activities_html = ""
                         allowed_after_selection = {"hotel", "vini", "cucina tipica", "strutture ricettive", "cucina_tipica", "dolci tipici"}
@@ -783,11 +812,12 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                             if "results" in data and data["results"]:
                                 cat_norm = category.lower()
                                 if cat_norm == "la_nostra_selezione" or cat_norm in allowed_after_selection:
-                                    activities_html += f"\n\n<div class='category-section'>\n<h2 class='category-title'>{category.replace('_', ' ').title()}</h2>\n{data['results']}\n</div>"
+                                    results = data['results'] if isinstance(data['results'], str) else json.dumps(data['results'], ensure_ascii=False, separators=(",", ":"))
+                                    activities_html += f"\n\n<div class='category-section'>\n<h2 class='category-title'>{category.replace('_', ' ').title()}</h2>\n{results}\n</div>"
                         
                         # Aggiorna il complete_html_content per includere anche le attività
                         complete_html_content = complete_html_content + activities_html
-                        self.last_complete_html = complete_html_content
+                        state.last_complete_html = complete_html_content
 
                 end_time = time.time()
                 logger.info(f"Tempo di risposta totale del modello: {end_time - start_time:.2f} secondi")
@@ -795,33 +825,48 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 # Log dell'HTML completo generato (opzionale)
                 logger.info(f"HTML completo generato: {len(complete_html_content)} caratteri")
                 
-                # Restituisci l'HTML completo come ultimo yield
-                yield {"complete_html": complete_html_content}
-                self.chatBot = ProgramService(complete_html_content) if getattr(self, "programMode", False) else Chatter(complete_html_content)
+                # Una generazione interrotta a metà ha già inviato dei chunk: non va in cache
+                if cache_key and not state.content_failed and self._is_cacheable_result(full_content_response, ranked_results):
+                    result_cache.set(cache_key, {
+                        "location": state.location,
+                        "content": full_content_response,
+                        "search_queries": search_queries,
+                        "ranked_results": ranked_results,
+                        "complete_html": complete_html_content,
+                    })
+
+                # Restituisci l'HTML completo come ultimo yield; in formato JSON il client ha
+                # già i record e riceve solo il contenuto, senza ripetere i risultati
+                yield {"complete_html": complete_html_content if results_format == "html" else full_content_response}
+                state.chatBot = self._new_chatbot(state)
 
                 # Attiva la modalità chatbot per le ricerche successive
-                self.chatMode = True
+                state.chatMode = True
 
             except Exception as e:
                 logger.error(f"Errore durante lo streaming della chat: {e}", exc_info=True)
                 yield {"error": "Si è verificato un errore durante l'elaborazione della richiesta."}
+            finally:
+                for task in (location_task, preferences_task):
+                    if task is not None and not task.done():
+                        task.cancel()
 
 
         else:
             # Modalità chatbot attiva dalla seconda ricerca in poi
             try:
                 # Inizializzazione di sicurezza del chatbot nel caso non sia stato creato
-                if self.chatBot is None:
+                if state.chatBot is None:
                     logger.info("ChatBot non inizializzato: creo istanza chatbot in base alla modalità")
-                    self.chatBot = ProgramService(self.get_last_complete_html()) if getattr(self, "programMode", False) else Chatter(self.get_last_complete_html())
-                locationBuff = self.contextDetector.checkLocation(user_message)
+                    state.chatBot = self._new_chatbot(state)
+                locationBuff = await self.contextDetector.checkLocation(user_message)
                 try:
                     loc = (locationBuff or "").strip()
                     if loc and loc.lower() != "false":
-                        self.location = loc
-                        logger.info(f"📍 Località impostata per chat mode: {self.location}")
+                        state.location = loc
+                        logger.info(f"📍 Località impostata per chat mode: {state.location}")
                         # Invia al frontend la località rilevata
-                        yield {"detected_location": self.location}
+                        yield {"detected_location": state.location}
                 except Exception as _e:
                     logger.warning(f"Impostazione località fallita: {_e}")
 
@@ -840,7 +885,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 yield user_payload
                 
                 # Usa il ChatterService per generare la risposta appropriata
-                bot_response = self.chatBot.getResponse(user_message)
+                bot_response = await state.chatBot.getResponse(user_message)
                 logger.info(f"Risposta del chatbot: {bot_response}")
                 # Aggiungi la risposta del bot al chatbot
                 bot_payload = {
@@ -864,6 +909,28 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 }
                 yield error_payload
             
+    def _is_cacheable_result(self, content: str, ranked_results: Dict[str, Any]) -> bool:
+        """Memorizza solo ricerche con contenuto e almeno una categoria con risultati
+        (gli errori di generazione sono esclusi a monte tramite ``state.content_failed``)."""
+        if not content:
+            return False
+        return any(isinstance(v, dict) and v.get("results") for v in (ranked_results or {}).values())
+
+    def _replay_cached_result(self, cached: Dict[str, Any], state: ConversationState, results_format: str = "html"):
+        """Eventi di una prima ricerca ricostruiti da un risultato in cache, nello stesso ordine del flusso live."""
+        if cached.get("location"):
+            state.location = cached["location"]
+            yield {"detected_location": state.location}
+        image_prefetcher.submit(cached.get("complete_html") or cached["content"])
+        yield {"content_payload": {"answer": cached["content"]}}
+        if cached.get("ranked_results"):
+            yield {"map_payload": {"tool_name": "search_google_maps", "tool_data": cached["ranked_results"], "format": results_format}}
+        complete_html_content = cached.get("complete_html") or cached["content"]
+        state.last_complete_html = complete_html_content
+        yield {"complete_html": complete_html_content if results_format == "html" else cached["content"]}
+        state.chatBot = self._new_chatbot(state)
+        state.chatMode = True
+
     def _filter_out_unwanted_categories(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Filtra le categorie lato server lasciando SOLO quelle supportate in UI.
         Ammesse: 'cucina_tipica', 'vini', 'hotel' (sinonimo: 'strutture ricettive').
@@ -894,61 +961,161 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 filtered[k] = v
         return filtered
 
-    def get_last_complete_html(self) -> str:
-        """Restituisce l'ultimo HTML completo generato"""
-        return getattr(self, 'last_complete_html', "")
+    def _new_chatbot(self, state: ConversationState):
+        """Chatbot della sessione (ProgramService in pagina programma, altrimenti Chatter) con il
+        riassunto compatto della pagina corrente come contesto, invece dell'HTML completo."""
+        context = context_compactor.for_session(state)
+        return ProgramService(context) if state.programMode else Chatter(context)
+
+    def get_last_complete_html(self, session: Optional[ConversationState] = None) -> str:
+        """Restituisce l'ultimo HTML completo generato per la sessione"""
+        return getattr(session, 'last_complete_html', "") or ""
     
-    async def _generate_culinary_content_stream(self, user_message: str, history: Optional[List] = None) -> str:
+    async def _detect_location(self, user_message: str) -> Optional[str]:
+        """Località citata nella richiesta (None se assente o in caso di errore)."""
+        try:
+            loc = (await self.contextDetector.checkLocation(user_message) or "").strip()
+        except Exception as e:
+            logger.warning(f"Rilevamento località fallito: {e}")
+            return None
+        if not loc or loc.lower() == "false":
+            return None
+        return loc
+
+    def _use_live_maps(self) -> bool:
+        """True se la ricerca Maps va fatta dal vivo (fuori debug e con chiave valida)."""
+        return not settings.debug_mode and self.filtering_ranking_service._is_maps_key_active()
+
+    def _load_maps_data_fallback(self, search_queries: Dict[str, Any]) -> Dict[str, Any]:
+        """Dati Maps senza chiamate live: file di cache in debug, struttura vuota altrimenti
+        (il servizio di ranking ricarica poi i JSON delle città salvate)."""
+        if settings.debug_mode:
+            logger.info("Modalità debug attiva: caricamento dei dati di Google Maps da file (assets/generata).")
+            candidate_paths = [
+                os.path.join("assets", "cities_cache", "maps_data_cache.json"),
+                os.path.join("generated_content_test_files", "maps_data_cache.json"),
+            ]
+            for p in candidate_paths:
+                maps_data = json_storage.read_sync(p)
+                if maps_data:
+                    logger.info(f"Caricati dati Maps da: {p}")
+                    return maps_data
+        logger.warning("Cache Maps non trovata/valida. Uso struttura vuota per consentire suggerimenti locali.")
+        return {cat: {"results": [], "iframe_url": None} for cat in search_queries.keys()}
+
+    async def _stream_ranked_categories(self, search_queries: Dict[str, Any], user_message: str, preferences_query: str, preferences_task: Optional["asyncio.Task"] = None, results_format: str = "html"):
+        """Ricerca Maps live con ranking progressivo.
+
+        Restituisce (categoria, voce, finale) per ogni categoria appena la sua
+        ricerca termina; "la_nostra_selezione" arriva per ultima con finale=True.
+        """
+        maps_data: Dict[str, Any] = {}
+        all_activities: Dict[str, List[Dict[str, Any]]] = {}
+        meta: Dict[str, Any] = {}
+        preferences = None
+        try:
+            logger.info(f"Chiamo gemini_maps.iter_search_places con categorie: {list(search_queries.keys())}")
+            async for category, data in self.gemini_maps.iter_search_places(search_queries, user_message, meta):
+                maps_data[category] = data
+                if preferences is None:
+                    preferences = await self.filtering_ranking_service.resolve_preferences(preferences_query, preferences_task)
+                    logger.info(f"Preferenze dell'utente: {preferences}")
+                entry, ranked_selection = self.filtering_ranking_service.rank_category(category, search_queries.get(category), data, preferences, results_format)
+                if ranked_selection:
+                    all_activities[category] = ranked_selection
+                visible = self._filter_out_unwanted_categories({category: entry}) if entry is not None else {}
+                if category in visible:
+                    yield category, entry, False
+        except Exception as e:
+            logger.warning(f"Ricerca Maps fallita: {e}. Uso struttura vuota per le categorie mancanti.")
+            for category in search_queries.keys():
+                if category not in maps_data:
+                    maps_data[category] = {"results": [], "iframe_url": None}
+                    if self._filter_out_unwanted_categories({category: None}):
+                        yield category, maps_data[category], False
+
+        # Ordine delle categorie come richieste, contatori in coda (come search_places)
+        ordered = {category: maps_data[category] for category in search_queries if category in maps_data}
+        ordered["_meta"] = meta
+        try:
+            await json_storage.write("generated_content_test_files/maps_data_cache.json", ordered)
+        except Exception as e:
+            logger.warning(f"Scrittura cache Maps fallita: {e}")
+
+        selection_entry = self.filtering_ranking_service.build_selection_entry(all_activities, results_format)
+        if selection_entry:
+            yield "la_nostra_selezione", selection_entry, True
+
+    async def _stream_culinary_content(self, user_message: str, history: Optional[List] = None, session: Optional[ConversationState] = None) -> AsyncIterator[str]:
+        """Genera il contenuto culinario restituendo il testo man mano che il modello lo produce.
+        Se la generazione fallisce, ``session.content_failed`` resta True fino alla prossima chiamata."""
+        if session is not None:
+            session.content_failed = False
         if settings.debug_mode:
             logger.info("Modalità debug attiva: caricamento del contenuto da file.")
-            try:
-                with open("generated_content_test_files/culinary_content_cache.json", "r") as f:
-                    return json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                logger.warning("File di cache non trovato o corrotto. Generazione del contenuto in corso.")
-                # Prosegui con la generazione normale se il file non esiste
-                pass
-
-        """Genera contenuto culinario completo senza streaming."""
+            cached = await json_storage.read("generated_content_test_files/culinary_content_cache.json")
+            if cached is not None:
+                yield cached
+                return
+            logger.warning("File di cache non trovato o corrotto. Generazione del contenuto in corso.")
+            # Prosegui con la generazione normale se il file non esiste
+
         try:
-            logger.info(f"Generazione contenuto culinario (senza streaming) per: '{user_message}'")
+            logger.info(f"Generazione contenuto culinario (streaming) per: '{user_message}'")
 
             content_config = self.content_config
             try:
-                if self.chatMode and self.location:
+                if session is not None and session.chatMode and session.location:
                     grounding_tool = types.Tool(google_search=types.GoogleSearch())
                     content_config = types.GenerateContentConfig(
-                        system_instruction=self._get_content_system_prompt() + f"\nCITTÀ CORRENTE: {self.location}\n",
+                        system_instruction=self._get_content_system_prompt() + f"\nCITTÀ CORRENTE: {session.location}\n",
                         temperature=0,
                         tools=[grounding_tool]
                     )
             except Exception:
                 content_config = self.content_config
-            content_chat = self.content_client.chats.create(
+            content_chat = gemini_client.create_chat(
                 model=GEMINI_MODEL,
                 config=content_config,
                 history=history or []
             )
 
-            # NOTA: nessun stream=True => ritorna una risposta completa
-            response = content_chat.send_message(message=user_message)
+            parts: List[str] = []
+            last_chunk = None
+            async for chunk in gemini_client.send_message_stream(content_chat, user_message):
+                last_chunk = chunk
+                text = getattr(chunk, "text", None)
+                if text:
+                    parts.append(text)
+                    yield text
 
-            # Log dei metadati di grounding
-            self._log_grounding_metadata(response)
+            # I metadati di grounding arrivano con l'ultimo chunk
+            if last_chunk is not None and getattr(last_chunk, "candidates", None):
+                self._log_grounding_metadata(last_chunk)
 
-            if response.candidates and response.candidates[0].content.parts:
-                content = response.candidates[0].content.parts[0].text
+            if parts:
                 if not settings.debug_mode:
-                    with open("generated_content_test_files/culinary_content_cache.json", "w") as f:
-                        json.dump(content, f, indent=4)
-                return content
+                    try:
+                        await json_storage.write("generated_content_test_files/culinary_content_cache.json", "".join(parts))
+                    except Exception as e:
+                        logger.warning(f"Scrittura cache contenuto fallita: {e}")
+                return
 
             logger.warning("Nessuna risposta valida dal modello.")
-            return "Spiacente, non sono riuscito a generare una risposta."
+            if session is not None:
+                session.content_failed = True
+            yield self.CONTENT_EMPTY_MESSAGE
 
         except Exception as e:
             logger.error(f"Errore nella generazione del contenuto: {e}")
-            return f"Errore tecnico nella generazione del contenuto: {str(e)}"
+            if session is not None:
+                session.content_failed = True
+            yield f"{self.CONTENT_ERROR_PREFIX}: {str(e)}"
+
+    async def _generate_culinary_content_stream(self, user_message: str, history: Optional[List] = None, session: Optional[ConversationState] = None) -> str:
+        """Genera il contenuto culinario completo (concatena i chunk dello streaming)."""
+        parts = [piece async for piece in self._stream_culinary_content(user_message, history, session=session)]
+        return "".join(parts)
 
     
     def _is_grounded(self, response) -> bool:
@@ -1141,7 +1308,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
         try:
             logger.info(f"Generazione contenuto culinario per: '{user_message}'")
             
-            content_chat = self.content_client.chats.create(
+            content_chat = gemini_client.create_chat(
                 model=GEMINI_MODEL,
                 config=self.content_config,
                 history=history or []
@@ -1149,7 +1316,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
             
             content_start_time = time.time()
             # Chiama il metodo non-streaming
-            response = content_chat.send_message(message=user_message)
+            response = await gemini_client.send_message(content_chat, user_message)
             
             content_end_time = time.time()
             content_response_time = content_end_time - content_start_time
@@ -1190,11 +1357,12 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
             logger.error(f"Errore in chatTalk: {e}")
             return {"error": f"Errore nel chatbot: {str(e)}"}
     
-    def write_to_chatbox(self, user_message: str) -> list:
+    async def write_to_chatbox(self, user_message: str, session: ConversationState) -> list:
         """Metodo per scrivere nel box del chatbot.
         
         Args:
             user_message (str): Il messaggio dell'utente da aggiungere
+            session (ConversationState): Stato della conversazione corrente
             
         Returns:
             list: Lista di payload per aggiungere i messaggi al chatbot
@@ -1211,11 +1379,11 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 }
             }
             # Inizializzazione di sicurezza del chatbot
-            if self.chatBot is None:
+            if session.chatBot is None:
                 logger.info("ChatBot non inizializzato in write_to_chatbox: creo istanza in base alla modalità")
-                self.chatBot = ProgramService(self.get_last_complete_html()) if getattr(self, "programMode", False) else Chatter(self.get_last_complete_html())
+                session.chatBot = self._new_chatbot(session)
 
-            response = self.chatBot.getResponse(user_message)
+            response = await session.chatBot.getResponse(user_message)
             
             # Payload per la risposta del bot (sempre "ciao" a sinistra)
             bot_payload = {
@@ -12,6 +12,7 @@ from .filtering_ranking_service import FilteringRankingService
 import os
 from .ChatterService import Chatter
 from .ContextDetection import ContextDetector
+from . import gemini_client
 
 
 logger = logging.getLogger(__name__)
@@ -28,10 +29,9 @@ class GeminiService:
     """Servizio per gestire l'integrazione con Gemini AI con architettura a tre agenti"""
     
     def __init__(self, google_maps_service: GoogleMapsService, analyzer_service: AnalyzerService):
-        # Client per il contenuto (con grounding per piatti/dolci/vini)
-        self.content_client = genai.Client(api_key=settings.gemini_api_key)
-        # Client per i tool (search_google_maps)
-        self.tool_client = genai.Client(api_key=settings.gemini_api_key)
+        # Client condiviso per contenuto (grounding) e tool: le chiamate passano da gemini_client
+        self.content_client = gemini_client.get_client()
+        self.tool_client = self.content_client
         
         self.google_maps_service = google_maps_service
         self.analyzer_service = analyzer_service
@@ -513,7 +513,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
         else:
             # Modalità chatbot attiva dalla seconda ricerca in poi
             try:
-                locationBuff = self.contextDetector.checkLocation(user_message)
+                locationBuff = await self.contextDetector.checkLocation(user_message)
                 if(False):
                     #locationBuff.lower() != self.location.lower() and locationBuff.lower() != "false"
                     logger.info(f"🔄 NUOVA LOCALITÀ RILEVATA: {self.location} ----> {locationBuff}")
@@ -556,20 +556,20 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 
                 # Genera la risposta con Gemini in modalità chatbot; fallback a ChatterService
                 try:
-                    content_chat = self.content_client.chats.create(
+                    content_chat = gemini_client.create_chat(
                         model=GEMINI_MODEL,
                         config=self.content_config,
                         history=history or []
                     )
-                    response = content_chat.send_message(message=user_message)
+                    response = await gemini_client.send_message(content_chat, user_message)
                     if response.candidates and response.candidates[0].content.parts:
                         bot_response = response.candidates[0].content.parts[0].text
                     else:
                         logger.warning("Nessuna risposta valida dal modello in chat mode, uso fallback.")
-                        bot_response = self.chatBot.getResponse(user_message)
+                        bot_response = await self.chatBot.getResponse(user_message)
                 except Exception as e:
                     logger.error(f"Errore nella risposta Gemini in chat mode: {e}")
-                    bot_response = self.chatBot.getResponse(user_message)
+                    bot_response = await self.chatBot.getResponse(user_message)
 
                 # Aggiungi la risposta del bot al chatbot
                 yield {
@@ -629,14 +629,14 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
         try:
             logger.info(f"Generazione contenuto culinario (senza streaming) per: '{user_message}'")
 
-            content_chat = self.content_client.chats.create(
+            content_chat = gemini_client.create_chat(
                 model=GEMINI_MODEL,
                 config=self.content_config,
                 history=history or []
             )
 
             # NOTA: nessun stream=True => ritorna una risposta completa
-            response = content_chat.send_message(message=user_message)
+            response = await gemini_client.send_message(content_chat, user_message)
 
             # Log dei metadati di grounding
             self._log_grounding_metadata(response)
@@ -848,7 +848,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
         try:
             logger.info(f"Generazione contenuto culinario per: '{user_message}'")
             
-            content_chat = self.content_client.chats.create(
+            content_chat = gemini_client.create_chat(
                 model=GEMINI_MODEL,
                 config=self.content_config,
                 history=history or []
@@ -856,7 +856,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
             
             content_start_time = time.time()
             # Chiama il metodo non-streaming
-            response = content_chat.send_message(message=user_message)
+            response = await gemini_client.send_message(content_chat, user_message)
             
             content_end_time = time.time()
             content_response_time = content_end_time - content_start_time
@@ -897,7 +897,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
             logger.error(f"Errore in chatTalk: {e}")
             return {"error": f"Errore nel chatbot: {str(e)}"}
     
-    def write_to_chatbox(self, user_message: str) -> list:
+    async def write_to_chatbox(self, user_message: str) -> list:
         """Metodo per scrivere nel box del chatbot.
         
         Args:
@@ -918,7 +918,7 @@ Non fare altro, esegui semplicemente la ricerca richiesta.
                 }
             }
 
-            response = self.chatBot.getResponse(user_message)
+            response = await self.chatBot.getResponse(user_message)
             
             # Payload per la risposta del bot (sempre "ciao" a sinistra)
             bot_payload = {
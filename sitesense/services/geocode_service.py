@@ -0,0 +1,148 @@
+"""Risoluzione località -> coordinate per il filtro geografico.
+
+Ordine di risoluzione:
+1. gazetteer offline dei comuni italiani (``assets/gazetteer/comuni_italiani.json``);
+2. cache in memoria con TTL (anche per le località non trovate);
+3. API Geocoding di Google, con una sola richiesta in volo per località:
+   le ricerche contemporanee della stessa città attendono lo stesso risultato.
+
+In DEBUG_MODE senza chiave Maps si usa solo il gazetteer.
+"""
+
+import json
+import logging
+import re
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..config.settings import settings
+from . import http_client
+from .single_flight import SingleFlight
+from .ttl_cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+GAZETTEER_PATH = BASE_DIR / "assets" / "gazetteer" / "comuni_italiani.json"
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+
+# Le coordinate di una città non cambiano: TTL lungo; i fallimenti si ritentano prima
+POSITIVE_TTL = 7 * 24 * 3600
+NEGATIVE_TTL = 3600
+
+
+def _fold(name: str) -> str:
+    s = unicodedata.normalize("NFD", name or "")
+    return "".join(c for c in s if unicodedata.category(c) != "Mn").lower()
+
+
+def normalize_place_name(name: str) -> str:
+    """Chiave del gazetteer: minuscolo, senza accenti, apostrofi e suffissi come ', Italia' o la sigla di provincia."""
+    s = re.sub(r",.*$", "", _fold(name))
+    s = re.sub(r"\(.*?\)", " ", s)
+    s = re.sub(r"[^a-z0-9]+", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def geocode_key(name: str) -> str:
+    """Chiave di cache per l'API: tutta la stringa (anche dopo la virgola), senza accenti e maiuscole.
+
+    "San Giovanni, Napoli" e "San Giovanni, Roma" sono località diverse per
+    Google e non devono condividere il risultato.
+    """
+    parts = (re.sub(r"[^a-z0-9]+", " ", part).strip() for part in _fold(name).split(","))
+    return ", ".join(part for part in parts if part)
+
+
+def _load_gazetteer(path: Path = GAZETTEER_PATH) -> Dict[str, Dict[str, float]]:
+    index: Dict[str, Dict[str, float]] = {}
+    try:
+        entries = json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logger.warning(f"Gazetteer non disponibile ({path}): {e}")
+        return index
+    for entry in entries:
+        coords = {"lat": float(entry["lat"]), "lng": float(entry["lng"])}
+        for name in [entry.get("nome")] + list(entry.get("alias") or []):
+            key = normalize_place_name(name)
+            if key:
+                index.setdefault(key, coords)
+    logger.info(f"Gazetteer caricato: {len(entries)} comuni")
+    return index
+
+
+class GeocodeService:
+    """Coordinate di una località con gazetteer offline, cache e richieste coalescenti."""
+
+    def __init__(self, max_entries: int = 2000):
+        self.gazetteer = _load_gazetteer()
+        self.cache = TTLCache(max_entries=max_entries, default_ttl=POSITIVE_TTL, name="geocode")
+        self._flights = SingleFlight("geocode")
+        self._gazetteer_hits = 0
+        self._api_calls = 0
+
+    def lookup_offline(self, location: str) -> Optional[Dict[str, float]]:
+        """Cerca la località nel gazetteer (nome o alias, senza accenti e maiuscole)."""
+        coords = self.gazetteer.get(normalize_place_name(location))
+        return dict(coords) if coords else None
+
+    async def get_coordinates(self, location: str) -> Optional[Dict[str, float]]:
+        """Restituisce {'lat', 'lng'} della località oppure None."""
+        key = geocode_key(location)
+        if not key:
+            return None
+
+        offline = self.lookup_offline(location)
+        if offline:
+            self._gazetteer_hits += 1
+            return offline
+
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            return dict(cached) if cached else None
+
+        if settings.debug_mode and settings.google_maps_api_key == "DUMMY_KEY":
+            return None
+
+        result = await self._flights.do(key, lambda: self._fetch_cached(key, location))
+        return dict(result) if result else None
+
+    async def _fetch_cached(self, key: str, location: str) -> Optional[Dict[str, float]]:
+        try:
+            result = await self._fetch(location)
+        except Exception as e:
+            logger.warning(f"Errore nel recupero coordinate per '{location}': {e}")
+            return None
+        self.cache.set(key, result, ttl=POSITIVE_TTL if result else NEGATIVE_TTL)
+        return result
+
+    async def _fetch(self, location: str) -> Optional[Dict[str, float]]:
+        self._api_calls += 1
+        params = {
+            "address": location,
+            "key": settings.google_maps_api_key,
+        }
+        response = await http_client.get(GEOCODE_URL, params=params)
+        data = response.json()
+
+        results: List[Dict] = data.get("results", [])
+        if results:
+            location_coords = results[0].get("geometry", {}).get("location", {})
+            if location_coords.get("lat") and location_coords.get("lng"):
+                return {"lat": location_coords["lat"], "lng": location_coords["lng"]}
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        data = self.cache.stats()
+        data.update({
+            "gazetteer_entries": len(self.gazetteer),
+            "gazetteer_hits": self._gazetteer_hits,
+            "api_calls": self._api_calls,
+            "coalesced": self._flights.stats()["shared"],
+        })
+        return data
+
+
+# Istanza condivisa per il worker corrente
+geocode_service = GeocodeService()
@@ -1,10 +1,14 @@
 import asyncio
 import logging
-import httpx
 import math
 from typing import Dict, List, Any, Optional
 from ..config.settings import settings
 from .filtering_ranking_service import FilteringRankingService
+from . import http_client
+from .geocode_service import geocode_service
+from .places_cache import details_key, places_cache
+from .scoring import filter_by_distance
+from .ttl_cache import MISSING
 
 logger = logging.getLogger(__name__)
 
@@ -57,9 +61,8 @@ class GoogleMapsService:
             "fields": ",".join(fields)
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            data = response.json()
+        response = await http_client.get(url, params=params)
+        data = response.json()
         status = data.get("status")
         error_message = data.get("error_message")
         if status != "OK":
@@ -86,9 +89,8 @@ class GoogleMapsService:
             "fields": ",".join(fields)
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            data = response.json()
+        response = await http_client.get(url, params=params)
+        data = response.json()
         status = data.get("status")
         error_message = data.get("error_message")
         if status != "OK":
@@ -136,12 +138,18 @@ class GoogleMapsService:
             "language": language
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            data = response.json()
+        key = details_key(place_id, "google_maps", language)
+        cached = await places_cache.get(key)
+        if cached is not MISSING and cached is not None:
+            return cached
+
+        response = await http_client.get(url, params=params)
+        data = response.json()
         
         result = data.get("result", {})
         result["photo_url"] = self._get_photo_url(result.get("photos"))
+        if data.get("status") == "OK" and result:
+            await places_cache.set(key, result)
         
         return result
     
@@ -234,26 +242,8 @@ class GoogleMapsService:
             if not reference_coords:
                 return results  # Se non riusciamo a ottenere le coordinate, restituiamo tutti i risultati
             
-            # Filtra i risultati in base alla distanza (max 50km)
-            filtered_results = []
-            for result in results:
-                geometry = result.get('geometry', {})
-                location_coords = geometry.get('location', {})
-                
-                if location_coords.get('lat') and location_coords.get('lng'):
-                    distance = self._calculate_distance(
-                        reference_coords['lat'], reference_coords['lng'],
-                        location_coords['lat'], location_coords['lng']
-                    )
-                    
-                    # Mantieni solo i risultati entro 50km
-                    if distance <= 35:
-                        filtered_results.append(result)
-                    else:
-                        logger.info(f"Filtrato risultato '{result.get('name')}' - distanza: {distance:.1f}km")
-                else:
-                    # Se non abbiamo coordinate, manteniamo il risultato
-                    filtered_results.append(result)
+            # Filtra i risultati in base alla distanza (max 35km), in un'unica passata sul lotto
+            filtered_results = filter_by_distance(results, reference_coords, max_km=35)
             
             logger.info(f"Filtro geografico: {len(results)} -> {len(filtered_results)} risultati")
             return filtered_results
@@ -285,34 +275,8 @@ class GoogleMapsService:
         return None
     
     async def _get_location_coordinates(self, location: str) -> Optional[Dict[str, float]]:
-        """Ottiene le coordinate di una località usando l'API Geocoding."""
-        try:
-            url = f"{self.base_url}/geocode/json"
-            params = {
-                'address': location,
-                'key': self.api_key
-            }
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, params=params)
-                data = response.json()
-            
-            results = data.get('results', [])
-            if results:
-                geometry = results[0].get('geometry', {})
-                location_coords = geometry.get('location', {})
-                
-                if location_coords.get('lat') and location_coords.get('lng'):
-                    return {
-                        'lat': location_coords['lat'],
-                        'lng': location_coords['lng']
-                    }
-            
-            return None
-            
-        except Exception as e:
-            logger.warning(f"Errore nel recupero coordinate per '{location}': {e}")
-            return None
+        """Ottiene le coordinate di una località (gazetteer offline, cache, API Geocoding)."""
+        return await geocode_service.get_coordinates(location)
     
     def _calculate_distance(self, lat1: float, lng1: float, lat2: float, lng2: float) -> float:
         """Calcola la distanza in km tra due punti usando la formula dell'emisenoverso."""
@@ -0,0 +1,156 @@
+"""Client HTTP condiviso per le chiamate verso le API esterne (Google in primis).
+
+Un unico ``httpx.AsyncClient`` per processo, creato nel lifespan di FastAPI:
+connessioni keep-alive riutilizzate (HTTP/2 se il pacchetto ``h2`` è
+installato), limite di connessioni per host, timeout uniformi e retry con
+backoff esponenziale + jitter su 429/5xx ed errori di trasporto.
+"""
+
+import asyncio
+import logging
+import random
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+
+from ..config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Status per cui ha senso ritentare la richiesta
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Metodi idempotenti: solo questi vengono ritentati automaticamente
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+_BACKOFF_BASE_SECONDS = 0.25
+_BACKOFF_MAX_SECONDS = 4.0
+
+_client: Optional[httpx.AsyncClient] = None
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive,
+        keepalive_expiry=30.0,
+    )
+    timeout = httpx.Timeout(settings.http_timeout_seconds, connect=5.0)
+    http2 = _http2_available()
+    logger.info(f"Client HTTP condiviso creato (http2={http2}, max_connections={settings.http_max_connections})")
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+
+async def startup() -> None:
+    """Crea il client condiviso (chiamato dal lifespan dell'applicazione)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+
+
+async def shutdown() -> None:
+    """Chiude il client condiviso e le connessioni aperte."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _host_semaphores.clear()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Restituisce il client condiviso; se il lifespan non è attivo (script, test) lo crea al volo."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = httpx.URL(url).host
+    sem = _host_semaphores.get(host)
+    if sem is None:
+        sem = asyncio.Semaphore(settings.http_max_per_host)
+        _host_semaphores[host] = sem
+    return sem
+
+
+def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+    # Rispetta Retry-After se presente, altrimenti backoff esponenziale con jitter pieno
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), _BACKOFF_MAX_SECONDS)
+    cap = min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+async def request(method: str, url: str, *, retries: Optional[int] = None, **kwargs: Any) -> httpx.Response:
+    """Esegue una richiesta sul client condiviso, con retry su 429/5xx per i metodi idempotenti.
+
+    Accetta gli stessi argomenti di ``httpx.AsyncClient.request`` (params, headers,
+    data, timeout, follow_redirects, ...). L'ultima risposta (anche se di errore)
+    viene restituita al chiamante; le eccezioni di trasporto vengono rilanciate
+    dopo l'ultimo tentativo.
+    """
+    method = method.upper()
+    if retries is None:
+        retries = settings.http_max_retries if method in IDEMPOTENT_METHODS else 0
+    client = get_http_client()
+    attempt = 0
+    while True:
+        response: Optional[httpx.Response] = None
+        try:
+            async with _host_semaphore(url):
+                response = await client.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUS or attempt >= retries:
+                return response
+            logger.info(f"HTTP {response.status_code} da {httpx.URL(url).host}: nuovo tentativo ({attempt + 1}/{retries})")
+        except httpx.TransportError as e:
+            if attempt >= retries:
+                raise
+            logger.info(f"Errore di trasporto verso {httpx.URL(url).host} ({e.__class__.__name__}): nuovo tentativo ({attempt + 1}/{retries})")
+        await asyncio.sleep(_retry_delay(attempt, response))
+        attempt += 1
+
+
+async def get(url: str, **kwargs: Any) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs: Any) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, **kwargs: Any):
+    """Richiesta in streaming sul client condiviso (senza retry): il corpo si legge con ``aiter_bytes``."""
+    async with _host_semaphore(url):
+        async with get_http_client().stream(method.upper(), url, **kwargs) as response:
+            yield response
+
+
+class _SharedSession:
+    """Vista sul client condiviso con argomenti di default (timeout, redirect, ...)."""
+
+    def __init__(self, **defaults: Any):
+        self._defaults = defaults
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await request("GET", url, **{**self._defaults, **kwargs})
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await request("POST", url, **{**self._defaults, **kwargs})
+
+
+@asynccontextmanager
+async def session(**defaults: Any):
+    """Sostituto di ``async with httpx.AsyncClient(...) as client``: riusa il pool condiviso senza chiuderlo."""
+    yield _SharedSession(**defaults)
@@ -0,0 +1,138 @@
+"""Preriscaldamento in background della cache immagini dopo una ricerca.
+
+Il contenuto generato e i risultati classificati contengono già gli URL che il
+browser chiederà subito dopo (``/image_search_cse?dish=...&city=...``,
+``/city_image_cse?city=...``). ``submit()`` li estrae e li mette in una coda
+limitata, svuotata da pochi worker che chiamano gli stessi resolver degli
+endpoint (single-flight, salvataggio in Initalya.photo / cities.photo). Così,
+quando arrivano le richieste delle card, l'immagine è già in cache oppure la
+ricerca è già in corso e viene condivisa.
+
+Il lavoro è fuori dal percorso della richiesta: ``submit()`` non attende mai e,
+se la coda è piena, scarta le voci in eccesso.
+"""
+
+import asyncio
+import html
+import logging
+import re
+import urllib.parse
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..config.settings import settings
+from .single_flight import image_flights, image_key
+from .ttl_cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Chiavi già preriscaldate da questo worker: non vengono rimesse in coda per un po'
+_RECENT_TTL_SECONDS = 6 * 3600
+_RECENT_MAX_ENTRIES = 5000
+
+_IMAGE_URL = re.compile(r"/(image_search(?:_cse)?|city_image(?:_cse)?|city_dish_image)\?([^\"'\s<>()\\]+)")
+
+ImageRequest = Tuple[str, Optional[str], Optional[str]]
+
+
+def extract_image_requests(text: str) -> List[ImageRequest]:
+    """(tipo, piatto, città) per ogni URL immagine presente nel testo, senza ripetizioni."""
+    found: List[ImageRequest] = []
+    seen = set()
+    for endpoint, query in _IMAGE_URL.findall(text or ""):
+        params = urllib.parse.parse_qs(html.unescape(query))
+        dish = (params.get("dish") or [""])[0].strip() or None
+        city = (params.get("city") or [""])[0].strip() or None
+        if endpoint.startswith("image_search") and dish:
+            request = ("dish", dish, city)
+        elif endpoint.startswith("city_image") and city:
+            request = ("city", None, city)
+        elif endpoint == "city_dish_image" and dish and city:
+            request = ("city_dish", dish, city)
+        else:
+            continue
+        if request not in seen:
+            seen.add(request)
+            found.append(request)
+    return found
+
+
+class ImagePrefetcher:
+    """Coda limitata di immagini da preparare, servita da un numero fisso di worker."""
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending = set()
+        self._recent = TTLCache(max_entries=_RECENT_MAX_ENTRIES, default_ttl=_RECENT_TTL_SECONDS, name="prefetch")
+        self._resolvers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self._counters = {"queued": 0, "skipped": 0, "dropped": 0, "warmed": 0, "failed": 0}
+
+    def configure(self, resolvers: Dict[str, Callable[[Optional[str], Optional[str]], Awaitable[Any]]]) -> None:
+        """Resolver per tipo ("dish", "city", "city_dish"), chiamati come resolver(piatto, città)."""
+        self._resolvers = dict(resolvers)
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._pending.clear()
+
+    def submit(self, text: str) -> int:
+        """Mette in coda le immagini citate nel testo; restituisce quante ne sono state accodate."""
+        if self._queue is None or not text:
+            return 0
+        queued = 0
+        for kind, dish, city in extract_image_requests(text):
+            if kind not in self._resolvers:
+                continue
+            key = image_key(kind, dish, city)
+            if key in self._pending or image_flights.in_flight(key) or self._recent.get(key) is not MISSING:
+                self._counters["skipped"] += 1
+                continue
+            try:
+                self._queue.put_nowait((key, kind, dish, city))
+            except asyncio.QueueFull:
+                self._counters["dropped"] += 1
+                break
+            self._pending.add(key)
+            self._counters["queued"] += 1
+            queued += 1
+        return queued
+
+    async def _worker(self) -> None:
+        queue = self._queue
+        while True:
+            key, kind, dish, city = await queue.get()
+            try:
+                url = await self._resolvers[kind](dish, city)
+                self._counters["warmed" if url else "failed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._counters["failed"] += 1
+                logger.warning(f"Prefetch immagine {key} fallito: {e}")
+            finally:
+                # Anche gli esiti negativi non vengono ritentati subito (quota CSE)
+                self._recent.set(key, True)
+                self._pending.discard(key)
+                queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "pending": len(self._pending)}
+
+
+# Istanza condivisa per il worker corrente
+image_prefetcher = ImagePrefetcher(
+    workers=settings.image_prefetch_workers,
+    queue_size=settings.image_prefetch_queue_size,
+)
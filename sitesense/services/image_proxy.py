@@ -0,0 +1,288 @@
+"""Proxy immagini con cache su disco indirizzata per contenuto e varianti ridimensionate.
+
+Invece di rimandare il browser all'host originale (spesso lento e con immagini
+a piena risoluzione), gli endpoint immagine scaricano l'originale una volta e
+servono una variante adatta all'uso:
+- ``thumb`` (200 px), ``card`` (640 px), ``hero`` (1280 px) di larghezza, in WebP
+  (richiede Pillow, in requirements.txt: senza si serve l'originale e all'avvio
+  viene registrato un avviso).
+
+Struttura della cache (``IMAGE_CACHE_DIR``):
+- ``originals/<sha256>``: byte originali, nominati per hash del contenuto;
+- ``variants/<sha256>-<variante>.webp``: varianti generate al primo uso;
+- ``sources/<sha1 dell'URL>``: URL sorgente -> hash del contenuto.
+
+Le risposte hanno ETag (hash + variante), Last-Modified e Cache-Control lunghi;
+il disco (originali, varianti e indice delle sorgenti) è limitato a
+``IMAGE_CACHE_MAX_MB`` con politica LRU. Gli originali si scaricano in
+streaming e il download si interrompe oltre ``MAX_SOURCE_BYTES``.
+"""
+
+import asyncio
+import email.utils
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+from ..config.settings import settings
+from . import http_client
+from .single_flight import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:  # senza Pillow niente varianti: avviso in startup()
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = {"thumb": 200, "card": 640, "hero": 1280}
+DEFAULT_VARIANT = "card"
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+WEBP_QUALITY = 80
+_CACHE_SUBDIRS = ("originals", "variants", "sources")
+
+# Firme dei formati più comuni, per il Content-Type degli originali
+_MAGIC = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+
+
+def variant_name(variant: Optional[str]) -> str:
+    return variant if variant in VARIANTS else DEFAULT_VARIANT
+
+
+def _sniff_content_type(data: bytes) -> Optional[str]:
+    for magic, content_type in _MAGIC:
+        if data.startswith(magic):
+            return content_type
+    return None
+
+
+class CachedImage:
+    """File della cache pronto per la risposta HTTP."""
+
+    def __init__(self, path: Path, content_type: str, etag: str):
+        self.path = path
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = path.stat().st_mtime
+
+
+class ImageProxy:
+    """Cache su disco con limite di dimensione (LRU) e generazione delle varianti."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[Path, int]" = OrderedDict()
+        self._total = 0
+        self._loaded = False
+        self._flights = SingleFlight("image_proxy")
+        self._counters = {"hits": 0, "downloads": 0, "variants": 0, "evictions": 0, "failures": 0}
+
+    async def startup(self) -> None:
+        """Carica l'indice LRU della cache e segnala se mancano le varianti ridimensionate."""
+        if not settings.image_proxy_enabled:
+            return
+        if Image is None:
+            logger.warning(
+                "Proxy immagini: Pillow non installato, le varianti thumb/card/hero non vengono generate "
+                "e si servono gli originali a piena risoluzione (pip install -r requirements.txt)"
+            )
+        await asyncio.to_thread(self._load)
+
+    def _load(self) -> None:
+        with self._lock:
+            self._load_locked()
+
+    # --- LRU su disco -----------------------------------------------------------------
+
+    def _load_locked(self) -> None:
+        if self._loaded:
+            return
+        entries = []
+        for sub in _CACHE_SUBDIRS:
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+            for path in (self.root / sub).iterdir():
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_atime, path, st.st_size))
+        for _, path, size in sorted(entries, key=lambda e: e[0]):
+            self._lru[path] = size
+            self._total += size
+        self._loaded = True
+        self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._total > self.max_bytes and len(self._lru) > 1:
+            path, size = self._lru.popitem(last=False)
+            self._total -= size
+            self._counters["evictions"] += 1
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _touch(self, path: Path) -> None:
+        with self._lock:
+            if path in self._lru:
+                self._lru.move_to_end(path)
+        try:
+            # Solo l'ora di accesso: l'ora di modifica resta il Last-Modified
+            os.utime(path, (time.time(), path.stat().st_mtime))
+        except OSError:
+            pass
+
+    def _write(self, path: Path, data: bytes) -> None:
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(data) - self._lru.pop(path, 0)
+            self._lru[path] = len(data)
+            self._evict_locked()
+
+    # --- originali ------------------------------------------------------------------
+
+    def _source_file(self, source_url: str) -> Path:
+        return self.root / "sources" / hashlib.sha1(source_url.encode("utf-8")).hexdigest()
+
+    def _cached_digest(self, source_url: str) -> Optional[str]:
+        with self._lock:
+            self._load_locked()
+        source = self._source_file(source_url)
+        try:
+            digest = source.read_text().strip()
+        except OSError:
+            return None
+        if not (self.root / "originals" / digest).exists():
+            return None
+        # Anche l'indice è nella LRU: quello di un originale rimosso invecchia e viene eliminato
+        self._touch(source)
+        return digest
+
+    def _store_original(self, source_url: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.root / "originals" / digest
+        if not path.exists():
+            self._write(path, data)
+        self._write(self._source_file(source_url), digest.encode("ascii"))
+        return digest
+
+    async def _download(self, source_url: str) -> Optional[str]:
+        async with http_client.stream("GET", source_url, follow_redirects=True, timeout=15, headers={"Accept": "image/*"}) as response:
+            content_type = response.headers.get("content-type", "")
+            if response.status_code != 200 or not content_type.startswith("image/"):
+                logger.info(f"Proxy immagini: sorgente non valida ({response.status_code}, {content_type}) {source_url}")
+                return None
+            length = response.headers.get("content-length", "")
+            if length.isdigit() and int(length) > MAX_SOURCE_BYTES:
+                logger.info(f"Proxy immagini: sorgente troppo grande ({length} byte) {source_url}")
+                return None
+            buf = bytearray()
+            async for chunk in response.aiter_bytes():
+                buf += chunk
+                if len(buf) > MAX_SOURCE_BYTES:
+                    logger.info(f"Proxy immagini: sorgente oltre {MAX_SOURCE_BYTES} byte, download interrotto {source_url}")
+                    return None
+        data = bytes(buf)
+        if not data:
+            return None
+        self._counters["downloads"] += 1
+        return await asyncio.to_thread(self._store_original, source_url, data)
+
+    async def _original_digest(self, source_url: str) -> Optional[str]:
+        digest = await asyncio.to_thread(self._cached_digest, source_url)
+        if digest:
+            return digest
+        return await self._flights.do(("source", source_url), lambda: self._download(source_url))
+
+    # --- varianti -------------------------------------------------------------------
+
+    def _variant(self, digest: str, variant: str) -> CachedImage:
+        original = self.root / "originals" / digest
+        if Image is None:
+            self._touch(original)
+            with original.open("rb") as f:
+                head = f.read(16)
+            return CachedImage(original, _sniff_content_type(head) or "application/octet-stream", f'"{digest[:32]}"')
+        path = self.root / "variants" / f"{digest}-{variant}.webp"
+        # L'originale resta "recente" insieme alle sue varianti (serve per generarne altre)
+        self._touch(original)
+        if path.exists():
+            self._counters["hits"] += 1
+            self._touch(path)
+        else:
+            with Image.open(original) as img:
+                img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+                width = VARIANTS[variant]
+                if img.width > width:
+                    img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+                buf = io.BytesIO()
+                img.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+            self._write(path, buf.getvalue())
+            self._counters["variants"] += 1
+        return CachedImage(path, "image/webp", f'"{digest[:32]}-{variant}"')
+
+    async def get(self, source_url: str, variant: Optional[str] = None) -> Optional[CachedImage]:
+        """Variante dell'immagine all'URL indicato, scaricandola e generandola se necessario."""
+        if not source_url:
+            return None
+        variant = variant_name(variant)
+        try:
+            digest = await self._original_digest(source_url)
+            if not digest:
+                self._counters["failures"] += 1
+                return None
+            return await self._flights.do(("variant", digest, variant), lambda: asyncio.to_thread(self._variant, digest, variant))
+        except Exception as e:
+            self._counters["failures"] += 1
+            logger.warning(f"Proxy immagini: errore per {source_url}: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "bytes": self._total, "files": len(self._lru), "resize": Image is not None}
+
+
+def image_response(image: CachedImage, request: Optional[Request], max_age: int) -> Response:
+    """FileResponse con ETag/Last-Modified/Cache-Control; 304 se il browser ha già la stessa versione."""
+    headers = {
+        "ETag": image.etag,
+        "Last-Modified": email.utils.formatdate(image.last_modified, usegmt=True),
+        "Cache-Control": f"public, max-age={max_age}",
+    }
+    if request is not None:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and image.etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if_modified_since = request.headers.get("if-modified-since")
+        if not if_none_match and if_modified_since:
+            try:
+                if email.utils.parsedate_to_datetime(if_modified_since).timestamp() >= int(image.last_modified):
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+    return FileResponse(image.path, media_type=image.content_type, headers=headers)
+
+
+# Istanza condivisa per il worker corrente
+image_proxy = ImageProxy(
+    root=Path(settings.image_cache_dir),
+    max_bytes=settings.image_cache_max_mb * 1024 * 1024,
+)
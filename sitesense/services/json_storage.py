@@ -0,0 +1,146 @@
+"""Lettura e scrittura dei file JSON dell'applicazione (cache città, itinerari salvati, file di debug).
+
+- Scritture atomiche: file temporaneo nella stessa cartella, fsync, poi
+  ``os.replace``; un lettore vede sempre il file vecchio o quello nuovo, mai
+  uno scritto a metà. Scritture sullo stesso percorso nello stesso worker
+  sono serializzate.
+- Serializzazione compatta (senza indentazione), UTF-8.
+- Letture memorizzate per percorso (LRU con scadenza, solo file piccoli) e
+  validate su mtime e dimensione: il file viene riletto e decodificato solo se
+  è cambiato. Le scritture non popolano la memoria: molti file (es. gli
+  itinerari salvati) sono letti dal browser e mai dal server.
+- Le varianti ``async`` eseguono l'I/O in un thread, fuori dall'event loop.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Union
+
+from .ttl_cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+PathLike = Union[str, Path]
+
+# File decodificati tenuti in memoria e loro durata massima
+_MEMO_MAX_ENTRIES = 128
+_MEMO_TTL_SECONDS = 3600
+# File più grandi vengono riletti a ogni lettura invece di restare in memoria
+_MEMO_MAX_FILE_BYTES = 1024 * 1024
+
+
+def dumps(data: Any) -> str:
+    """JSON compatto, con caratteri non ASCII in chiaro."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class JsonStorage:
+    """File JSON su disco con scritture atomiche e letture memorizzate."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path_locks: Dict[str, threading.Lock] = {}
+        # percorso -> (mtime_ns, dimensione, valore decodificato)
+        self._memo = TTLCache(max_entries=_MEMO_MAX_ENTRIES, default_ttl=_MEMO_TTL_SECONDS, name="json_memo")
+        self._counters = {"reads": 0, "memo_hits": 0, "writes": 0, "deletes": 0, "errors": 0}
+
+    @staticmethod
+    def _key(path: PathLike) -> str:
+        return os.path.abspath(os.fspath(path))
+
+    def _path_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            lock = self._path_locks.get(key)
+            if lock is None:
+                lock = self._path_locks[key] = threading.Lock()
+            return lock
+
+    def write_sync(self, path: PathLike, data: Any) -> None:
+        """Scrive ``data`` in modo atomico (temp + fsync + rename)."""
+        key = self._key(path)
+        payload = dumps(data).encode("utf-8")
+        directory = os.path.dirname(key)
+        os.makedirs(directory, exist_ok=True)
+        with self._path_lock(key):
+            fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(key)}.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, key)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+            with self._lock:
+                # La prossima lettura rilegge il file
+                self._memo.pop(key)
+                self._counters["writes"] += 1
+
+    def read_sync(self, path: PathLike, default: Any = None) -> Any:
+        """Contenuto del file (copia indipendente); ``default`` se manca o non è JSON valido."""
+        key = self._key(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return default
+        with self._lock:
+            memo = self._memo.get(key)
+        if memo is not MISSING and memo[0] == st.st_mtime_ns and memo[1] == st.st_size:
+            with self._lock:
+                self._counters["memo_hits"] += 1
+        else:
+            try:
+                with open(key, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+            except (OSError, ValueError) as e:
+                with self._lock:
+                    self._counters["errors"] += 1
+                logger.warning(f"Lettura JSON fallita per {key}: {e}")
+                return default
+            memo = (st.st_mtime_ns, st.st_size, value)
+            with self._lock:
+                if st.st_size <= _MEMO_MAX_FILE_BYTES:
+                    self._memo.set(key, memo)
+                else:
+                    self._memo.pop(key)
+                self._counters["reads"] += 1
+        return copy.deepcopy(memo[2])
+
+    def delete_sync(self, path: PathLike) -> None:
+        """Rimuove il file se esiste."""
+        key = self._key(path)
+        with self._path_lock(key):
+            try:
+                os.unlink(key)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._memo.pop(key)
+                self._counters["deletes"] += 1
+
+    async def write(self, path: PathLike, data: Any) -> None:
+        await asyncio.to_thread(self.write_sync, path, data)
+
+    async def read(self, path: PathLike, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.read_sync, path, default)
+
+    async def delete(self, path: PathLike) -> None:
+        await asyncio.to_thread(self.delete_sync, path)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "memo": len(self._memo)}
+
+
+# Istanza condivisa per il worker corrente
+json_storage = JsonStorage()
@@ -0,0 +1,63 @@
+"""Sanificazione dei percorsi come middleware ASGI puro.
+
+I link generati dal dashboard e dalle pagine del design a volte contengono
+virgolette (grezze o ``%22``), doppi slash o uno slash dopo ``.html``: la
+richiesta viene reindirizzata (307) al percorso ripulito. Gli alias di
+``api_current_user`` sotto ``/dashboard`` e ``/api/area_riservata`` sono
+reindirizzati a ``/api_current_user``.
+
+A differenza di ``@app.middleware("http")`` (BaseHTTPMiddleware) non avvolge
+richiesta e risposta: per un percorso già pulito costa pochi controlli
+``in`` sulla stringa e la chiamata passa direttamente all'applicazione, senza
+toccare le risposte in streaming come ``/search``.
+"""
+
+import re
+from typing import Optional, Sequence
+
+from fastapi.responses import RedirectResponse
+
+_MULTI_SLASH = re.compile(r"/+")
+_HTML_TRAILING_SLASH = re.compile(r"(\.html)/+$")
+_CURRENT_USER_ALIASES = ("/dashboard/api_current_user", "/api/area_riservata/api_current_user")
+
+
+def sanitize_path(path: str) -> Optional[str]:
+    """Percorso ripulito da virgolette, doppi slash e slash dopo .html; None se è già pulito."""
+    if '"' not in path and "'" not in path and "%22" not in path and "//" not in path and not path.endswith(".html/"):
+        return None
+    # Rimuove qualsiasi occorrenza di %22 o virgolette grezze dal path
+    sanitized = path.replace('%22', '').replace('"', '').replace("'", '')
+    # Normalizza doppi slash
+    sanitized = _MULTI_SLASH.sub("/", sanitized)
+    # Rimuove slash finale superfluo dopo .html
+    sanitized = _HTML_TRAILING_SLASH.sub(r"\1", sanitized)
+    return sanitized if sanitized != path else None
+
+
+class SanitizePathMiddleware:
+    """Middleware ASGI: redirect 307 per percorsi sporchi, passaggio diretto per tutto il resto."""
+
+    def __init__(self, app, bypass_prefixes: Sequence[str] = ()):
+        self.app = app
+        # Mount statici: i loro percorsi non passano dalla sanificazione
+        self.bypass_prefixes = tuple(bypass_prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope.get("root_path", "") + scope["path"]
+        if path.startswith(_CURRENT_USER_ALIASES):
+            target = "/api_current_user"
+        elif self.bypass_prefixes and path.startswith(self.bypass_prefixes):
+            await self.app(scope, receive, send)
+            return
+        else:
+            target = sanitize_path(path)
+            if target is None:
+                await self.app(scope, receive, send)
+                return
+        query = scope.get("query_string", b"").decode("latin-1")
+        response = RedirectResponse(url=target if not query else f"{target}?{query}", status_code=307)
+        await response(scope, receive, send)
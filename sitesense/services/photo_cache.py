@@ -0,0 +1,297 @@
+"""Cache delle immagini salvate in Initalya.photo (piatti, elementi della pagina intro).
+
+Le ricerche non usano più ``titolo LIKE '%...%'`` (scansione completa della
+tabella) ma una chiave normalizzata:
+- ``dish_slug``: titolo senza accenti, minuscolo, parole separate da "-";
+- indice univoco ``(dish_slug, city_id)``, scritto a ogni inserimento; la
+  ricerca senza città usa lo stesso indice per prefisso.
+
+Davanti al database c'è una LRU in memoria. Il confronto parziale sul titolo
+resta solo come ultimo livello esplicito, con i propri contatori
+(``stats()``). La migrazione (colonna, valori per le righe esistenti, indice)
+viene eseguita all'avvio da ``startup()`` e registrata in
+``Initalya.app_migrations``: i worker successivi non la ripetono.
+"""
+
+import logging
+import re
+import threading
+import time
+import unicodedata
+import urllib.parse
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from mysql.connector import errors
+
+from ..config.settings import settings
+from . import database
+from .ttl_cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+SLUG_MAX_LENGTH = 191  # massimo indicizzabile per VARCHAR utf8mb4
+URL_MAX_LENGTH = 255   # colonna url di Initalya.photo
+INDEX_NAME = "uq_photo_dish_city"
+# Nome con cui la migrazione è registrata in Initalya.app_migrations
+MIGRATION_NAME = "photo_dish_slug"
+_BACKFILL_BATCH_ROWS = 500
+# Dopo una migrazione fallita (es. permessi insufficienti) si riprova non prima di così
+_MIGRATION_RETRY_SECONDS = 300.0
+# Errori MySQL attesi se un altro worker ha già applicato la migrazione
+_ER_DUP_FIELDNAME = 1060
+_ER_DUP_KEYNAME = 1061
+
+SOCIAL_DOMAINS = [
+    "instagram.com", "cdninstagram.com", "instagr.am", "facebook.com", "fbcdn.net", "m.facebook.com", "fbsbx.com", "tiktok.com"
+]
+
+
+def is_social_url(url: str) -> bool:
+    """True se l'URL appartiene a un social (immagini non riutilizzabili)."""
+    try:
+        host = urllib.parse.urlparse(url).netloc.lower()
+    except Exception:
+        return False
+    return any(host == d or host.endswith("." + d) for d in SOCIAL_DOMAINS)
+
+
+def slugify(text: str) -> str:
+    """'Orecchiette alle Cime di Rapa' -> 'orecchiette-alle-cime-di-rapa'."""
+    s = unicodedata.normalize("NFD", text or "")
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn").lower()
+    return re.sub(r"[^a-z0-9]+", "-", s).strip("-")[:SLUG_MAX_LENGTH]
+
+
+class PhotoCache:
+    """Ricerca a livelli (memoria, chiave indicizzata, confronto parziale) e salvataggio delle immagini."""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.memory = TTLCache(max_entries=max_entries, default_ttl=ttl, name="photo")
+        self._memory_lock = threading.Lock()
+        self._migration_lock = threading.Lock()
+        self._migrated = False
+        self._migration_failed_at = 0.0
+        self._counters = {"indexed_hits": 0, "fuzzy_hits": 0, "misses": 0, "stores": 0}
+
+    def _count(self, key: str) -> None:
+        with self._memory_lock:
+            self._counters[key] += 1
+
+    def _remember(self, key: Tuple[str, Optional[int]], url: str) -> None:
+        with self._memory_lock:
+            self.memory.set(key, url)
+
+    def _usable(self, url: Optional[str]) -> bool:
+        if not url:
+            return False
+        if is_social_url(url):
+            logger.info(f"⛔ URL cache su dominio social ignorato: {url}")
+            return False
+        return True
+
+    def _fetch_url(self, conn, sql: str, params: Sequence[Any]) -> Optional[str]:
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, tuple(params))
+            row = cur.fetchone()
+        finally:
+            cur.close()
+        return row[0] if row else None
+
+    def lookup(self, conn, title: str, city_id: Optional[int], fuzzy_patterns: Sequence[str] = ()) -> Optional[str]:
+        """URL salvato per (titolo, città); con city_id None cerca in tutte le città.
+        ``fuzzy_patterns`` attiva l'ultimo livello: ``titolo LIKE '%pattern%'``."""
+        slug = slugify(title)
+        if not slug:
+            return None
+        key = (slug, city_id)
+        with self._memory_lock:
+            url = self.memory.get(key)
+        if url is not MISSING:
+            return url
+        if conn is None:
+            return None
+
+        self.migrate(conn)
+        # Senza migrazione (non ancora riuscita) si confronta il titolo esatto, come in passato
+        column, value = ("dish_slug", slug) if self._migrated else ("titolo", title)
+        if city_id is not None:
+            url = self._fetch_url(
+                conn, f"SELECT url FROM Initalya.photo WHERE {column} = %s AND city_id = %s ORDER BY id DESC LIMIT 1",
+                (value, city_id),
+            )
+        else:
+            url = self._fetch_url(
+                conn, f"SELECT url FROM Initalya.photo WHERE {column} = %s ORDER BY id DESC LIMIT 1", (value,)
+            )
+        if self._usable(url):
+            self._count("indexed_hits")
+            self._remember(key, url)
+            return url
+
+        patterns = [p for p in fuzzy_patterns if p]
+        if patterns:
+            likes = " OR ".join(["titolo LIKE %s"] * len(patterns))
+            params = [f"%{p}%" for p in patterns]
+            where = f"({likes})"
+            if city_id is not None:
+                where = f"city_id = %s AND {where}"
+                params.insert(0, city_id)
+            url = self._fetch_url(conn, f"SELECT url FROM Initalya.photo WHERE {where} ORDER BY id DESC LIMIT 1", params)
+            if self._usable(url):
+                self._count("fuzzy_hits")
+                logger.info(f"Immagine per '{title}' trovata solo con confronto parziale sul titolo")
+                self._remember(key, url)
+                return url
+
+        self._count("misses")
+        return None
+
+    def store(self, conn, title: str, city_id: int, url: str) -> bool:
+        """Salva (o aggiorna) l'immagine di un titolo per una città. False se non salvabile."""
+        slug = slugify(title)
+        if not slug or not city_id or not url:
+            return False
+        if is_social_url(url):
+            logger.info(f"⛔ Salvataggio evitato per URL social: {url}")
+            return False
+        if len(url) > URL_MAX_LENGTH:
+            logger.info(f"Salvataggio evitato per URL più lungo di {URL_MAX_LENGTH} caratteri: {url}")
+            return False
+        self.migrate(conn)
+        cur = conn.cursor()
+        try:
+            if self._migrated:
+                cur.execute(
+                    "INSERT INTO Initalya.photo (city_id, url, titolo, dish_slug) VALUES (%s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE url = VALUES(url), titolo = VALUES(titolo)",
+                    (city_id, url, title[:255], slug),
+                )
+            else:
+                cur.execute(
+                    "INSERT INTO Initalya.photo (city_id, url, titolo) VALUES (%s, %s, %s)", (city_id, url, title[:255])
+                )
+            conn.commit()
+        finally:
+            cur.close()
+        self._count("stores")
+        self._remember((slug, city_id), url)
+        return True
+
+    # --- migrazione -------------------------------------------------------------------
+
+    def migrate(self, conn) -> None:
+        """Crea la tabella se manca, aggiunge dish_slug, la valorizza per le righe esistenti
+        e crea l'indice univoco. Eseguita una volta per worker."""
+        if self._migrated or conn is None:
+            return
+        if self._migration_failed_at and time.monotonic() - self._migration_failed_at < _MIGRATION_RETRY_SECONDS:
+            return
+        with self._migration_lock:
+            if self._migrated:
+                return
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS Initalya.photo (
+                        id INT AUTO_INCREMENT PRIMARY KEY,
+                        city_id INT NOT NULL,
+                        url VARCHAR(255) NOT NULL,
+                        titolo VARCHAR(255) NOT NULL,
+                        dish_slug VARCHAR({SLUG_MAX_LENGTH}) NULL,
+                        UNIQUE KEY {INDEX_NAME} (dish_slug, city_id),
+                        FOREIGN KEY (city_id) REFERENCES cities(id) ON DELETE CASCADE
+                    )
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS Initalya.app_migrations (
+                        name VARCHAR(100) PRIMARY KEY,
+                        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                    """
+                )
+                cur.execute("SELECT 1 FROM Initalya.app_migrations WHERE name = %s", (MIGRATION_NAME,))
+                if cur.fetchone():
+                    # Già applicata da questo o da un altro worker
+                    self._migrated = True
+                    return
+                cur.execute(
+                    "SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS "
+                    "WHERE TABLE_SCHEMA = 'Initalya' AND TABLE_NAME = 'photo' AND COLUMN_NAME = 'dish_slug'"
+                )
+                if not cur.fetchone()[0]:
+                    self._ddl(cur, f"ALTER TABLE Initalya.photo ADD COLUMN dish_slug VARCHAR({SLUG_MAX_LENGTH}) NULL", _ER_DUP_FIELDNAME)
+                cur.execute(
+                    "SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS "
+                    "WHERE TABLE_SCHEMA = 'Initalya' AND TABLE_NAME = 'photo' AND INDEX_NAME = %s",
+                    (INDEX_NAME,),
+                )
+                has_index = bool(cur.fetchone()[0])
+                self._backfill(conn, cur)
+                if not has_index:
+                    self._ddl(cur, f"ALTER TABLE Initalya.photo ADD UNIQUE INDEX {INDEX_NAME} (dish_slug, city_id)", _ER_DUP_KEYNAME)
+                cur.execute("INSERT IGNORE INTO Initalya.app_migrations (name) VALUES (%s)", (MIGRATION_NAME,))
+                conn.commit()
+                self._migrated = True
+            except errors.Error as e:
+                self._migration_failed_at = time.monotonic()
+                logger.warning(f"Migrazione Initalya.photo non completata: {e}")
+            finally:
+                cur.close()
+
+    @staticmethod
+    def _ddl(cur, sql: str, already_applied_errno: int) -> None:
+        try:
+            cur.execute(sql)
+        except errors.Error as e:
+            if getattr(e, "errno", None) != already_applied_errno:
+                raise
+
+    @staticmethod
+    def _backfill(conn, cur) -> None:
+        """Valorizza dish_slug per le righe che non l'hanno ancora. A parità di (slug, città) la
+        chiave va solo alla riga più recente, che era quella restituita dalle vecchie ricerche;
+        le righe duplicate restano NULL."""
+        cur.execute("SELECT id, city_id, titolo FROM Initalya.photo WHERE dish_slug IS NULL ORDER BY id DESC")
+        candidates: Dict[Tuple[str, int], int] = {}
+        for photo_id, city_id, titolo in cur.fetchall() or []:
+            key = (slugify(titolo or ""), city_id)
+            if key[0] and key not in candidates:
+                candidates[key] = photo_id
+        # Chiavi già assegnate ad altre righe (lette tramite l'indice, solo per gli slug candidati)
+        slugs = sorted({slug for slug, _ in candidates})
+        taken = set()
+        for i in range(0, len(slugs), _BACKFILL_BATCH_ROWS):
+            chunk = slugs[i:i + _BACKFILL_BATCH_ROWS]
+            cur.execute(
+                f"SELECT dish_slug, city_id FROM Initalya.photo WHERE dish_slug IN ({', '.join(['%s'] * len(chunk))})",
+                tuple(chunk),
+            )
+            taken.update((slug, city_id) for slug, city_id in cur.fetchall() or [])
+        updates = [(key[0], photo_id) for key, photo_id in candidates.items() if key not in taken]
+        for i in range(0, len(updates), _BACKFILL_BATCH_ROWS):
+            cur.executemany("UPDATE Initalya.photo SET dish_slug = %s WHERE id = %s", updates[i:i + _BACKFILL_BATCH_ROWS])
+        conn.commit()
+        if updates:
+            logger.info(f"Migrazione Initalya.photo: dish_slug valorizzato per {len(updates)} righe")
+
+    async def startup(self) -> None:
+        """Applica la migrazione all'avvio; se il DB non è raggiungibile verrà applicata al primo uso."""
+        try:
+            await database.run(self.migrate)
+        except Exception as e:
+            logger.warning(f"Migrazione Initalya.photo rimandata: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._memory_lock:
+            return {**self._counters, "memory": self.memory.stats(), "migrated": self._migrated}
+
+
+# Istanza condivisa per il worker corrente
+photo_cache = PhotoCache(
+    max_entries=settings.photo_cache_max_entries,
+    ttl=settings.photo_cache_ttl_seconds,
+)
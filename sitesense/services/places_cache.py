@@ -0,0 +1,172 @@
+"""Cache dei risultati Google Places (find-place e place details).
+
+Due livelli:
+- LRU in memoria per worker (``TTLCache``);
+- opzionale tabella SQLite condivisa tra worker e riavvii, attiva se
+  ``PLACES_CACHE_DB`` indica il percorso del file.
+
+La durata di una voce dipende dai campi che contiene (orari e valutazioni
+cambiano spesso, nome e coordinate quasi mai). Le ricerche senza candidati
+vengono memorizzate per un tempo breve (caching negativo).
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from ..config.settings import settings
+from .ttl_cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# TTL per campo: la voce scade con il campo più volatile che contiene
+FIELD_TTLS: Dict[str, int] = {
+    "opening_hours": 6 * HOUR,
+    "rating": DAY,
+    "user_ratings_total": DAY,
+    "reviews": DAY,
+    "website": 7 * DAY,
+    "international_phone_number": 7 * DAY,
+    "formatted_phone_number": 7 * DAY,
+    "photo_url": 7 * DAY,
+    "photos": 7 * DAY,
+    "name": 30 * DAY,
+    "formatted_address": 30 * DAY,
+    "geometry": 30 * DAY,
+    "place_id": 30 * DAY,
+}
+DEFAULT_TTL = DAY
+# Ricerche senza candidati: ritenta dopo un'ora
+NEGATIVE_TTL = HOUR
+
+
+def normalize_query(query: str) -> str:
+    """Chiave stabile per una query find-place (minuscolo, spazi e punteggiatura compattati)."""
+    q = (query or "").strip().lower()
+    q = re.sub(r"[\s,;]+", " ", q)
+    return q.strip()
+
+
+def ttl_for(value: Any) -> int:
+    """TTL di una voce in base ai campi valorizzati (None = caching negativo)."""
+    if value is None:
+        return NEGATIVE_TTL
+    if not isinstance(value, dict):
+        return DEFAULT_TTL
+    ttls = [FIELD_TTLS.get(k, DEFAULT_TTL) for k, v in value.items() if v not in (None, "", [], {})]
+    return min(ttls) if ttls else NEGATIVE_TTL
+
+
+class _SQLiteTier:
+    """Livello persistente su SQLite; le operazioni girano in un thread per non bloccare il loop."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS places_cache ("
+                " cache_key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_places_cache_expires ON places_cache (expires_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=5)
+
+    def _get(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM places_cache WHERE cache_key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        if row is None:
+            return MISSING, 0.0
+        return json.loads(row[0]), row[1] - time.time()
+
+    def _set(self, key: str, value: Any, ttl: float) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO places_cache (cache_key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+            )
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+
+class PlacesCache:
+    """Cache a due livelli per le risposte Places, con contatori di utilizzo."""
+
+    def __init__(self, max_entries: int, db_path: Optional[str] = None):
+        self.memory = TTLCache(max_entries=max_entries, default_ttl=DEFAULT_TTL, name="places")
+        self.persistent: Optional[_SQLiteTier] = None
+        self._persistent_hits = 0
+        self._negative_hits = 0
+        if db_path:
+            try:
+                self.persistent = _SQLiteTier(db_path)
+                logger.info(f"Cache Places persistente attiva: {db_path}")
+            except Exception as e:
+                logger.warning(f"Cache Places persistente non disponibile ({db_path}): {e}")
+
+    async def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is MISSING and self.persistent is not None:
+            try:
+                value, remaining = await self.persistent.get(key)
+                if value is not MISSING:
+                    self._persistent_hits += 1
+                    self.memory.set(key, value, ttl=remaining)
+            except Exception as e:
+                logger.warning(f"Lettura cache Places fallita per '{key}': {e}")
+                value = MISSING
+        if value is None:
+            self._negative_hits += 1
+        return value if value is MISSING else copy.deepcopy(value)
+
+    async def set(self, key: str, value: Any) -> None:
+        ttl = ttl_for(value)
+        self.memory.set(key, copy.deepcopy(value), ttl=ttl)
+        if self.persistent is not None:
+            try:
+                await self.persistent.set(key, value, ttl)
+            except Exception as e:
+                logger.warning(f"Scrittura cache Places fallita per '{key}': {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        data = self.memory.stats()
+        data.update({
+            "persistent": self.persistent is not None,
+            "persistent_hits": self._persistent_hits,
+            "negative_hits": self._negative_hits,
+        })
+        return data
+
+
+def find_key(query: str, variant: str) -> str:
+    return f"find:{variant}:{normalize_query(query)}"
+
+
+def details_key(place_id: str, variant: str, language: str = "it") -> str:
+    return f"details:{variant}:{language}:{place_id}"
+
+
+# Istanza condivisa per il worker corrente
+places_cache = PlacesCache(
+    max_entries=settings.places_cache_max_entries,
+    db_path=settings.places_cache_db,
+)
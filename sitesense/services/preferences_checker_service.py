@@ -1,21 +1,36 @@
-from google import genai 
 from google.genai import types
 from typing import Optional, Dict, Any
 import logging
 import os
 import json
+import re
 from ..config.settings import settings
+from . import gemini_client
+from .single_flight import SingleFlight
+from .ttl_cache import MISSING, TTLCache
 
 logger = logging.getLogger(__name__)
 GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL") or os.getenv("GEMINI_MODEL") or "gemini-2.5-flash"
 
+# Preferenze già estratte per query normalizzata, condivise da tutte le istanze del worker:
+# le ricerche ripetute e i "ricarico" non rifanno la chiamata al modello
+PREFERENCES_TTL = 24 * 3600
+_preferences_cache = TTLCache(max_entries=1000, default_ttl=PREFERENCES_TTL, name="preferences")
+_preferences_flights = SingleFlight("preferences")
+
+
+def normalize_preferences_query(user_query: str) -> str:
+    """Chiave di cache: minuscolo, spazi compattati, senza punteggiatura finale."""
+    q = re.sub(r"\s+", " ", (user_query or "").strip().lower())
+    return q.rstrip(" .!?;,")
+
 class PreferencesCheckerService:
     """
     Servizio per verificare se l'utente ha prefereze, e nel caso, le recupera e le restituisce.
     """
     def __init__(self):
         logger.info("PreferencesCheckerService initialized.")
-        self.preferences_checker_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+        self.preferences_checker_client = gemini_client.get_client()
         self.preferences_checker_config = self._setup_preferences_checker_config()
         self.debug_mode = settings.debug_mode
 
@@ -109,21 +124,33 @@ Analizza attentamente la richiesta e fornisci solo l'output JSON."""
     async def check_preferences(self, user_query: str) -> Optional[str]:
         """
         Verifica se l'utente ha delle preferenze specifiche.
+        Il risultato è memorizzato per query normalizzata; richieste contemporanee
+        per la stessa query attendono un'unica chiamata al modello.
         """
+        key = normalize_preferences_query(user_query)
+        cached = _preferences_cache.get(key)
+        if cached is not MISSING:
+            logger.info("Preferenze dell'utente recuperate dalla cache.")
+            return cached
+
+        # Se il chiamante viene annullato la chiamata prosegue e popola comunque la cache
+        return await _preferences_flights.do(key, lambda: self._fetch_preferences(key, user_query))
+
+    async def _fetch_preferences(self, key: str, user_query: str) -> Optional[str]:
         logger.info("Verifica delle preferenze dell'utente...")
         try:
-            preferences_chat = self.preferences_checker_client.chats.create(
+            preferences_chat = gemini_client.create_chat(
                 model=GEMINI_MODEL,
                 config=self.preferences_checker_config
             )
-            response = preferences_chat.send_message(user_query)
+            response = await gemini_client.send_message(preferences_chat, user_query)
+            _preferences_cache.set(key, response.text)
             return response.text
         except Exception as e:
-            # Non bloccare la pipeline: usa fallback coerente
+            # Non bloccare la pipeline: usa fallback coerente (non memorizzato, si ritenta alla prossima ricerca)
             logger.warning(f"Preferenze: errore durante la chiamata al modello ({type(e).__name__}): {e}. Uso fallback.")
-            # In debug possiamo anche loggare più dettagli o leggere da cache locale in futuro
             return self._fallback_preferences(user_query)
 
-
-
-
+    @staticmethod
+    def cache_stats() -> Dict[str, Any]:
+        return {**_preferences_cache.stats(), "flights": _preferences_flights.stats()}
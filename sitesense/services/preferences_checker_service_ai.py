@@ -3,6 +3,7 @@ from google.genai import types
 from typing import Optional
 import logging
 import os
+from . import gemini_client
 
 logger = logging.getLogger(__name__)
 GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL") or os.getenv("GEMINI_MODEL") or "gemini-2.5-flash"
@@ -13,7 +14,7 @@ class PreferencesCheckerService:
     """
     def __init__(self):
         logger.info("PreferencesCheckerService initialized.")
-        self.preferences_checker_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+        self.preferences_checker_client = gemini_client.get_client()
         self.preferences_checker_config = self._setup_preferences_checker_config()
 
     def _setup_preferences_checker_config(self) -> types.GenerateContentConfig:
@@ -82,11 +83,11 @@ Analizza attentamente la richiesta e fornisci solo l'output JSON."""
         Verifica se l'utente ha delle preferenze specifiche.
         """
         logger.info("Verifica delle preferenze dell'utente...")
-        preferences_chat = self.preferences_checker_client.chats.create(
+        preferences_chat = gemini_client.create_chat(
             model=GEMINI_MODEL,
             config=self.preferences_checker_config
         )
-        response = preferences_chat.send_message(user_query)
+        response = await gemini_client.send_message(preferences_chat, user_query)
         return response.text
 
 
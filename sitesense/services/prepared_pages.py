@@ -0,0 +1,142 @@
+"""Pagine HTML che cambiano solo con il deploy (Chi Siamo e pagine del design).
+
+Il contenuto viene costruito una volta (lettura del file, riscritture regex,
+rendering del template) e tenuto in memoria insieme a:
+- ETag forte calcolato sul contenuto;
+- varianti precompresse gzip e, se il pacchetto ``brotli`` è installato, br.
+
+La pagina viene ricostruita solo quando cambia mtime o dimensione di uno dei
+file da cui dipende. ``page_response`` sceglie la codifica in base ad
+Accept-Encoding e risponde 304 se il browser ha già la stessa versione.
+"""
+
+import gzip
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Facoltativo: senza brotli si servono solo gzip e identity
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Sotto questa dimensione la compressione non conviene
+_MIN_COMPRESS_BYTES = 512
+_GZIP_LEVEL = 9
+_BROTLI_QUALITY = 11
+
+
+class PreparedPage:
+    """Contenuto di una pagina con ETag e varianti compresse."""
+
+    def __init__(self, content: str, media_type: str = "text/html; charset=utf-8"):
+        self.body = content.encode("utf-8")
+        self.media_type = media_type
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:32] + '"'
+        # codifica -> byte compressi (solo se più piccoli dell'originale)
+        self.encoded: Dict[str, bytes] = {}
+        if len(self.body) >= _MIN_COMPRESS_BYTES:
+            # mtime=0: stessa pagina, stessi byte (e stesso ETag) a ogni ricostruzione
+            self._add("gzip", gzip.compress(self.body, compresslevel=_GZIP_LEVEL, mtime=0))
+            if brotli is not None:
+                self._add("br", brotli.compress(self.body, quality=_BROTLI_QUALITY))
+
+    def _add(self, encoding: str, data: bytes) -> None:
+        if len(data) < len(self.body):
+            self.encoded[encoding] = data
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """ETag della rappresentazione: ogni codifica ha il suo, come richiesto per gli ETag forti."""
+        return self.etag if not encoding else f'{self.etag[:-1]}-{encoding}"'
+
+
+def preferred_encoding(accept_encoding: Optional[str], available: Sequence[str]) -> Optional[str]:
+    """Codifica migliore tra quelle disponibili accettate dal client (br prima di gzip)."""
+    if not accept_encoding or not available:
+        return None
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class PreparedPages:
+    """Pagine preparate per chiave, invalidate su mtime/dimensione dei file sorgente."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages: Dict[Hashable, Tuple[tuple, PreparedPage]] = {}
+        self._counters = {"hits": 0, "builds": 0}
+
+    @staticmethod
+    def _signature(sources: Sequence[Path]) -> tuple:
+        sig = []
+        for path in sources:
+            try:
+                st = path.stat()
+                sig.append((str(path), st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append((str(path), None, None))
+        return tuple(sig)
+
+    def get(self, key: Hashable, sources: Sequence[Path], build: Callable[[], str]) -> PreparedPage:
+        """Pagina per ``key``; ``build`` viene chiamata solo se uno dei ``sources`` è cambiato."""
+        signature = self._signature(sources)
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached is not None and cached[0] == signature:
+                self._counters["hits"] += 1
+                return cached[1]
+        page = PreparedPage(build())
+        with self._lock:
+            self._pages[key] = (signature, page)
+            self._counters["builds"] += 1
+        logger.info(f"Pagina {key} preparata: {len(page.body)} byte, varianti {sorted(page.encoded) or '-'}")
+        return page
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "pages": len(self._pages)}
+
+
+def page_response(page: PreparedPage, request: Optional[Request], vary: Sequence[str] = ()) -> Response:
+    """Risposta con ETag e Cache-Control: no-cache (rivalidazione); 304 se l'ETag corrisponde."""
+    encoding = preferred_encoding(request.headers.get("accept-encoding") if request is not None else None, list(page.encoded))
+    etag = page.etag_for(encoding)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Vary": ", ".join(["Accept-Encoding", *vary]),
+    }
+    if request is not None:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            if "*" in tags or etag in tags or f"W/{etag}" in tags:
+                return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return Response(content=page.encoded[encoding], media_type=page.media_type, headers=headers)
+    return Response(content=page.body, media_type=page.media_type, headers=headers)
+
+
+# Istanza condivisa per il worker corrente
+prepared_pages = PreparedPages()
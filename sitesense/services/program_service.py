@@ -9,11 +9,11 @@ import logging
 import re
 from typing import Dict, Optional
 import os
-from google import genai
 from google.genai import types
 
 from ..config.settings import settings
 from .google_maps_service import GoogleMapsService
+from . import gemini_client
 
 logger = logging.getLogger(__name__)
 GEMINI_MODEL = os.getenv("GEMINI_CHAT_BOT_MODEL")
@@ -23,10 +23,10 @@ class ProgramService:
     """Servizio per analizzare il contenuto generato e determinare le azioni successive."""
 
     def __init__(self, html):
-        self.client = genai.Client(api_key=settings.gemini_api_key)
+        self.client = gemini_client.get_client()
         self.html = html
         self.config = self.generateConfig()
-        self.chat = self.client.chats.create(model=GEMINI_MODEL, config=self.config)
+        self.chat = gemini_client.create_chat(model=GEMINI_MODEL, config=self.config)
         
         
 
@@ -85,7 +85,8 @@ Assistant: "Il sistema di Initalya permette di creare un percorso a tappe sulla
 User: "Come arrivo all'enoteca?"
 Assistant: "Ecco le indicazioni per raggiungere l'Enoteca Il Grappolo: [Link Google Maps]"
 
-        
+
+DATI DEL PROGRAMMA:
         """ + self.html
 
 
@@ -93,14 +94,14 @@ Assistant: "Ecco le indicazioni per raggiungere l'Enoteca Il Grappolo: [Link Goo
 
   
 
-    def getResponse(self, prompt: str) -> str:
+    async def getResponse(self, prompt: str) -> str:
         """Restituisce la risposta dall'analyzer client"""
         try:
             # Se il client o il modello non sono configurati, rispondi con fallback locale
             if not settings.gemini_api_key or not GEMINI_MODEL or not getattr(self, 'chat', None):
                 return self._localFallback(prompt)
 
-            response = self.chat.send_message(prompt)
+            response = await gemini_client.send_message(self.chat, prompt)
             text = getattr(response, 'text', '') or ''
             if not text.strip():
                 return self._localFallback(prompt)
@@ -0,0 +1,383 @@
+"""Accesso ai dati di Initalya (utenti, programmi, locali, città, tipologie).
+
+Raccoglie in un unico posto le query SQL usate dai gestori HTTP:
+- ogni query gira su statement preparati, memorizzati per connessione del pool
+  e riutilizzati dalle richieste successive;
+- un ``Repository`` vive per una sola richiesta e tiene una mappa di identità,
+  così la stessa riga (es. l'utente corrente) viene letta una volta sola.
+
+Uso dai gestori asincroni::
+
+    def _work(repo):
+        user_id = repo.get_user_id(email)
+        ...
+    result = await repository.run(_work)
+
+``repo`` è None se il database non è disponibile. Le scritture composte
+(programma + locali) vanno in ``with repo.transaction(...)``: commit o rollback
+unico e durata misurata nei log.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from mysql.connector import errors
+
+from ..config.settings import settings
+from . import database
+from .city_index import city_index
+from .schema_registry import is_schema_change, schema_registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Statement preparati tenuti aperti per singola connessione
+_MAX_STATEMENTS_PER_CONNECTION = 64
+# Errore MySQL "Unknown prepared statement handler": la connessione è stata riaperta
+_ER_UNKNOWN_STMT_HANDLER = 1243
+# Righe per singolo INSERT multi-riga dei locali (resta ben sotto max_allowed_packet)
+_INSERT_BATCH_ROWS = 500
+
+_statements: "weakref.WeakKeyDictionary[Any, OrderedDict]" = weakref.WeakKeyDictionary()
+_statements_lock = threading.Lock()
+
+
+def normalize_city_name(city: Optional[str]) -> str:
+    """Nome città senza provincia, sigla o 'Italia' (es. 'Bari, BA, Italia' -> 'Bari')."""
+    t = (city or "").strip()
+    if not t or t.lower() == "none":
+        return ""
+    t = re.sub(r",.*$", "", t)
+    t = re.sub(r"\s+[A-Z]{2}$", "", t)
+    t = re.sub(r"\b(italia|italy)\b", "", t, flags=re.I)
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def place_id_for(loc: Dict[str, Any]) -> str:
+    """place_id del locale, estratto dall'URL Maps o derivato da nome e indirizzo."""
+    pid = (loc.get("place_id") or "").strip()
+    if not pid:
+        m = re.search(r"place_id:([^&]+)", loc.get("url") or "")
+        pid = m.group(1).strip() if m else ""
+    if not pid:
+        base = f"{loc.get('name','').strip()}|{loc.get('address','').strip()}"
+        pid = f"manual_{hashlib.md5(base.encode('utf-8')).hexdigest()[:16]}"
+    return pid
+
+
+def _raw_connection(conn) -> Any:
+    # Le connessioni del pool sono involucri ricreati a ogni prelievo: la cache va sulla connessione reale
+    return getattr(conn, "_cnx", None) or conn
+
+
+class Repository:
+    """Query tipizzate su una connessione del pool, con mappa di identità per richiesta."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._identity: Dict[tuple, Any] = {}
+        # Città inserite e non ancora confermate: entrano nell'indice in memoria solo dopo il commit
+        self._pending_cities: List[tuple] = []
+
+    # --- esecuzione ---------------------------------------------------------
+
+    def _statement_cache(self) -> OrderedDict:
+        raw = _raw_connection(self.conn)
+        with _statements_lock:
+            cache = _statements.get(raw)
+            if cache is None:
+                cache = OrderedDict()
+                _statements[raw] = cache
+        return cache
+
+    def _cursor(self, sql: str):
+        cache = self._statement_cache()
+        cur = cache.get(sql)
+        if cur is None:
+            cur = self.conn.cursor(prepared=True)
+            cache[sql] = cur
+            while len(cache) > _MAX_STATEMENTS_PER_CONNECTION:
+                _, old = cache.popitem(last=False)
+                try:
+                    old.close()
+                except Exception:
+                    pass
+        else:
+            cache.move_to_end(sql)
+        return cur
+
+    def _run(self, sql: str, params: Sequence[Any]):
+        cur = self._cursor(sql)
+        try:
+            cur.execute(sql, tuple(params))
+        except errors.Error as e:
+            if getattr(e, "errno", None) != _ER_UNKNOWN_STMT_HANDLER:
+                raise
+            # Connessione riaperta dal pool: gli statement preparati non esistono più
+            self._statement_cache().clear()
+            cur = self._cursor(sql)
+            cur.execute(sql, tuple(params))
+        return cur
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        cur = self._run(sql, params)
+        rows = cur.fetchall() or []
+        columns = cur.column_names
+        return [dict(zip(columns, row)) for row in rows]
+
+    def query_one(self, sql: str, params: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Esegue un comando e restituisce lastrowid (per gli INSERT) o il numero di righe."""
+        cur = self._run(sql, params)
+        return cur.lastrowid or cur.rowcount
+
+    def _with_schema_retry(self, write: Callable[[], T]) -> T:
+        """Esegue una scrittura dipendente dallo schema; se lo schema in cache non è più
+        valido (colonna o tabella inesistente) lo ricarica e riprova una volta."""
+        try:
+            return write()
+        except errors.Error as e:
+            if not is_schema_change(e):
+                raise
+            logger.warning(f"Schema Initalya cambiato ({e}): ricarico la mappatura delle colonne")
+            schema_registry.invalidate()
+            return write()
+
+    def _cached(self, key: tuple, loader: Callable[[], T]) -> T:
+        if key not in self._identity:
+            self._identity[key] = loader()
+        return self._identity[key]
+
+    def commit(self) -> None:
+        self.conn.commit()
+        pending, self._pending_cities = self._pending_cities, []
+        for city_id, name in pending:
+            city_index.add(city_id, name)
+
+    def rollback(self) -> None:
+        # Le città inserite nella transazione annullata non esistono più
+        for _city_id, name in self._pending_cities:
+            self._identity.pop(("city_match", name), None)
+        self._pending_cities = []
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+
+    @contextmanager
+    def transaction(self, label: str):
+        """Blocco eseguito in un'unica transazione: commit all'uscita, rollback se solleva.
+        La durata viene registrata e segnalata se supera ``DB_SLOW_TRANSACTION_MS``."""
+        start = time.perf_counter()
+        try:
+            yield self
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms > settings.db_slow_transaction_ms:
+                logger.warning(f"Transazione '{label}' lenta: {elapsed_ms:.1f}ms")
+            else:
+                logger.info(f"Transazione '{label}': {elapsed_ms:.1f}ms")
+
+    # --- utenti ---------------------------------------------------------------
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return self._cached(("user", email), lambda: self.query_one(
+            "SELECT id, name, surname, email, profile_image FROM Initalya.users WHERE email = %s",
+            (email,),
+        ))
+
+    def get_user_id(self, email: str) -> Optional[int]:
+        user = self.get_user_by_email(email)
+        return user["id"] if user else None
+
+    # --- città ------------------------------------------------------------------
+
+    def get_city_name(self, city_id: int) -> str:
+        row = self._cached(("city_name", city_id), lambda: self.query_one(
+            "SELECT name FROM Initalya.cities WHERE id = %s", (city_id,)
+        ))
+        return row["name"] if row else ""
+
+    def find_city_id(self, name: str) -> Optional[int]:
+        """Id della città con nome esatto."""
+        row = self._cached(("city_id", name), lambda: self.query_one(
+            "SELECT id FROM Initalya.cities WHERE name = %s LIMIT 1", (name,)
+        ))
+        return row["id"] if row else None
+
+    def match_city_id(self, name: str) -> Optional[int]:
+        """Id della città: prima dall'indice in memoria (senza distinzione di maiuscole e accenti),
+        poi sul database anche per corrispondenza parziale."""
+        city = city_index.resolve(name)
+        if city is not None:
+            return city[0]
+
+        def load():
+            row = self.query_one("SELECT id FROM Initalya.cities WHERE LOWER(name) = LOWER(%s)", (name,))
+            if not row:
+                row = self.query_one("SELECT id FROM Initalya.cities WHERE name LIKE %s", (f"%{name}%",))
+            return row["id"] if row else None
+        return self._cached(("city_match", name), load)
+
+    def get_or_create_city_id(self, name: str) -> int:
+        city_id = self.match_city_id(name)
+        if city_id is None:
+            city_id = self.execute("INSERT INTO Initalya.cities (name) VALUES (%s)", (name,))
+            self._identity[("city_match", name)] = city_id
+            self._pending_cities.append((city_id, name))
+        return city_id
+
+    # --- programmi ----------------------------------------------------------------
+
+    def get_program(self, program_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        """Programma se appartiene all'utente, altrimenti None."""
+        return self._cached(("program", program_id, user_id), lambda: self.query_one(
+            "SELECT * FROM Initalya.programs WHERE id = %s AND user_id = %s", (program_id, user_id)
+        ))
+
+    def list_program_locals(self, program_id: int) -> List[Dict[str, Any]]:
+        return self.query(
+            """
+            SELECT
+                l.place_id,
+                l.name,
+                l.address,
+                COALESCE(t.typology, '') AS type,
+                l.lat,
+                l.lng,
+                l.image,
+                l.rating
+            FROM Initalya.locals l
+            LEFT JOIN Initalya.types t ON l.type_id = t.id
+            WHERE l.program_id = %s
+            ORDER BY l.id ASC
+            """,
+            (program_id,),
+        )
+
+    def get_program_with_locals(self, program_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        """Programma dell'utente con nome della città e locali salvati (None se non trovato)."""
+        program = self.get_program(program_id, user_id)
+        if not program:
+            return None
+        city_name = self.get_city_name(program["city_id"]) if program.get("city_id") else ""
+        return {"program": program, "city_name": city_name, "locals": self.list_program_locals(program_id)}
+
+    def _city_assignment(self, city: Optional[str]) -> Dict[str, Any]:
+        """Colonna e valore della città per programs, secondo lo schema disponibile."""
+        schema = schema_registry.programs(self.conn)
+        if schema.has_city_id:
+            return {"city_id": self.get_or_create_city_id(normalize_city_name(city) or "Non specificata")}
+        if schema.has_city:
+            return {"city": city or ""}
+        return {}
+
+    def create_program(self, user_id: int, num_locali: int, city: Optional[str]) -> int:
+        def write():
+            values = {"user_id": user_id, "num_locali": num_locali, **self._city_assignment(city)}
+            placeholders = ", ".join(["%s"] * len(values))
+            return self.execute(
+                f"INSERT INTO Initalya.programs ({', '.join(values)}) VALUES ({placeholders})",
+                tuple(values.values()),
+            )
+        return self._with_schema_retry(write)
+
+    def update_program(self, program_id: int, user_id: int, num_locali: int, city: Optional[str]) -> None:
+        def write():
+            values = {**(self._city_assignment(city) if city is not None else {}), "num_locali": num_locali}
+            assignments = ", ".join(f"{column} = %s" for column in values)
+            self.execute(
+                f"UPDATE Initalya.programs SET {assignments} WHERE id = %s AND user_id = %s",
+                (*values.values(), program_id, user_id),
+            )
+        self._with_schema_retry(write)
+
+    def delete_program(self, program_id: int, user_id: int) -> None:
+        # ON DELETE CASCADE rimuove anche i locali
+        self.execute("DELETE FROM Initalya.programs WHERE id = %s AND user_id = %s", (program_id, user_id))
+
+    # --- locali ---------------------------------------------------------------------
+
+    def get_type_id(self, typology: str) -> int:
+        """Id della tipologia; se sconosciuta 'ristoranti', altrimenti 1."""
+        types = schema_registry.types(self.conn)
+        return types.get(typology.strip().lower()) or types.get("ristoranti") or 1
+
+    def _insert_rows(self, table: str, columns: List[str], rows: List[tuple]) -> None:
+        """INSERT multi-riga: executemany di mysql.connector li unisce in un solo statement."""
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        cur = self.conn.cursor()
+        try:
+            for i in range(0, len(rows), _INSERT_BATCH_ROWS):
+                cur.executemany(sql, rows[i:i + _INSERT_BATCH_ROWS])
+        finally:
+            cur.close()
+
+    def insert_locals(self, program_id: int, locali: List[Dict[str, Any]]) -> None:
+        """Inserisce i locali di un programma, secondo le colonne presenti in Initalya.locals,
+        con un solo INSERT multi-riga."""
+        def write():
+            schema = schema_registry.locals(self.conn)
+            columns = [schema.program_col, schema.name_col, schema.address_col]
+            optional = [schema.type_col, schema.place_col, schema.lat_col, schema.lng_col, schema.image_col, schema.rating_col]
+            columns += [c for c in optional if c]
+
+            rows = []
+            for loc in locali:
+                values: Dict[str, Any] = {
+                    schema.program_col: program_id,
+                    schema.name_col: loc.get("name") or "",
+                    schema.address_col: loc.get("address") or "",
+                }
+                if schema.type_col == "type_id":
+                    values[schema.type_col] = self.get_type_id(loc.get("type") or "")
+                elif schema.type_col:
+                    values[schema.type_col] = loc.get("type") or ""
+                if schema.place_col:
+                    values[schema.place_col] = place_id_for(loc)
+                if schema.lat_col:
+                    values[schema.lat_col] = loc.get("lat")
+                if schema.lng_col:
+                    values[schema.lng_col] = loc.get("lng")
+                if schema.image_col:
+                    img = loc.get("image") or loc.get("photo") or loc.get("photo_url") or ""
+                    if isinstance(img, str) and schema.image_max_length and len(img) > schema.image_max_length:
+                        img = img[:schema.image_max_length]
+                    values[schema.image_col] = img
+                if schema.rating_col:
+                    values[schema.rating_col] = loc.get("rating")
+                rows.append(tuple(values[c] for c in columns))
+
+            if rows:
+                self._insert_rows("Initalya.locals", columns, rows)
+        self._with_schema_retry(write)
+
+    def replace_locals(self, program_id: int, locali: List[Dict[str, Any]]) -> None:
+        def delete():
+            program_col = schema_registry.locals(self.conn).program_col
+            self.execute(f"DELETE FROM Initalya.locals WHERE {program_col} = %s", (program_id,))
+        self._with_schema_retry(delete)
+        self.insert_locals(program_id, locali)
+
+
+async def run(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Esegue ``fn(repo, *args, **kwargs)`` in un thread con un Repository nuovo
+    (None se il database non è disponibile)."""
+    def _with_repository(conn):
+        return fn(Repository(conn) if conn else None, *args, **kwargs)
+    return await database.run(_with_repository)
@@ -0,0 +1,114 @@
+"""Cache dei risultati completi della prima ricerca (contenuto, query Maps, risultati classificati).
+
+Le richieste reali sono in gran parte varianti della stessa domanda
+("cosa mangiare a Bari", "piatti tipici Bari"): la chiave è quindi una forma
+canonica della query, ottenuta così:
+- minuscolo, senza accenti e punteggiatura;
+- località riconosciuta tramite il gazetteer offline e tolta dal testo;
+- parole vuote rimosse e sinonimi generici di "cucina" ricondotti a un solo termine;
+- termini ordinati e senza ripetizioni;
+più la modalità (ricerca / programma di viaggio).
+
+La località viene dal gazetteer (nessuna chiamata al modello), così la ricerca
+in cache non ritarda le richieste che non la trovano. Le voci vivono in una LRU
+in memoria con TTL e numero massimo di elementi.
+"""
+
+import copy
+import logging
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config.settings import settings
+from .geocode_service import geocode_service
+from .ttl_cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Nomi di località composti da al massimo tante parole (es. "reggio nell emilia")
+_MAX_PLACE_WORDS = 4
+
+_STOPWORDS = {
+    "a", "ad", "al", "alla", "alle", "ai", "agli", "all", "il", "lo", "la", "i", "gli", "le", "l",
+    "un", "uno", "una", "di", "del", "della", "delle", "dei", "degli", "dell", "da", "dal", "dalla",
+    "in", "nel", "nella", "nei", "nelle", "su", "sul", "sulla", "per", "con", "tra", "fra", "e", "ed",
+    "o", "che", "cosa", "cose", "quali", "quale", "qual", "dove", "come", "mi", "ci", "si", "vorrei",
+    "voglio", "cerco", "consigli", "consigliami", "suggerisci", "suggeriscimi", "dimmi", "posso",
+    "puoi", "sono", "citta", "zona", "vicino", "oggi", "the", "of", "what", "to",
+}
+
+# Termini che, in questo dominio, esprimono la stessa intenzione di ricerca
+_SYNONYMS = {
+    "mangiare": "cucina", "mangia": "cucina", "piatti": "cucina", "piatto": "cucina",
+    "tipici": "cucina", "tipico": "cucina", "tipiche": "cucina", "tipica": "cucina",
+    "tradizionali": "cucina", "tradizionale": "cucina", "specialita": "cucina",
+    "cibo": "cucina", "cibi": "cucina", "gastronomia": "cucina", "enogastronomia": "cucina",
+    "food": "cucina", "eat": "cucina", "assaggiare": "cucina", "provare": "cucina", "locale": "cucina", "locali": "cucina",
+    "vino": "vini", "cantine": "vini", "cantina": "vini", "enoteche": "vini", "enoteca": "vini",
+    "dolce": "dolci", "dessert": "dolci", "pasticcerie": "dolci", "pasticceria": "dolci",
+    "alberghi": "hotel", "albergo": "hotel", "dormire": "hotel", "alloggi": "hotel", "alloggio": "hotel",
+}
+
+
+def _normalize_text(text: str) -> List[str]:
+    s = unicodedata.normalize("NFD", text or "")
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn").lower()
+    return re.sub(r"[^a-z0-9]+", " ", s).split()
+
+
+def _find_location(words: List[str]) -> Tuple[Optional[str], List[str]]:
+    """Cerca nel testo il nome di una località del gazetteer (prima i nomi più lunghi).
+    Restituisce (località normalizzata, parole rimanenti)."""
+    gazetteer = geocode_service.gazetteer
+    for size in range(min(_MAX_PLACE_WORDS, len(words)), 0, -1):
+        for start in range(len(words) - size + 1):
+            candidate = " ".join(words[start:start + size])
+            if candidate in gazetteer:
+                return candidate, words[:start] + words[start + size:]
+    return None, words
+
+
+def canonical_query(user_message: str) -> Tuple[Optional[str], str]:
+    """(località riconosciuta o None, forma canonica della richiesta)."""
+    words = _normalize_text(user_message)
+    location, rest = _find_location(words)
+    terms = {_SYNONYMS.get(w, w) for w in rest if w not in _STOPWORDS}
+    return location, " ".join(sorted(terms))
+
+
+class ResultCache:
+    """Cache LRU con TTL dei risultati completi di una prima ricerca."""
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.memory = TTLCache(max_entries=max_entries, default_ttl=ttl, name="results")
+
+    @staticmethod
+    def key_for(user_message: Any, mode: str) -> Optional[str]:
+        if not isinstance(user_message, str) or not user_message.strip():
+            return None
+        location, canonical = canonical_query(user_message)
+        if not canonical and not location:
+            return None
+        return f"{mode}|{location or ''}|{canonical}"
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if key is None:
+            return None
+        value = self.memory.get(key)
+        return None if value is MISSING else copy.deepcopy(value)
+
+    def set(self, key: Optional[str], entry: Dict[str, Any]) -> None:
+        if key is None:
+            return
+        self.memory.set(key, copy.deepcopy(entry))
+
+    def stats(self) -> Dict[str, Any]:
+        return self.memory.stats()
+
+
+# Istanza condivisa per il worker corrente
+result_cache = ResultCache(
+    max_entries=settings.result_cache_max_entries,
+    ttl=settings.result_cache_ttl_seconds,
+)
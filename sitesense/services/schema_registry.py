@@ -0,0 +1,166 @@
+"""Schema di Initalya.programs e Initalya.locals e tabella delle tipologie, letti una volta e condivisi.
+
+Le installazioni esistenti hanno varianti di schema (``city`` o ``city_id`` su
+programs, nomi italiani o inglesi delle colonne di locals, colonne opzionali
+per coordinate, immagine e rating). La mappatura viene risolta con una sola
+query su INFORMATION_SCHEMA all'avvio (o al primo uso) e riusata da tutti i
+salvataggi; si ricarica con ``invalidate()``, chiamato anche quando una query
+fallisce per colonna o tabella inesistente. Allo stesso modo la tabella
+``types`` (poche righe, cambia di rado) è tenuta in memoria come mappa
+tipologia -> id, così l'inserimento dei locali non la interroga riga per riga.
+"""
+
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from mysql.connector import errors
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = "Initalya"
+# Errori MySQL che indicano uno schema diverso da quello in cache
+# (1054 colonna sconosciuta, 1146 tabella inesistente)
+SCHEMA_CHANGE_ERRNOS = {1054, 1146}
+DEFAULT_IMAGE_MAX_LENGTH = 512
+
+PROGRAM_COLUMN_CANDIDATES = ["program_id", "programma_id", "programId", "program", "id_programma"]
+
+
+def _first(columns: Dict[str, Dict], *candidates: str) -> Optional[str]:
+    return next((c for c in candidates if c in columns), None)
+
+
+class ProgramsSchema:
+    """Colonne opzionali di Initalya.programs."""
+
+    def __init__(self, columns: Dict[str, Dict]):
+        self.has_city_id = "city_id" in columns
+        self.has_city = "city" in columns
+
+
+class LocalsSchema:
+    """Nomi effettivi delle colonne di Initalya.locals (None se la colonna non esiste)."""
+
+    def __init__(self, columns: Dict[str, Dict]):
+        self.program_col = _first(columns, *PROGRAM_COLUMN_CANDIDATES) or "program_id"
+        self.name_col = _first(columns, "name", "nome") or "name"
+        self.address_col = _first(columns, "address", "indirizzo") or "address"
+        self.type_col = _first(columns, "type_id", "type")
+        self.place_col = _first(columns, "place_id")
+        self.lat_col = _first(columns, "lat", "latitude")
+        self.lng_col = _first(columns, "lng", "longitude", "long")
+        self.image_col = _first(columns, "image", "photo", "photo_url")
+        self.rating_col = _first(columns, "rating")
+        # Lunghezza massima dell'immagine: None per le colonne TEXT (nessun troncamento)
+        self.image_max_length: Optional[int] = DEFAULT_IMAGE_MAX_LENGTH
+        info = columns.get(self.image_col) if self.image_col else None
+        if info:
+            if str(info.get("data_type") or "").lower().endswith("text"):
+                self.image_max_length = None
+            elif info.get("max_length"):
+                self.image_max_length = int(info["max_length"])
+
+
+class SchemaRegistry:
+    """Cache thread-safe della mappatura delle colonne, caricata alla prima richiesta."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schemas: Optional[Tuple[ProgramsSchema, LocalsSchema]] = None
+        self._types: Optional[Dict[str, int]] = None
+        self._loads = 0
+
+    def _load(self, conn) -> Tuple[ProgramsSchema, LocalsSchema]:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH "
+                "FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ('programs', 'locals')",
+                (SCHEMA,),
+            )
+            rows = cur.fetchall() or []
+        finally:
+            cur.close()
+        tables: Dict[str, Dict[str, Dict]] = {"programs": {}, "locals": {}}
+        for table, column, data_type, max_length in rows:
+            tables.setdefault(table, {})[column] = {"data_type": data_type, "max_length": max_length}
+        self._loads += 1
+        logger.info(
+            f"Schema Initalya caricato: programs={sorted(tables['programs'])}, locals={sorted(tables['locals'])}"
+        )
+        return ProgramsSchema(tables["programs"]), LocalsSchema(tables["locals"])
+
+    def _snapshot(self, conn) -> Tuple[ProgramsSchema, LocalsSchema]:
+        snapshot = self._schemas
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self._schemas is None:
+                try:
+                    self._schemas = self._load(conn)
+                except errors.Error as e:
+                    # Come in passato: si procede con i nomi di default, senza memorizzarli
+                    logger.warning(f"Lettura schema Initalya fallita: {e}")
+                    return ProgramsSchema({}), LocalsSchema({})
+            return self._schemas
+
+    def programs(self, conn) -> ProgramsSchema:
+        return self._snapshot(conn)[0]
+
+    def locals(self, conn) -> LocalsSchema:
+        return self._snapshot(conn)[1]
+
+    def types(self, conn) -> Dict[str, int]:
+        """Mappa tipologia (minuscolo) -> id di Initalya.types."""
+        types = self._types
+        if types is not None:
+            return types
+        with self._lock:
+            if self._types is None:
+                cur = conn.cursor()
+                try:
+                    cur.execute("SELECT id, typology FROM Initalya.types")
+                    rows = cur.fetchall() or []
+                except errors.Error as e:
+                    logger.warning(f"Lettura tipologie Initalya fallita: {e}")
+                    return {}
+                finally:
+                    cur.close()
+                self._types = {str(typology).strip().lower(): type_id for type_id, typology in rows if typology}
+                logger.info(f"Tipologie Initalya caricate: {len(self._types)}")
+            return self._types
+
+    def invalidate(self) -> None:
+        """Forza la rilettura di schema e tipologie al prossimo uso."""
+        with self._lock:
+            self._schemas = None
+            self._types = None
+
+    async def startup(self) -> None:
+        """Carica lo schema all'avvio; se il DB non è raggiungibile verrà caricato al primo uso."""
+        def _warm(conn):
+            if conn:
+                self._snapshot(conn)
+                self.types(conn)
+        try:
+            await database.run(_warm)
+        except Exception as e:
+            logger.warning(f"Caricamento schema Initalya rimandato: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "loads": self._loads,
+            "loaded": int(self._schemas is not None),
+            "types": len(self._types or {}),
+        }
+
+
+def is_schema_change(error: Exception) -> bool:
+    return isinstance(error, errors.Error) and getattr(error, "errno", None) in SCHEMA_CHANGE_ERRNOS
+
+
+# Istanza condivisa per il worker corrente
+schema_registry = SchemaRegistry()
@@ -0,0 +1,125 @@
+"""Punteggio, selezione top-k e filtro per distanza dei risultati Places.
+
+Condiviso dalle varianti di ``FilteringRankingService`` e da ``GoogleMapsService``.
+I risultati di una categoria vengono trasformati in colonne (rating, recensioni,
+lat, lng) e valutati in un'unica passata vettoriale con NumPy (in requirements.txt);
+il percorso per singola attività resta solo come ripiego se NumPy manca.
+La selezione dei migliori usa una top-k parziale invece di un ordinamento completo.
+"""
+
+import heapq
+import logging
+import math
+from array import array
+from typing import Any, Dict, List, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # ripiego per singola attività
+    np = None
+
+logger = logging.getLogger(__name__)
+if np is None:
+    logger.warning("Scoring: NumPy non installato, punteggi e distanze calcolati per singola attività")
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _to_reviews(value: Any) -> int:
+    try:
+        reviews = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return reviews if reviews > 0 else 0
+
+
+def quality_score(activity: Dict[str, Any]) -> float:
+    """Punteggio di qualità di una singola attività: rating x log10(recensioni + 1)."""
+    rating = _to_float(activity.get("rating"))
+    reviews = _to_reviews(activity.get("user_ratings_total"))
+    return rating * math.log10(reviews + 1)
+
+
+def quality_scores(activities: Sequence[Dict[str, Any]]) -> List[float]:
+    """Punteggi di qualità per un lotto di attività, nello stesso ordine."""
+    if np is None:
+        return [quality_score(a) for a in activities]
+    ratings = np.fromiter((_to_float(a.get("rating")) for a in activities), dtype=np.float64, count=len(activities))
+    reviews = np.fromiter((_to_reviews(a.get("user_ratings_total")) for a in activities), dtype=np.float64, count=len(activities))
+    return (ratings * np.log10(reviews + 1.0)).tolist()
+
+
+def top_k_indices(scores: Sequence[float], k: int) -> List[int]:
+    """Indici dei k punteggi più alti in ordine decrescente.
+    A parità di punteggio vince l'ordine originale, come con sorted(..., reverse=True)."""
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    if np is not None:
+        arr = np.asarray(scores, dtype=np.float64)
+        # Soglia del k-esimo valore, poi ordinamento stabile dei soli candidati
+        kth = np.partition(arr, n - k)[n - k]
+        candidates = np.flatnonzero(arr >= kth)
+        order = candidates[np.argsort(-arr[candidates], kind="stable")]
+        return order[:k].tolist()
+    return heapq.nsmallest(k, range(n), key=lambda i: (-scores[i], i))
+
+
+def rank_top_k(activities: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """Assegna 'quality_score' a ogni attività e restituisce le k migliori, ordinate."""
+    scores = quality_scores(activities)
+    for activity, score in zip(activities, scores):
+        activity["quality_score"] = score
+    top = [activities[i] for i in top_k_indices(scores, k)]
+    summary = ", ".join(f"{a.get('name')}={a['quality_score']:.2f}" for a in top)
+    logger.info(f"Ranking: selezionate {len(top)} attività su {len(activities)} ({summary})")
+    return top
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Distanza in km tra due punti (formula dell'emisenoverso)."""
+    lat1_rad, lng1_rad, lat2_rad, lng2_rad = map(math.radians, (lat1, lng1, lat2, lng2))
+    dlat = lat2_rad - lat1_rad
+    dlng = lng2_rad - lng1_rad
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def distances_km(ref_lat: float, ref_lng: float, lats: Sequence[float], lngs: Sequence[float]) -> List[float]:
+    """Distanze in km da un punto di riferimento per colonne di latitudini/longitudini."""
+    if np is None:
+        return [haversine_km(ref_lat, ref_lng, la, ln) for la, ln in zip(lats, lngs)]
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lng = np.radians(np.asarray(lngs, dtype=np.float64))
+    ref_lat_rad = math.radians(ref_lat)
+    a = np.sin((lat - ref_lat_rad) / 2) ** 2 + math.cos(ref_lat_rad) * np.cos(lat) * np.sin((lng - math.radians(ref_lng)) / 2) ** 2
+    return (EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).tolist()
+
+
+def filter_by_distance(results: List[Dict[str, Any]], reference: Dict[str, float], max_km: float) -> List[Dict[str, Any]]:
+    """Mantiene i risultati entro `max_km` dal riferimento; quelli senza coordinate restano."""
+    located: List[int] = []
+    lats = array("d")
+    lngs = array("d")
+    for i, result in enumerate(results):
+        coords = (result.get("geometry") or {}).get("location") or {}
+        if coords.get("lat") and coords.get("lng"):
+            located.append(i)
+            lats.append(float(coords["lat"]))
+            lngs.append(float(coords["lng"]))
+
+    too_far = set()
+    for i, distance in zip(located, distances_km(reference["lat"], reference["lng"], lats, lngs)):
+        if distance > max_km:
+            too_far.add(i)
+            logger.info(f"Filtrato risultato '{results[i].get('name')}' - distanza: {distance:.1f}km")
+    return [r for i, r in enumerate(results) if i not in too_far]
+
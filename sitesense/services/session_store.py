@@ -0,0 +1,190 @@
+"""Stato delle conversazioni per sessione.
+
+Ogni conversazione (identificata da un cookie) ha il proprio stato:
+modalità chat/programma, località corrente, HTML completo della pagina e
+istanza del chatbot (Chatter/ProgramService). Lo store è in memoria per
+worker, con eviction LRU, scadenza per inattività (TTL) e un tetto alla
+memoria occupata dall'HTML salvato.
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from ..config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE_NAME = "sitesense_session"
+
+
+class ConversationState:
+    """Stato di una singola conversazione con il concierge."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        # Store che contiene la sessione (None dopo l'eviction) e ultima dimensione comunicata
+        self._store: Optional["SessionStore"] = None
+        self._size = 0
+        self.chatMode = False
+        self.programMode = False
+        self.location: Optional[str] = None
+        self._chatBot = None
+        self._last_complete_html = ""
+        # Riassunto della pagina per il chatbot (context_compactor) e chiave della pagina da cui deriva
+        self._chat_context = ""
+        self.chat_context_key: Optional[str] = None
+        # True se l'ultima generazione del contenuto è fallita (anche dopo aver inviato dei chunk)
+        self.content_failed = False
+        self.created_at = time.monotonic()
+        self.last_access = self.created_at
+        # Serializza le richieste concorrenti della stessa conversazione
+        self.lock = asyncio.Lock()
+
+    # Pagina, riassunto e chatbot sono gli unici campi che pesano: ogni assegnazione
+    # aggiorna il totale dello store senza doverlo ricalcolare su tutte le sessioni.
+    @property
+    def last_complete_html(self) -> str:
+        return self._last_complete_html
+
+    @last_complete_html.setter
+    def last_complete_html(self, value: str) -> None:
+        self._last_complete_html = value
+        self._resized()
+
+    @property
+    def chat_context(self) -> str:
+        return self._chat_context
+
+    @chat_context.setter
+    def chat_context(self, value: str) -> None:
+        self._chat_context = value
+        self._resized()
+
+    @property
+    def chatBot(self):
+        return self._chatBot
+
+    @chatBot.setter
+    def chatBot(self, value) -> None:
+        self._chatBot = value
+        self._resized()
+
+    def _resized(self) -> None:
+        size = self.approx_size()
+        if self._store is not None:
+            self._store._total_bytes += size - self._size
+        self._size = size
+
+    def approx_size(self) -> int:
+        """Stima (in caratteri) della memoria trattenuta dalla sessione."""
+        size = len(self.last_complete_html or "")
+        if self.chat_context is not self.last_complete_html:
+            size += len(self.chat_context or "")
+        bot_html = getattr(self.chatBot, "html", None)
+        if isinstance(bot_html, str) and bot_html is not self.last_complete_html and bot_html is not self.chat_context:
+            size += len(bot_html)
+        return size
+
+
+class SessionStore:
+    """Store LRU con TTL e limite di memoria per gli stati di conversazione."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, ConversationState]" = OrderedDict()
+        # Somma di approx_size() delle sessioni presenti, aggiornata dalle sessioni stesse
+        self._total_bytes = 0
+        self._evictions = 0
+
+    @staticmethod
+    def new_session_id() -> str:
+        return secrets.token_urlsafe(24)
+
+    def get(self, session_id: Optional[str]) -> Optional[ConversationState]:
+        """Restituisce lo stato esistente (aggiornandone l'accesso) oppure None."""
+        if not session_id:
+            return None
+        self._purge_expired()
+        state = self._sessions.get(session_id)
+        if state is None:
+            return None
+        state.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return state
+
+    def get_or_create(self, session_id: Optional[str]) -> ConversationState:
+        """Recupera lo stato della sessione o ne crea uno nuovo (con id nuovo se assente o scaduto)."""
+        state = self.get(session_id)
+        if state is not None:
+            self._enforce_limits(keep=state.session_id)
+            return state
+        new_id = self.new_session_id()
+        state = ConversationState(new_id)
+        self._sessions[new_id] = state
+        state._store = self
+        self._total_bytes += state._size
+        self._enforce_limits(keep=new_id)
+        return state
+
+    def discard(self, session_id: str) -> None:
+        state = self._sessions.pop(session_id, None)
+        if state is not None:
+            self._detach(state)
+
+    def _detach(self, state: ConversationState) -> None:
+        # Una richiesta ancora in corso può modificare la sessione rimossa: non deve toccare il totale
+        self._total_bytes -= state._size
+        state._store = None
+
+    def _purge_expired(self) -> None:
+        # L'ordine è per ultimo accesso: le sessioni scadute sono in testa
+        now = time.monotonic()
+        while self._sessions:
+            state = next(iter(self._sessions.values()))
+            if now - state.last_access <= self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._detach(state)
+            self._evictions += 1
+
+    def _enforce_limits(self, keep: Optional[str] = None) -> None:
+        while len(self._sessions) > self.max_entries:
+            if not self._evict_oldest(keep):
+                break
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            if self._evict_oldest(keep) is None:
+                break
+
+    def _evict_oldest(self, keep: Optional[str]) -> Optional[ConversationState]:
+        for sid in self._sessions:
+            if sid != keep:
+                state = self._sessions.pop(sid)
+                self._detach(state)
+                self._evictions += 1
+                logger.info(f"Sessione '{sid[:8]}…' rimossa dallo store (LRU)")
+                return state
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "approx_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self._evictions,
+        }
+
+
+# Istanza condivisa per il worker corrente
+session_store = SessionStore(
+    max_entries=settings.session_max_entries,
+    ttl_seconds=settings.session_ttl_seconds,
+    max_bytes=settings.session_max_bytes,
+)
@@ -0,0 +1,54 @@
+"""Coalescenza di richieste identiche contemporanee (single-flight).
+
+Se più richieste chiedono la stessa chiave mentre la prima è ancora in corso,
+attendono tutte lo stesso task invece di ripetere il lavoro (es. una chiamata
+Google CSE a quota pagata e il relativo salvataggio nel database).
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from .city_index import fold
+from .photo_cache import slugify
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Un solo task in corso per chiave; gli altri chiamanti ne condividono il risultato."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, "asyncio.Task"] = {}
+        self._started = 0
+        self._shared = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            self._started += 1
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+        else:
+            self._shared += 1
+        # shield: se un chiamante viene annullato il lavoro prosegue per gli altri
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "started": self._started, "shared": self._shared, "inflight": len(self._inflight)}
+
+
+def image_key(kind: str, dish: Optional[str] = None, city: Optional[str] = None) -> tuple:
+    """Chiave di un'immagine ("dish", "city", "city_dish"), condivisa da resolver e prefetch."""
+    return (kind, slugify(dish or ""), " ".join(fold(city or "")))
+
+
+# Istanza condivisa per il worker corrente (immagini di piatti e città)
+image_flights = SingleFlight("images")
@@ -1468,11 +1468,58 @@ function processAndDisplayContent(payload) {
 }
 
 
+// Anteprima del contenuto mentre arriva in streaming: usa lo stesso wrapper .content-response
+// di processAndDisplayContent, che lo sostituisce quando arriva il testo completo.
+function renderStreamingContentPreview(text) {
+    const pageIntro = document.getElementById('page-intro');
+    if (!pageIntro) return;
+    const resultsSection = document.getElementById('results-section');
+    if (resultsSection) {
+        resultsSection.classList.remove('hidden');
+        resultsSection.style.display = '';
+    }
+    const homeHero = document.getElementById('home-hero');
+    if (homeHero) { homeHero.style.display = 'none'; }
+    let preview = document.getElementById('streaming-content-preview');
+    if (!preview) {
+        hideAILoadingAnimation();
+        preview = document.createElement('div');
+        preview.id = 'streaming-content-preview';
+        preview.className = 'w-full max-w-[1400px] ml-6 mr-0 mb-8 order-first';
+        preview.innerHTML = '<div class="content-response"></div>';
+        const cityIntro = pageIntro.querySelector('#city-intro-section');
+        if (cityIntro && cityIntro.parentNode === pageIntro) {
+            pageIntro.insertBefore(preview, cityIntro.nextSibling);
+        } else {
+            pageIntro.insertBefore(preview, pageIntro.firstChild);
+        }
+    }
+    preview.firstElementChild.innerHTML = stripDocumentWrappers(removeMarkdownWrappers(text));
+}
+
+// Record compatti dei risultati (formato JSON di /search): URL immagine e testo sicuro per innerHTML
+function recordPhotoUrl(place) {
+  if (!place) return '';
+  if (place.photo_ref) return `/place_photo?ref=${encodeURIComponent(place.photo_ref)}&v=card`;
+  return place.image || place.foto_url || '';
+}
+
+function escapeRecordText(value) {
+  return String(value == null ? '' : value)
+    .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+    .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
 function processAndDisplayMap(payload) {
     try {
       if (payload && payload.tool_name === 'search_google_maps' && payload.tool_data) {
         // Memorizza i risultati categorizzati per il salvataggio della pagina "Altri suggerimenti"
-        window.lastRankedResults = payload.tool_data;
+        // I payload parziali (una categoria alla volta) si accumulano su quelli della stessa ricerca
+        if (payload.partial && payload.sequence > 0 && window.lastRankedResults && typeof window.lastRankedResults === 'object') {
+          window.lastRankedResults = Object.assign({}, window.lastRankedResults, payload.tool_data);
+        } else {
+          window.lastRankedResults = payload.tool_data;
+        }
       }
     } catch (e) {}
     const mapContainer = document.getElementById('map-container');
@@ -1590,15 +1637,22 @@ function processAndDisplayMap(payload) {
                         `;
                         const categoryResultsContainer = categorySection.querySelector(`[data-category="${category}"]`);
                         (categoryData.results || []).slice(0, 4).forEach(place => {
+                            // Accetta sia i luoghi "storici" (nome/indirizzo/foto_url) sia i record
+                            // compatti del formato JSON (name/address/photo_ref/image)
+                            const photoUrl = recordPhotoUrl(place);
+                            const reviews = place.reviews ? ` · ${place.reviews} recensioni` : '';
                             const card = document.createElement('a');
-                            card.href = `/place_details?place_id=${place.place_id}`;
+                            card.href = `/place_details?place_id=${encodeURIComponent(place.place_id || '')}`;
                             card.className = "flex flex-col bg-white rounded-xl shadow-lg overflow-hidden transition-all hover:shadow-xl duration-300 transform hover:-translate-y-1 w-[300px]";
+                            if (place.place_id) card.dataset.placeId = place.place_id;
+                            if (place.lat != null) card.dataset.lat = place.lat;
+                            if (place.lng != null) card.dataset.lng = place.lng;
                             card.innerHTML = `
-                                ${place.foto_url ? `<div class="w-full bg-center bg-no-repeat aspect-[4/3] bg-cover" style='background-image: url("${place.foto_url}");'></div>` : '<div class="w-full bg-slate-200 aspect-[4/3] flex items-center justify-center"><span class="material-icons text-slate-400 text-4xl">place</span></div>'}
+                                ${photoUrl ? `<div class="w-full bg-center bg-no-repeat aspect-[4/3] bg-cover" style='background-image: url("${escapeRecordText(photoUrl)}");'></div>` : '<div class="w-full bg-slate-200 aspect-[4/3] flex items-center justify-center"><span class="material-icons text-slate-400 text-4xl">place</span></div>'}
                                 <div class="p-5 flex flex-col flex-grow">
-                                  <h4 class="text-slate-800 text-lg font-semibold leading-snug">${place.nome || 'Nome non disponibile'}</h4>
-                                  <p class="text-slate-600 text-sm font-normal leading-normal mt-1 flex-grow">${place.indirizzo || 'Indirizzo non disponibile'}</p>
-                                  <p class="text-slate-500 text-xs font-normal leading-normal mt-1">Valutazione: ${place.valutazione || 'N/A'}</p>
+                                  <h4 class="text-slate-800 text-lg font-semibold leading-snug">${escapeRecordText(place.name || place.nome || 'Nome non disponibile')}</h4>
+                                  <p class="text-slate-600 text-sm font-normal leading-normal mt-1 flex-grow">${escapeRecordText(place.address || place.indirizzo || 'Indirizzo non disponibile')}</p>
+                                  <p class="text-slate-500 text-xs font-normal leading-normal mt-1">Valutazione: ${escapeRecordText(place.rating || place.valutazione || 'N/A')}${escapeRecordText(reviews)}</p>
                                 </div>
                             `;
                             // Ripristino appendChild per mostrare i risultati
@@ -1697,8 +1751,9 @@ function processAndDisplayMap(payload) {
             } catch (e) {}
             try { attachSaveItineraryHandlers(); } catch (e) {}
             // Autosalvataggio cache città: salva una volta per sessione dopo il render live
+            // (con i payload parziali solo all'arrivo dell'ultimo, quando i risultati sono completi)
             try {
-              if (!window.usedCityCacheFallback) {
+              if (!window.usedCityCacheFallback && (!payload.partial || payload.final)) {
                 maybeAutoSaveCityCache('live');
               }
             } catch (e) {}
@@ -2562,6 +2617,8 @@ searchFormEl.addEventListener('submit', async (event) => {
 
   // Flag per evitare contenuti duplicati durante questa ricerca
   let contentInsertedForThisSearch = false;
+  // Testo del contenuto ricevuto finora in streaming (anteprima prima del content_payload)
+  let streamedContentText = '';
   
   // DEBUG: Stato iniziale della località
   console.log('🔍 DEBUG - Stato iniziale currentLocation:', currentLocation);
@@ -2808,6 +2865,10 @@ searchFormEl.addEventListener('submit', async (event) => {
                 console.log('📍 Località impostata dal backend:', currentLocation);
               }
             }
+            if (data.content_chunk && !contentInsertedForThisSearch) {
+              streamedContentText += data.content_chunk;
+              renderStreamingContentPreview(streamedContentText);
+            }
             if (data.content_payload && !contentInsertedForThisSearch) {
               processAndDisplayContent(data.content_payload);
               contentInsertedForThisSearch = true;